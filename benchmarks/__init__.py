@@ -0,0 +1 @@
+"""Performance tooling: `python -m benchmarks.transforms` times single operations."""
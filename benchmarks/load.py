@@ -0,0 +1,372 @@
+"""Load harness: concurrent traffic against the whole service.
+
+By default the app from `server.app` is started in-process on a threaded
+Werkzeug server, with a throwaway SQLite database and upload folder. `--url`
+targets a server that is already running instead (e.g. gunicorn with the
+production worker settings), which is what to use for sizing workers.
+
+Every virtual client signs up its own user and uploads a few seed images,
+then sends requests drawn from a weighted mix until the duration or request
+count runs out:
+
+    python -m benchmarks.load --concurrency 16 --duration 60
+    python -m benchmarks.load --mix list=50,download=30,transform=20
+    python -m benchmarks.load --url http://127.0.0.1:8000 --replay traffic.jsonl
+
+A replay file has one request per line, sent in order (each client starts at
+a different offset and wraps around):
+
+    {"method": "GET", "path": "/api/images/?limit=20"}
+    {"method": "POST", "path": "/api/images/{image_id}/transform",
+     "json": {"transformations": [{"type": "flip"}]}}
+    {"method": "POST", "path": "/api/images/", "upload": true}
+
+`{image_id}` and `{filename}` are filled in from the client's own images.
+Requests are authenticated unless they set `"auth": false`, and may set a
+`"name"` to group them by in the report. Lines without a method and path
+are skipped (and counted).
+
+The report gives requests per second, latency percentiles, error rates and
+status codes overall and per endpoint.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+from PIL import Image as PILImage
+
+from benchmarks.transforms import percentile
+
+DEFAULT_MIX = {"list": 30, "download": 25, "transform": 20, "upload": 10, "login": 10, "render": 5}
+MAX_IMAGES_PER_CLIENT = 50
+TRANSFORMS = (
+    [{"type": "flip"}],
+    [{"type": "filter", "options": {"filter": "grayscale"}}],
+    [{"type": "rotate", "options": {"angle": 90}}, {"type": "compress", "options": {"quality": 70}}],
+    [{"type": "crop", "options": {"left": 10, "top": 10, "right": 300, "bottom": 200}}],
+)
+
+
+def sample_jpeg(size=(640, 480)):
+    """A small, unique photo-like JPEG, so uploads are never deduplicated."""
+    image = PILImage.merge("RGB", [
+        PILImage.linear_gradient("L").resize(size),
+        PILImage.effect_noise(size, random.randint(20, 80)),
+        PILImage.radial_gradient("L").resize(size),
+    ])
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def multipart(field, filename, data, content_type="image/jpeg"):
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        f"Content-Type: {content_type}\r\n\r\n".encode(),
+        data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = defaultdict(Counter)
+
+    def record(self, name, status, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            self.statuses[name][status] += 1
+            if status is None or status >= 400:
+                self.errors[name] += 1
+
+
+class Client:
+    """One virtual user with a keep-alive connection."""
+
+    def __init__(self, base_url, results, index):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.results = results
+        self.conn = None
+        self.email = f"load-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = "load-test-password"
+        self.token = None
+        self.images = []  # (id, filename)
+        self.offset = index
+
+    def request(self, name, method, path, body=None, headers=None, auth=True, record=True):
+        headers = dict(headers or {})
+        if auth and self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        status, data = None, b""
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            status, data = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            if self.conn:
+                self.conn.close()
+            self.conn = None
+        if record:
+            self.results.record(name, status, time.perf_counter() - start)
+        return status, data
+
+    def _json(self, data):
+        try:
+            return json.loads(data)
+        except ValueError:
+            return {}
+
+    def setup(self, seed_images):
+        status, data = self.request("signup", "POST", "/api/auth/signup", {
+            "email": self.email, "username": self.email.split("@")[0], "password": self.password,
+        }, auth=False, record=False)
+        if status != 201:
+            raise RuntimeError(f"Signup failed with {status}: {data[:200]!r}")
+        self.token = self._json(data)["access_token"]
+        for _ in range(seed_images):
+            self.upload(record=False)
+
+    def upload(self, record=True):
+        body, content_type = multipart("image", f"{uuid.uuid4().hex[:8]}.jpg", sample_jpeg())
+        status, data = self.request("upload", "POST", "/api/images/", body, {"Content-Type": content_type}, record=record)
+        if status == 201:
+            image = self._json(data)
+            self.images.append((image["id"], image["filename"]))
+            del self.images[:-MAX_IMAGES_PER_CLIENT]
+
+    def pick_image(self):
+        return random.choice(self.images) if self.images else (None, None)
+
+    # Weighted scenarios
+
+    def list(self):
+        self.request("list", "GET", "/api/images/?limit=20")
+
+    def download(self):
+        _, filename = self.pick_image()
+        self.request("download", "GET", f"/api/images/download/{filename}")
+
+    def transform(self):
+        image_id, _ = self.pick_image()
+        transformations = list(random.choice(TRANSFORMS))
+        # A random size makes some requests miss the transform cache
+        transformations.append({"type": "resize", "options": {"width": random.randint(100, 600), "height": 300}})
+        self.request("transform", "POST", f"/api/images/{image_id}/transform", {"transformations": transformations})
+
+    def login(self):
+        self.request("login", "POST", "/api/auth/login", {"email": self.email, "password": self.password}, auth=False)
+
+    def render(self):
+        image_id, _ = self.pick_image()
+        self.request("render", "GET", f"/api/images/{image_id}/render?w={random.randint(100, 600)}&fmt=webp")
+
+    def replay(self, entries):
+        entry = entries[self.offset % len(entries)]
+        self.offset += 1
+        if entry.get("upload"):
+            return self.upload()
+        image_id, filename = self.pick_image()
+        path = entry["path"].replace("{image_id}", str(image_id)).replace("{filename}", str(filename))
+        name = entry.get("name") or f"{entry['method']} {entry['path'].split('?')[0]}"
+        self.request(name, entry["method"], path, entry.get("json"), entry.get("headers"), entry.get("auth", True))
+
+
+def load_replay(path):
+    """Requests from a JSONL file, plus how many lines were skipped."""
+    entries, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "method" in entry and "path" in entry:
+                entries.append(entry)
+            elif entry.get("upload"):
+                entries.append(dict(entry, method="POST", path="/api/images/"))
+            else:
+                skipped += 1
+    return entries, skipped
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def start_local_server(root, host="127.0.0.1"):
+    """Start the app on a free port, backed by SQLite under `root`."""
+    import logging
+    from werkzeug.serving import make_server
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(root, 'load.db')}"
+    os.environ["UPLOAD_FOLDER"] = os.path.join(root, "uploads")
+    from server.app import app
+    from server.extensions import db
+
+    with app.app_context():
+        db.create_all()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server(host, 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def run(base_url, concurrency, duration=None, total=None, mix=None, replay=None, seed_images=2):
+    results = Results()
+    clients = [Client(base_url, results, i) for i in range(concurrency)]
+    for client in clients:
+        client.setup(seed_images)
+
+    names = list((mix or DEFAULT_MIX).keys())
+    weights = [(mix or DEFAULT_MIX)[n] for n in names]
+    lock = threading.Lock()
+    remaining = [total]
+    deadline = time.monotonic() + duration if duration else None
+
+    def take():
+        with lock:
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+        return deadline is None or time.monotonic() < deadline
+
+    def work(client):
+        while take():
+            if replay:
+                client.replay(replay)
+            else:
+                getattr(client, random.choices(names, weights)[0])()
+
+    threads = [threading.Thread(target=work, args=(c,)) for c in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    def stats(latencies, errors, statuses):
+        return {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "error_rate": round(errors / len(latencies), 4) if latencies else 0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2),
+            "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+        }
+
+    endpoints = {
+        name: stats(latencies, results.errors[name], results.statuses[name])
+        for name, latencies in sorted(results.latencies.items())
+    }
+    everything = [t for latencies in results.latencies.values() for t in latencies]
+    if not everything:
+        return {"elapsed_s": round(elapsed, 2), "total": None, "endpoints": {}}
+    all_statuses = sum(results.statuses.values(), Counter())
+    total = stats(everything, sum(results.errors.values()), all_statuses)
+    return {"elapsed_s": round(elapsed, 2), "total": total, "endpoints": endpoints}
+
+
+def print_report(summary):
+    header = f"{'endpoint':<40}{'reqs':>8}{'rps':>9}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  statuses"
+    print(header)
+    print("-" * len(header))
+    rows = list(summary["endpoints"].items())
+    if summary["total"]:
+        rows.append(("TOTAL", summary["total"]))
+    for name, s in rows:
+        statuses = " ".join(f"{k}:{v}" for k, v in s["statuses"].items())
+        print(
+            f"{name[:39]:<40}{s['requests']:>8}{s['rps']:>9.1f}{s['error_rate'] * 100:>6.1f}%"
+            f"{s['p50_ms']:>9.1f}{s['p90_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}  {statuses}"
+        )
+    print(f"Elapsed: {summary['elapsed_s']}s (latencies in ms)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="running server to target; default starts one in-process on SQLite")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual clients")
+    parser.add_argument("--duration", type=float, help="seconds to run (default 30 unless --requests)")
+    parser.add_argument("--requests", type=int, help="total requests to send")
+    parser.add_argument("--mix", type=parse_mix, help="weights, e.g. list=30,transform=20 (default: %s)" % ",".join(
+        f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    parser.add_argument("--replay", help="JSONL file of requests to send instead of the mix")
+    parser.add_argument("--seed-images", type=int, default=2, help="images each client uploads before starting")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+    if args.duration is None and args.requests is None:
+        args.duration = 30
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    replay = None
+    if args.replay:
+        replay, skipped = load_replay(args.replay)
+        if skipped:
+            print(f"Skipped {skipped} lines without a method and path", file=sys.stderr)
+        if not replay:
+            print(f"No requests to replay in {args.replay}", file=sys.stderr)
+            return 1
+
+    root = server = None
+    base_url = args.url
+    if not base_url:
+        root = tempfile.mkdtemp(prefix="pikcha-load-")
+        server, base_url = start_local_server(root)
+    try:
+        results, elapsed = run(
+            base_url, args.concurrency, args.duration, args.requests, args.mix, replay, args.seed_images,
+        )
+    finally:
+        if server:
+            server.shutdown()
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+
+    summary = summarize(results, elapsed)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(summary, target=args.url or "local", concurrency=args.concurrency), f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
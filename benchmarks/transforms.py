@@ -0,0 +1,315 @@
+"""Micro-benchmarks for every transformation, on synthetic images.
+
+Each case is one transformation planned and run the way the transform
+endpoint does it (`plan_transformations`, `execute_plan`), followed by
+encoding to memory with the plan's output options. `compress` and `format`
+only change the encoding. Decoding is left out, so the same source can be
+reused across repeats. Background removal uses a cheap stand-in for the
+rembg model by default, so it measures our own overhead; pass
+`--real-remove-bg` to time the model too.
+
+    python -m benchmarks.transforms                       # everything
+    python -m benchmarks.transforms --sizes 1,12 --ops resize,sepia --modes RGB
+    python -m benchmarks.transforms --save                # write the baseline
+    python -m benchmarks.transforms --threshold 0.25      # compare with it
+
+The comparison fails (exit status 1) when a case's p50 is more than
+`threshold` slower than in the baseline. It also fails when a case's peak
+memory grows by that much, for cases whose baseline peak is at least
+`MEMORY_FLOOR_MB`. Baselines only mean something on the machine that
+recorded them.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import io
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import PIL
+from PIL import Image as PILImage
+
+from server.extensions import background_remover
+from server.utils.encoders import encode
+from server.utils.filters import FILTERS
+from server.utils.pipeline import execute_plan, plan_transformations
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = (1, 12, 48)
+DEFAULT_MODES = ("RGB", "RGBA", "P")
+MEMORY_FLOOR_MB = 16
+
+
+def _operations():
+    ops = {
+        "resize": lambda w, h: [{"type": "resize", "options": {"width": w // 2, "height": h // 2}}],
+        "crop": lambda w, h: [{"type": "crop", "options": {
+            "left": w // 4, "top": h // 4, "right": w * 3 // 4, "bottom": h * 3 // 4,
+        }}],
+        "rotate_90": lambda w, h: [{"type": "rotate", "options": {"angle": 90}}],
+        "rotate_45": lambda w, h: [{"type": "rotate", "options": {"angle": 45}}],
+        "watermark": lambda w, h: [{"type": "watermark", "options": {"text": "Pik-Cha"}}],
+        "flip": lambda w, h: [{"type": "flip"}],
+        "mirror": lambda w, h: [{"type": "mirror"}],
+        "compress": lambda w, h: [{"type": "compress", "options": {"quality": 60}}],
+        "format": lambda w, h: [{"type": "format", "options": {"format": "WEBP"}}],
+        "remove_bg": lambda w, h: [{"type": "remove_bg"}],
+    }
+    for name in FILTERS:
+        ops[name] = lambda w, h, name=name: [{"type": "filter", "options": {"filter": name}}]
+    return ops
+
+
+OPERATIONS = _operations()
+
+
+def dimensions(megapixels):
+    """4:3 dimensions with about `megapixels` million pixels."""
+    width = max(1, round(math.sqrt(megapixels * 1_000_000 * 4 / 3)))
+    return width, max(1, round(width * 3 / 4))
+
+
+def synthetic_image(megapixels, mode):
+    """Smooth gradients plus noise, so encoders and filters get realistic work."""
+    size = dimensions(megapixels)
+    gradient = PILImage.linear_gradient("L").resize(size)
+    radial = PILImage.radial_gradient("L").resize(size)
+    noise = PILImage.effect_noise(size, 48)
+    image = PILImage.merge("RGB", (gradient, noise, radial))
+    if mode == "RGBA":
+        image.putalpha(radial)
+    elif mode == "P":
+        image = image.quantize(256)
+    elif mode != "RGB":
+        image = image.convert(mode)
+    return image
+
+
+def _stub_remove(image, model_name=None):
+    # Same output shape as the model: RGBA with a computed alpha mask.
+    rgba = image.convert("RGBA")
+    rgba.putalpha(image.convert("L").point(lambda v: 255 if v > 96 else 0))
+    return rgba
+
+
+@contextmanager
+def stub_background_removal():
+    background_remover.remove = _stub_remove
+    background_remover.remove_many = lambda images, model_name=None: [_stub_remove(i) for i in images]
+    try:
+        yield
+    finally:
+        del background_remover.remove
+        del background_remover.remove_many
+
+
+def _malloc_trim():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c")).malloc_trim
+    except (AttributeError, OSError, TypeError):  # not glibc
+        return None
+
+
+malloc_trim = _malloc_trim()
+
+
+def release_memory():
+    """Hand freed image memory back to the OS, so RSS growth during the next
+    run reflects what that run allocates."""
+    PILImage.core.clear_cache()
+    if malloc_trim:
+        malloc_trim(0)
+
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakMemory:
+    """Highest resident set size above the starting point while active,
+    sampled every `interval` seconds. Reports None where /proc is missing."""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes() - self._start)
+
+    def __enter__(self):
+        try:
+            self._start = _rss_bytes()
+        except (OSError, ValueError):
+            return self
+        self.peak = 0
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.peak is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss_bytes() - self._start)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_case(image, transformations, repeat, warmup=1):
+    plan = plan_transformations(transformations, image.size, mode=image.mode)
+    timings = []
+    peak = None
+    for i in range(warmup + repeat):
+        source = image.copy()  # some steps draw in place
+        release_memory()
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            result = execute_plan(source, plan)
+            encode(result, io.BytesIO(), plan.output)
+            elapsed = time.perf_counter() - start
+        del source, result
+        if i >= warmup:
+            timings.append(elapsed)
+            if memory.peak is not None:
+                peak = max(peak or 0, memory.peak)
+
+    megapixels = image.size[0] * image.size[1] / 1_000_000
+    p50 = percentile(timings, 0.5)
+    return {
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "mpx_per_s": round(megapixels / p50, 2) if p50 else None,
+        "peak_mb": round(peak / 2**20, 1) if peak is not None else None,
+        "runs": len(timings),
+    }
+
+
+def case_name(op, megapixels, mode):
+    return f"{op}/{megapixels:g}MP/{mode}"
+
+
+def run_suite(ops, sizes, modes, repeat, real_remove_bg=False, log=None):
+    results = {}
+    with nullcontext() if real_remove_bg else stub_background_removal():
+        for megapixels in sizes:
+            for mode in modes:
+                image = synthetic_image(megapixels, mode)
+                for op in ops:
+                    name = case_name(op, megapixels, mode)
+                    try:
+                        results[name] = run_case(image, OPERATIONS[op](*image.size), repeat)
+                    except Exception as e:
+                        results[name] = {"error": f"{type(e).__name__}: {e}"}
+                    if log:
+                        log(format_row(name, results[name]))
+                del image
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Cases slower (or hungrier) than the baseline by more than `threshold`.
+    Returns a list of (case, metric, baseline value, current value)."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or "error" in previous:
+            continue
+        if "error" in current:
+            regressions.append((name, "error", None, current["error"]))
+            continue
+        if current["p50_ms"] > previous["p50_ms"] * (1 + threshold):
+            regressions.append((name, "p50_ms", previous["p50_ms"], current["p50_ms"]))
+        old_peak, new_peak = previous.get("peak_mb"), current.get("peak_mb")
+        if old_peak and new_peak and old_peak >= MEMORY_FLOOR_MB and new_peak > old_peak * (1 + threshold):
+            regressions.append((name, "peak_mb", old_peak, new_peak))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def format_row(name, result):
+    if "error" in result:
+        return f"{name:<28} ERROR {result['error']}"
+    peak = "-" if result["peak_mb"] is None else f"{result['peak_mb']:.1f}"
+    return (
+        f"{name:<28} p50 {result['p50_ms']:>10.2f} ms  p95 {result['p95_ms']:>10.2f} ms  "
+        f"{result['mpx_per_s'] or 0:>9.1f} MP/s  peak {peak:>8} MB"
+    )
+
+
+def _csv(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ops", type=_csv, default=list(OPERATIONS), help="comma-separated, default all")
+    parser.add_argument("--sizes", type=lambda v: [float(s) for s in _csv(v)], default=list(DEFAULT_SIZES),
+                        help="megapixels, default 1,12,48")
+    parser.add_argument("--modes", type=_csv, default=list(DEFAULT_MODES), help="default RGB,RGBA,P")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", help="also write this run's results to a JSON file")
+    parser.add_argument("--real-remove-bg", action="store_true", help="use the rembg model instead of a stub")
+    args = parser.parse_args(argv)
+    unknown = set(args.ops) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown ops: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_suite(args.ops, args.sizes, args.modes, args.repeat, args.real_remove_bg, log=print)
+    report = {"environment": environment(), "threshold": args.threshold, "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print("Warning: the baseline was recorded in a different environment", file=sys.stderr)
+    regressions = compare(results, baseline["results"], args.threshold)
+    for name, metric, before, after in regressions:
+        print(f"REGRESSION {name} {metric}: {before} -> {after}")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ import * as HeroIcons from '@heroicons/react/24/outline';
 import toast from 'react-hot-toast';
 import { API_BASE_URL } from '../config';
 import axios from 'axios';
+import { fetchAllImages } from '../services/imageService';
 
 const Dashboard = () => {
   const { user } = useAuth();
@@ -28,16 +29,17 @@ const Dashboard = () => {
         toast.error("You must be logged in to view images");
         return;
       }
-      const response = await axios.get(`${API_BASE_URL}/api/images/`, {
+      const images = await fetchAllImages((params) => axios.get(`${API_BASE_URL}/api/images/`, {
+        params,
         headers: {
           Authorization: `Bearer ${token}`,
         },
-      });
-      setRecentImages(response.data.slice(0, 6)); // Get 6 most recent images
+      }));
+      setRecentImages(images.slice(0, 6)); // Get 6 most recent images
       setStats({
-        totalImages: response.data.length,
-        transformations: response.data.reduce((acc, img) => acc + (img.transformations || 0), 0),
-        storageUsed: `${(response.data.reduce((acc, img) => acc + (img.size || 0), 0) / (1024 * 1024)).toFixed(2)} MB`,
+        totalImages: images.length,
+        transformations: images.reduce((acc, img) => acc + (img.transformations || 0), 0),
+        storageUsed: `${(images.reduce((acc, img) => acc + (img.size || 0), 0) / (1024 * 1024)).toFixed(2)} MB`,
       });
     } catch (error) {
       console.error("Error fetching images:", error);
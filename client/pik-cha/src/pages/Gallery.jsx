@@ -4,6 +4,7 @@ import * as HeroIcons from '@heroicons/react/24/outline';
 import toast from 'react-hot-toast';
 import { API_BASE_URL } from '../config';
 import axios from 'axios';
+import { fetchAllImages } from '../services/imageService';
 
 const Gallery = () => {
   const [images, setImages] = useState([]);
@@ -22,14 +23,15 @@ const Gallery = () => {
         return;
       }
 
-      const response = await axios.get(`${API_BASE_URL}/api/images/`, {
+      const allImages = await fetchAllImages((params) => axios.get(`${API_BASE_URL}/api/images/`, {
+        params,
         headers: {
           Authorization: `Bearer ${token}`,
         },
-      });
+      }));
 
-      console.log('Received images:', response.data);
-      setImages(response.data); // Ensure transformed_url is included in the response
+      console.log('Received images:', allImages);
+      setImages(allImages); // Ensure transformed_url is included in the response
     } catch (error) {
       console.error('Error fetching images:', error);
       toast.error('Failed to load images');
@@ -24,6 +24,18 @@ export const transformImage = async (imageId, transformations) => {
   return mockTransformResponse;
 };
 
+// GET /api/images/ returns one page at a time; follow X-Next-Cursor to the end.
+export const fetchAllImages = async (getPage) => {
+  const images = [];
+  let cursor = null;
+  do {
+    const response = await getPage(cursor ? { limit: 200, cursor } : { limit: 200 });
+    images.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return images;
+};
+
 export const imageService = {
   async uploadImage(file) {
     const formData = new FormData();
@@ -43,8 +55,7 @@ export const imageService = {
 
   async listImages() {
     try {
-      const response = await axios.get('/images');
-      return response.data;
+      return await fetchAllImages((params) => axios.get('/images', { params }));
     } catch (error) {
       throw error.response?.data || { error: 'Failed to fetch images' };
     }
@@ -4,10 +4,10 @@ from server.routes.auth import SignupResource, LoginResource, MeResource, auth_b
 from server.routes.image import UploadImageResource, ListImagesResource, TransformImageResource, DownloadImageResource, ImageDetailResource, image_bp
 from flask_jwt_extended import JWTManager
 import os
-from flask import send_from_directory, current_app
+from server.utils.serving import send_upload
 
-# Create app instance
-app = create_app()
+# Create app instance ("development", "testing" or "production")
+app = create_app(os.getenv("FLASK_ENV", "development"))
 
 # Configure JWT
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'pikcha-jwt-secret-key-2024')
@@ -20,7 +20,8 @@ app.register_blueprint(user_bp, url_prefix="/api/users")
 
 @app.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(current_app.config["UPLOAD_FOLDER"], filename)
+    return send_upload(filename, negotiate_format=True)
 
 if __name__ == '__main__':
+    # Development server only; production runs server.wsgi under gunicorn
     app.run(debug=True)
@@ -6,7 +6,9 @@ from flask_restful import Api
 from sqlalchemy import MetaData
 from sqlalchemy.orm import declarative_base
 from dotenv import load_dotenv
-from server.extensions import db, migrate, jwt
+from server.extensions import db, migrate, jwt, transform_cache, job_queue, background_remover, user_cache, pixel_budget, metrics
+from server.utils.ingest import IngestRequest
+from server.utils.log import configure_logging
 
 
 # Load .env variables
@@ -31,8 +33,44 @@ class Config:
     SESSION_TYPE = "filesystem"
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
+    UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(os.getcwd(), 'uploads'))
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # Seconds; other workers see user changes after this
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+    UPLOAD_OFFLOAD = os.getenv("UPLOAD_OFFLOAD")  # "x-accel-redirect" or "x-sendfile" behind a proxy
+    UPLOAD_ACCEL_PREFIX = os.getenv("UPLOAD_ACCEL_PREFIX", "/_uploads/")  # nginx internal location
+    NEGOTIATE_FORMATS = [f for f in os.getenv("NEGOTIATE_FORMATS", "avif,webp").split(",") if f]  # Preferred first; empty disables
+    NEGOTIATE_QUALITY = int(os.getenv("NEGOTIATE_QUALITY", 80))  # For re-encoded JPEG sources
+    UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", 50))  # Files per multi-file upload
+    UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", 200 * 1024 * 1024))  # Whole multi-file request
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))  # Threads verifying multi-file uploads
+    MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 100_000_000))  # Decompression bomb guard
+    RENDER_SIGNING_KEY = os.getenv("RENDER_SIGNING_KEY")  # Unset disables signed render URLs
+    RENDER_MAX_AGE = int(os.getenv("RENDER_MAX_AGE", 86400))
+    VARIANTS_ON_UPLOAD = os.getenv("VARIANTS_ON_UPLOAD", "false").lower() == "true"  # Else built on first request
+    TRANSFORM_CACHE_FOLDER = None  # Defaults to <UPLOAD_FOLDER>/cache
+    TRANSFORM_CACHE_MAX_BYTES = int(os.getenv("TRANSFORM_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+    TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", 2))  # Processes for async transforms
+    TRANSFORM_QUEUE_SIZE = int(os.getenv("TRANSFORM_QUEUE_SIZE", 32))  # Pending jobs before 503
+    TRANSFORM_MEMORY_BUDGET = int(os.getenv("TRANSFORM_MEMORY_BUDGET", 256 * 1024 * 1024))  # In-memory peak that triggers strip mode, when strips would peak lower; not a bound; 0 = never
+    ADMISSION_BUDGET_BYTES = int(os.getenv("ADMISSION_BUDGET_BYTES", 1024 * 1024 * 1024))  # Decoded pixels in flight; 0 = unlimited
+    ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", 10))  # Seconds to wait for room before 503
+    ADMISSION_STATE_DIR = os.getenv("ADMISSION_STATE_DIR")  # Share the budget across workers on this host
+    BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 0)) or None  # Batch transform processes per web worker; None = CPU count / WEB_WORKERS
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+    REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+    REMBG_BATCH_SIZE = int(os.getenv("REMBG_BATCH_SIZE", 8))  # Batch images per background removal run
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", 0)) or os.cpu_count() or 1  # Gunicorn worker processes
+    WEB_THREADS = int(os.getenv("WEB_THREADS", 4))  # Request threads per worker
+    WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", 120))  # Seconds before a stuck worker is restarted
+    WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", 1000))  # Recycle workers to shed heap fragmentation; 0 = never
+    WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", 100))  # So workers don't all restart at once
+    PRELOAD_REMBG = os.getenv("PRELOAD_REMBG", "false").lower() == "true"  # Import rembg in the master, build sessions at warmup
+    WARMUP = os.getenv("WARMUP", "true").lower() == "true"  # Run every op once in each worker before serving
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))  # Share of DEBUG/INFO records kept; warnings always are
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"  # Serves /metrics
+    SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"  # Per-stage Server-Timing header
 
 
 class DevelopmentConfig(Config):
@@ -47,6 +85,7 @@ class TestingConfig(Config):
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))  # Per-request info lines add up under load
 
 
 # Mapping
@@ -61,15 +100,24 @@ config_map = {
 def create_app(config_name="development"):
     app = Flask(__name__)
     app.config.from_object(config_map[config_name])
+    app.request_class = IngestRequest  # Stream uploads straight into UPLOAD_FOLDER
 
     # Ensure upload folder exists
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+    configure_logging(app)
+
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
-    CORS(app, supports_credentials=True)
+    transform_cache.init_app(app)
+    job_queue.init_app(app)
+    background_remover.init_app(app)
+    user_cache.init_app(app)
+    pixel_budget.init_app(app)
+    metrics.init_app(app)
+    CORS(app, supports_credentials=True, expose_headers=["X-Next-Cursor", "Link"])  # Let browsers page the listing
     api.init_app(app)
     app.secret_key = app.config["SECRET_KEY"]
     app.json.compact = False
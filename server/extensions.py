@@ -1,7 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
+from server.utils.admission import PixelBudget
+from server.utils.background import BackgroundRemover
+from server.utils.jobs import JobQueue
+from server.utils.metrics import Metrics
+from server.utils.transform_cache import TransformCache
+from server.utils.user_cache import UserCache
 
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
+transform_cache = TransformCache()
+job_queue = JobQueue()
+background_remover = BackgroundRemover()
+user_cache = UserCache()
+pixel_budget = PixelBudget()
+metrics = Metrics()
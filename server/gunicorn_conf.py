@@ -0,0 +1,36 @@
+"""Gunicorn settings, read from `Config` so they follow the same env vars.
+
+Workers are recycled after `WEB_MAX_REQUESTS` requests (plus jitter), which
+hands memory fragmented by large Pillow allocations back to the OS. Each new
+worker runs `server.utils.warmup` before it accepts connections.
+"""
+import os
+
+from server.config import Config
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+preload_app = True
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = 30
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS_JITTER
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    from server.extensions import db
+    from server.wsgi import app
+
+    # Connections opened in the master must not be shared with workers
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from server.utils.warmup import warmup
+    from server.wsgi import app
+
+    if app.config.get("WARMUP"):
+        warmup(app, remove_bg=app.config.get("PRELOAD_REMBG"))
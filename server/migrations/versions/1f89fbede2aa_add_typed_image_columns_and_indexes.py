@@ -0,0 +1,137 @@
+"""Add typed image columns and listing indexes
+
+Revision ID: 1f89fbede2aa
+Revises: 51228aef408b
+Create Date: 2026-10-18 15:20:07.431825
+
+"""
+import os
+
+from alembic import op
+from flask import current_app
+from PIL import Image as PILImage
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f89fbede2aa'
+down_revision = '51228aef408b'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# Metadata keys that each record one applied transformation
+TRANSFORMATION_KEYS = (
+    "width", "height", "crop_box", "rotation_angle",
+    "watermark", "flipped", "mirrored", "compressed_quality",
+    "format", "filter", "background_removed",
+)
+
+
+def _from_file(path):
+    """Dimensions, format and size of a stored file, or None if it is gone."""
+    try:
+        with PILImage.open(path) as im:
+            return {"width": im.width, "height": im.height, "format": im.format, "file_size": os.path.getsize(path)}
+    except (OSError, PILImage.DecompressionBombError):
+        return None
+
+
+def _typed_values(row, folder):
+    metadata = row.image_metadata or {}
+    if row.transformed_url is None:
+        # "format" here is the upload's own format, not a transformation
+        width, height = metadata.get("size") or (None, None)
+        fmt = metadata.get("format")
+        file_size = metadata.get("file_size")
+        count = 0
+    else:
+        # Transformed rows inherit the original's metadata; of the sizes
+        # only a resize's is their own, and the file extension is the format
+        width, height = metadata.get("width"), metadata.get("height")
+        ext = os.path.splitext(row.filename)[1].lstrip(".").upper()
+        fmt = "JPEG" if ext == "JPG" else ext
+        file_size = None
+        count = metadata.get("transformation_count")
+        if count is None:
+            count = sum(1 for key in metadata if key in TRANSFORMATION_KEYS)
+    values = {
+        "width": width,
+        "height": height,
+        "format": str(fmt).upper()[:16] if fmt else None,
+        "file_size": file_size,
+        "transformation_count": count,
+    }
+    # The stored file is the truth; metadata is only a fallback
+    values.update(_from_file(os.path.join(folder, row.filename)) or {})
+    return values
+
+
+def _backfill():
+    """Read values from each stored file (falling back to image_metadata),
+    one keyset batch at a time."""
+    conn = op.get_bind()
+    folder = current_app.config["UPLOAD_FOLDER"]
+    images = sa.table(
+        'images',
+        sa.column('id', sa.String()),
+        sa.column('filename', sa.String()),
+        sa.column('transformed_url', sa.String()),
+        sa.column('image_metadata', sa.JSON()),
+        sa.column('width', sa.Integer()),
+        sa.column('height', sa.Integer()),
+        sa.column('format', sa.String()),
+        sa.column('file_size', sa.BigInteger()),
+        sa.column('transformation_count', sa.Integer()),
+    )
+    update = (
+        images.update()
+        .where(images.c.id == sa.bindparam('row_id'))
+        .values(
+            width=sa.bindparam('width'),
+            height=sa.bindparam('height'),
+            format=sa.bindparam('format'),
+            file_size=sa.bindparam('file_size'),
+            transformation_count=sa.bindparam('transformation_count'),
+        )
+    )
+
+    last_id = ''
+    while True:
+        rows = conn.execute(
+            sa.select(images.c.id, images.c.filename, images.c.transformed_url, images.c.image_metadata)
+            .where(images.c.id > last_id)
+            .order_by(images.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(update, [dict(_typed_values(row, folder), row_id=row.id) for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('format', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('file_size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('transformation_count', sa.Integer(), nullable=False, server_default='0'))
+
+    _backfill()
+
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.create_index('ix_images_user_id_created_at', ['user_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_images_blob_sha256'), ['blob_sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_images_blob_sha256'))
+        batch_op.drop_index('ix_images_user_id_created_at')
+        batch_op.drop_column('transformation_count')
+        batch_op.drop_column('file_size')
+        batch_op.drop_column('format')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
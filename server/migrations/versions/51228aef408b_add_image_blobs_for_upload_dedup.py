@@ -0,0 +1,38 @@
+"""Add image_blobs for upload deduplication
+
+Revision ID: 51228aef408b
+Revises: 0fa7850e1a56
+Create Date: 2026-10-18 09:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '51228aef408b'
+down_revision = '0fa7850e1a56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key(batch_op.f('fk_images_blob_sha256_image_blobs'), 'image_blobs', ['blob_sha256'], ['sha256'])
+
+
+def downgrade():
+    with op.batch_alter_table('images', schema=None) as batch_op:
+        batch_op.drop_constraint(batch_op.f('fk_images_blob_sha256_image_blobs'), type_='foreignkey')
+        batch_op.drop_column('blob_sha256')
+
+    op.drop_table('image_blobs')
@@ -0,0 +1,40 @@
+"""Add transform_jobs so any worker can report async job status
+
+Revision ID: 7c2e9d41b8a3
+Revises: 1f89fbede2aa
+Create Date: 2026-10-18 18:02:55.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9d41b8a3'
+down_revision = '1f89fbede2aa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('transform_jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('transform_jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_transform_jobs_owner_id'), ['owner_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transform_jobs_finished_at'), ['finished_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transform_jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_transform_jobs_finished_at'))
+        batch_op.drop_index(batch_op.f('ix_transform_jobs_owner_id'))
+
+    op.drop_table('transform_jobs')
@@ -1,3 +1,5 @@
 # models/__init__.py
 from .user import User
 from .image import Image
+from .blob import ImageBlob
+from .job import TransformJob
@@ -0,0 +1,14 @@
+from server.extensions import db
+from datetime import datetime
+
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)  # Content hash of the stored bytes
+    filename = db.Column(db.String, nullable=False)  # File in UPLOAD_FOLDER holding the bytes
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Image rows pointing here
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ImageBlob {self.sha256[:12]} x{self.ref_count}>"
@@ -7,6 +7,10 @@ def generate_uuid():
 
 class Image(db.Model):
     __tablename__ = 'images'
+    __table_args__ = (
+        # Keyset listing order
+        db.Index('ix_images_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String, primary_key=True, default=generate_uuid)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -15,6 +19,12 @@ class Image(db.Model):
     transformed_url = db.Column(db.String)  # Path to transformed image (if any)
     transformation_type = db.Column(db.String)  # e.g., 'resize', 'crop', etc.
     image_metadata = db.Column(db.JSON)  # e.g., {"width": 300, "height": 200}
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('image_blobs.sha256'), index=True)  # Shared upload bytes (originals only)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(16))  # e.g., 'JPEG', 'PNG'
+    file_size = db.Column(db.BigInteger)  # Bytes on disk
+    transformation_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
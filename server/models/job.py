@@ -0,0 +1,16 @@
+from server.extensions import db
+from datetime import datetime
+
+class TransformJob(db.Model):
+    __tablename__ = 'transform_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    owner_id = db.Column(db.Integer, index=True)  # User polling the job; None for internal work
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done or failed
+    result = db.Column(db.JSON)  # Serialized image row once done
+    error = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return f"<TransformJob {self.id} {self.status}>"
@@ -12,6 +12,7 @@ class User(db.Model):
     is_verified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Delete through server.utils.blobs.delete_image first so blob references are released
     images = db.relationship('Image', backref='user', lazy=True, cascade="all, delete")
 
     def set_password(self, password):
@@ -1,19 +1,34 @@
-from flask import Blueprint, request, send_from_directory, current_app as app
+from flask import Blueprint, Response, g, request, send_file, current_app as app
 from flask_restful import Api, Resource
 from werkzeug.utils import secure_filename
 from PIL import Image as PILImage
-from PIL import UnidentifiedImageError
-from rembg import remove
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
 
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import uuid
 from io import BytesIO
+from urllib.parse import urlencode
 
 from server.config import db
+from server.extensions import transform_cache, job_queue, metrics, pixel_budget
 from server.models.image import Image
-from server.models.user import User
 from server.schemas.image_schema import ImageSchema
-from server.utils.jwt_handler import decode_token
+from server.utils.admission import AdmissionRejected, estimate_plan_bytes
+from server.utils.auth import authenticate, login_required
+from server.utils.blobs import acquire_blob, delete_image, discard_upload, remove_files, sibling_filenames
+from server.utils.encoders import SAVE_FORMATS, mimetype
+from server.utils.ingest import IngestError, validate_upload, verify_upload
+from server.utils.jobs import QueueFull
+from server.utils.pagination import count_transformations, keyset_page, parse_limit
+from server.utils.pipeline import plan_transformations, removes_background, render_plan, render_plans
+from server.utils.render import parse_render_query, sign_params, verify_signature
+from server.utils.serving import IMMUTABLE, REVALIDATE, send_upload
+from server.utils.strips import image_bytes
+from server.utils.transform_cache import file_digest, remember_digest
+from server.utils.variants import ensure_variant, generate_variants, link_variants
 
 # Define the Blueprint
 image_bp = Blueprint("image", __name__)
@@ -31,269 +46,590 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def transformed_row(source, plan, metadata, transformed_path):
+    """Image row for a rendered file. `source` holds the original's user_id
+    and original_url, so this also works outside the request's session."""
+    new_filename = os.path.basename(transformed_path)
+    return Image(
+        user_id=source["user_id"],
+        filename=new_filename,
+        original_url=source["original_url"],  # Keep the original image's URL
+        transformed_url=f"/uploads/{new_filename}",  # Ensure this matches the actual file path
+        transformation_type="multiple",  # Indicate multiple transformations
+        image_metadata=metadata,
+        width=plan.output_size[0],
+        height=plan.output_size[1],
+        format=SAVE_FORMATS[plan.output["ext"]],
+        file_size=os.path.getsize(transformed_path),
+        transformation_count=count_transformations(metadata),
+    )
+
+
+def batch_groups(pending, workers, batch_size):
+    """Split pending batch items (by index) into calls for the batch pool.
+    Items that remove backgrounds share calls so the model sees several
+    images per run; the rest get a call each."""
+    groups, removing = [], []
+    for index, item in enumerate(pending):
+        if removes_background(item[1]):
+            removing.append(index)
+        else:
+            groups.append([index])
+    # Spread across the pool first, then cap each model run at batch_size
+    size = max(1, min(batch_size, -(-len(removing) // max(1, workers))))
+    groups.extend(removing[i:i + size] for i in range(0, len(removing), size))
+    return groups
+
+
+def busy(error):
+    return {"error": str(error)}, 503, {"Retry-After": "5"}
+
+
+def uploaded_row(user_id, filename, blob, ingested):
+    return Image(
+        user_id=user_id,
+        filename=filename,
+        original_url=f"/uploads/{filename}",
+        image_metadata={
+            "format": ingested.format,
+            "mode": ingested.mode,
+            "size": ingested.dimensions,
+        },
+        blob_sha256=blob.sha256,
+        width=ingested.dimensions[0],
+        height=ingested.dimensions[1],
+        format=ingested.format,
+        file_size=ingested.size,
+        transformation_count=0,
+    )
+
+
+def source_header(image, path):
+    """Size and mode to plan with: from the row when it has them, otherwise
+    from the file header. Transformed rows carry their source's metadata, so
+    only an original's recorded mode is its own."""
+    mode = None if image.transformed_url else (image.image_metadata or {}).get("mode")
+    if image.width and mode:
+        return (image.width, image.height), mode
+    with PILImage.open(path) as pil_image:
+        return pil_image.size, pil_image.mode
+
+
+def upload_variants(folder, filename, digest, dimensions):
+    """Variants for a new upload: linked from a file with the same bytes
+    when that one has them, otherwise generated from a fresh decode."""
+    for sibling in sibling_filenames(digest, filename):
+        if link_variants(folder, sibling, filename, dimensions):
+            return
+    with pixel_budget.admit(image_bytes(dimensions)):
+        generate_variants(folder, filename)
+
+
+def check_upload(file, folder, verify=False):
+    """Validate one uploaded file: limits and type from the header sniffed
+    while it streamed in, then, with `verify`, a structural check that reads
+    the whole file again. Returns (ingest, ingested); raises IngestError."""
+    if not file.filename or not allowed_file(file.filename):
+        raise IngestError("Invalid file type")
+    ingest, ingested = validate_upload(
+        file, folder, app.config.get("MAX_IMAGE_PIXELS"), app.config.get("MAX_CONTENT_LENGTH"),
+    )
+    if verify:
+        verify_upload(ingest)
+    return ingest, ingested
+
+
 class UploadImageResource(Resource):
+    @login_required
     def post(self):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            return {"error": "Authorization header required"}, 401
-
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
-            user = db.session.get(User, user_id)
-            if not user:
-                return {"error": "User not found"}, 404
+            user = g.user
 
-            if "image" not in request.files:
+            # The body is streamed to disk as the form is parsed
+            with metrics.stage("receive"):
+                files = request.files
+            if "image" not in files:
                 return {"error": "No image part in the request. Please check the form key."}, 400
 
-            file = request.files["image"]
+            file = files["image"]
             if file.filename == "":
                 return {"error": "No file selected"}, 400
 
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
                 unique_name = f"{uuid.uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-
-                file.save(filepath)
+                folder = app.config["UPLOAD_FOLDER"]
 
+                # Written, hashed and header-checked in one pass while the request was parsed
                 try:
-                    pil_image = PILImage.open(filepath)
-                    pil_image.verify()  # Verify that the file is a valid image
-                except UnidentifiedImageError:
-                    os.remove(filepath)  # Remove invalid file
-                    return {"error": "Uploaded file is not a valid image"}, 400
-
-                pil_image = PILImage.open(filepath)  # Reopen the image after verification
-                metadata = {
-                    "format": pil_image.format,
-                    "mode": pil_image.mode,
-                    "size": pil_image.size,
-                }
-
-                new_image = Image(
-                    user_id=user.id,
-                    filename=unique_name,
-                    original_url=f"/uploads/{unique_name}",
-                    image_metadata=metadata,
-                )
-
-                db.session.add(new_image)
-                db.session.commit()
+                    with metrics.stage("validate"):
+                        ingest, ingested = check_upload(file, folder)
+                except IngestError as e:
+                    return {"error": str(e)}, 400
+
+                # Identical bytes are stored once and linked to each row's own name
+                with metrics.stage("store"):
+                    blob, created = acquire_blob(ingest, ingested, folder, unique_name)
+                try:
+                    if app.config.get("VARIANTS_ON_UPLOAD"):
+                        with metrics.stage("variants"):
+                            upload_variants(folder, unique_name, blob.sha256, ingested.dimensions)
+
+                    with metrics.stage("db"):
+                        new_image = uploaded_row(user.id, unique_name, blob, ingested)
+                        db.session.add(new_image)
+                        db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    discard_upload(folder, unique_name, blob, created)
+                    raise
+                remember_digest(os.path.join(folder, unique_name), ingested.digest)
 
                 return image_schema.dump(new_image), 201
 
             return {"error": "Invalid file type"}, 400
 
+        except IngestError as e:
+            return {"error": str(e)}, 400
+        except RequestEntityTooLarge:
+            return {"error": "Upload is too large"}, 413
+        except AdmissionRejected as e:
+            return busy(e)
         except Exception as e:
             return {"error": f"An error occurred: {str(e)}"}, 400
 
 
-class ListImagesResource(Resource):
-    def get(self):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith('Bearer '):
-            print("Invalid Authorization header:", auth_header)
-            return {"error": "Invalid Authorization header"}, 401
+class BatchUploadResource(Resource):
+    """Multi-file upload: each file is read back and verified on a thread
+    pool, then every accepted file is recorded in one transaction."""
 
+    batch_upload = True  # IngestRequest allows UPLOAD_BATCH_MAX_BYTES and UPLOAD_MAX_FILES here
+
+    @login_required
+    def post(self):
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
-            if not user_id:
-                print("Invalid token or user_id not found")
-                return {"error": "Invalid token"}, 401
-
-            print(f"Fetching images for user_id: {user_id}")
-            user = User.query.get(user_id)
-            if not user:
-                print(f"User not found for user_id: {user_id}")
-                return {"error": "User not found"}, 404
-
-            images = Image.query.filter_by(user_id=user_id).all()
-            print(f"Found {len(images)} images for user {user_id}")
-            
-            serialized_images = []
-            for img in images:
+            with metrics.stage("receive"):
+                files = request.files.getlist("images[]") or request.files.getlist("images")
+        except IngestError as e:
+            return {"error": str(e)}, 400
+        except RequestEntityTooLarge:
+            return {"error": "Upload is too large"}, 413
+        if not files:
+            return {"error": "No images part in the request. Please check the form key."}, 400
+        return self._store(g.user.id, files)
+
+    @staticmethod
+    def _store(user_id, files):
+        folder = app.config["UPLOAD_FOLDER"]
+        ctx = app._get_current_object().app_context
+
+        def check(file):
+            with ctx():
                 try:
-                    img_dict = image_schema.dump(img)
-                    # Add file size in bytes
-                    filepath = os.path.join(app.config["UPLOAD_FOLDER"], img.filename)
-                    if os.path.exists(filepath):
-                        img_dict["size"] = os.path.getsize(filepath)
-                        print(f"Image {img.filename} size: {img_dict['size']} bytes")
-                    else:
-                        print(f"Warning: Image file not found: {filepath}")
-                        img_dict["size"] = 0
-                    
-                    # Count transformations from metadata
-                    transformations = 0
-                    if img.image_metadata:
-                        transformations = sum(1 for k in img.image_metadata.keys() if k in [
-                            "width", "height", "crop_box", "rotation_angle", 
-                            "watermark", "flipped", "mirrored", "compressed_quality", 
-                            "format", "filter", "background_removed"
-                        ])
-                    img_dict["transformations"] = transformations
-                    print(f"Image {img.filename} transformations: {transformations}")
-                    
-                    serialized_images.append(img_dict)
-                except Exception as e:
-                    print(f"Error processing image {img.filename}: {str(e)}")
-                    continue
-            
-            print(f"Returning {len(serialized_images)} serialized images")
-            return serialized_images, 200
+                    return check_upload(file, folder, verify=True), None
+                except IngestError as e:
+                    return None, str(e)
+
+        with metrics.stage("validate"), ThreadPoolExecutor(max_workers=app.config.get("UPLOAD_WORKERS", 4)) as pool:
+            checked = list(pool.map(check, files))
+
+        results = []
+        stored = []  # (result index, file name, digest, blob, whether this upload created it)
+        rows = []
+        for file, (value, error) in zip(files, checked):
+            result = {"filename": file.filename, "status": "error", "error": error}
+            results.append(result)
+            if error:
+                continue
+            ingest, ingested = value
+            unique_name = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            with metrics.stage("store"):
+                blob, created = acquire_blob(ingest, ingested, folder, unique_name)
+            stored.append((len(results) - 1, unique_name, ingested.digest, blob, created))
+            rows.append(uploaded_row(user_id, unique_name, blob, ingested))
+
+        try:
+            with metrics.stage("db"):
+                db.session.add_all(rows)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for index, filename, _, blob, created in stored:
+                discard_upload(folder, filename, blob, created)
+                results[index].update(error=str(e))
+            return {"uploaded": 0, "failed": len(results), "results": results}, 400
+
+        for (index, filename, digest, _, _), row in zip(stored, rows):
+            remember_digest(os.path.join(folder, filename), digest)
+            results[index] = {"filename": results[index]["filename"], "status": "ok", "image": image_schema.dump(row)}
+
+        if app.config.get("VARIANTS_ON_UPLOAD") and rows:
+            # The rows are committed; variants are rebuilt on first request if this fails
+            new_files = [(row.filename, (row.width, row.height)) for (*_, created), row in zip(stored, rows) if created]
+            workers = app.config.get("UPLOAD_WORKERS", 4)
+            costs = sorted((image_bytes(size) for _, size in new_files), reverse=True)
+            try:
+                with metrics.stage("variants"):
+                    if new_files:
+                        with pixel_budget.admit(sum(costs[:workers])), ThreadPoolExecutor(max_workers=workers) as pool:
+                            list(pool.map(lambda item: generate_variants(folder, item[0]), new_files))
+                    # Files with bytes already stored share the variants of one that has them
+                    for (*_, created), row in zip(stored, rows):
+                        if not created:
+                            upload_variants(folder, row.filename, row.blob_sha256, (row.width, row.height))
+            except Exception:
+                app.logger.exception("Generating upload variants failed")
+
+        uploaded = len(rows)
+        body = {"uploaded": uploaded, "failed": len(results) - uploaded, "results": results}
+        return body, 201 if uploaded else 400
+
+
+class ListImagesResource(Resource):
+    @login_required
+    def get(self):
+        try:
+            user_id = g.user_id
+
+            try:
+                limit = parse_limit(request.args.get("limit"))
+                query = Image.query.filter_by(user_id=user_id)
+
+                image_type = request.args.get("type")
+                if image_type == "original":
+                    query = query.filter(Image.transformed_url.is_(None))
+                elif image_type == "transformed":
+                    query = query.filter(Image.transformed_url.isnot(None))
+                elif image_type:
+                    raise ValueError("type must be 'original' or 'transformed'")
+                if request.args.get("since"):
+                    query = query.filter(Image.created_at >= datetime.fromisoformat(request.args["since"]))
+                if request.args.get("until"):
+                    query = query.filter(Image.created_at < datetime.fromisoformat(request.args["until"]))
+
+                with metrics.stage("query"):
+                    images, next_cursor = keyset_page(query, Image, limit, request.args.get("cursor"))
+            except ValueError as e:
+                return {"error": str(e)}, 400
+
+            with metrics.stage("serialize"):
+                serialized_images = images_schema.dump(images)
+                for img, img_dict in zip(images, serialized_images):
+                    # Recorded when the row was written
+                    img_dict["size"] = img.file_size or 0
+                    img_dict["transformations"] = img.transformation_count or 0
+
+            headers = {}
+            if next_cursor:
+                args = dict(request.args, cursor=next_cursor)
+                headers["X-Next-Cursor"] = next_cursor
+                headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+            app.logger.debug("Listed %d images for user %s", len(images), user_id)
+            return serialized_images, 200, headers
 
         except Exception as e:
-            print(f"Error in ListImagesResource: {str(e)}")
+            app.logger.exception("Error listing images")
             return {"error": str(e)}, 400
 
 
 class TransformImageResource(Resource):
+    @login_required
     def post(self, image_id):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            return {"error": "Authorization header required"}, 401
-
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
-            user = db.session.get(User, user_id)
-            if not user:
-                return {"error": "User not found"}, 404
+            user = g.user
 
             # Retrieve the image using db.session.get()
-            image = db.session.get(Image, image_id)
+            with metrics.stage("load"):
+                image = db.session.get(Image, image_id)
             if not image or image.user_id != user.id:
                 return {"error": "Image not found or unauthorized"}, 404
 
             data = request.get_json()
-            print('Transform endpoint received data:', data, flush=True)  # Debug print
+            app.logger.debug("Transform request for %s: %s", image_id, data)
             transformations = data.get("transformations", [])  # Expecting a list of transformations
 
             if not transformations:
                 return {"error": "No transformations provided"}, 400
 
             original_path = os.path.join(app.config["UPLOAD_FOLDER"], image.filename)
-            pil_image = PILImage.open(original_path)
-
-            metadata = image.image_metadata or {}
-
-            # Apply each transformation in sequence
-            for transformation in transformations:
-                type = transformation.get("type")
-                options = transformation.get("options", {})
-
-                if type == "resize":
-                    width = int(options.get("width", pil_image.width))
-                    height = int(options.get("height", pil_image.height))
-                    pil_image = pil_image.resize((width, height))
-                    metadata.update({"width": width, "height": height})
-
-                elif type == "crop":
-                    left = int(options.get("left", 0))
-                    top = int(options.get("top", 0))
-                    right = int(options.get("right", pil_image.width))
-                    bottom = int(options.get("bottom", pil_image.height))
-                    pil_image = pil_image.crop((left, top, right, bottom))
-                    metadata.update({"crop_box": [left, top, right, bottom]})
-
-                elif type == "rotate":
-                    angle = int(options.get("angle", 0))
-                    pil_image = pil_image.rotate(angle, expand=True)
-                    metadata.update({"rotation_angle": angle})
-
-                elif type == "watermark":
-                    from PIL import ImageDraw, ImageFont
-                    draw = ImageDraw.Draw(pil_image)
-                    font = ImageFont.load_default()
-                    text = options.get("text", "Pik-Cha")
-                    draw.text((10, 10), text, fill="white", font=font)
-                    metadata.update({"watermark": text})
-
-                elif type == "flip":
-                    from PIL import ImageOps
-                    pil_image = ImageOps.flip(pil_image)
-                    metadata.update({"flipped": True})
-
-                elif type == "mirror":
-                    from PIL import ImageOps
-                    pil_image = ImageOps.mirror(pil_image)
-                    metadata.update({"mirrored": True})
-
-                elif type == "compress":
-                    quality = int(options.get("quality", 75))
-                    metadata.update({"compressed_quality": quality})
-
-                elif type == "format":
-                    fmt = options.get("format", "JPEG").upper()
-                    metadata.update({"format": fmt})
-                    ext = fmt.lower()
-                    if ext == "jpeg":
-                        ext = "jpg"
-                    # Convert to RGB if saving as JPEG/JPG
-                    if ext in ["jpeg", "jpg"]:
-                        pil_image = pil_image.convert("RGB")
-
-                elif type == "filter":
-                    from PIL import ImageOps
-                    filter_type = options.get("filter")
-                    if filter_type == "grayscale":
-                        pil_image = ImageOps.grayscale(pil_image)
-                    elif filter_type == "sepia":
-                        sepia = pil_image.convert("RGB")
-                        pixels = sepia.load()
-                        for y in range(sepia.height):
-                            for x in range(sepia.width):
-                                r, g, b = pixels[x, y]
-                                tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                                tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                                tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                                pixels[x, y] = (min(255, tr), min(255, tg), min(255, tb))
-                        pil_image = sepia
-                    metadata.update({"filter": filter_type})
-
-                elif type == "remove_bg":
-                    img_bytes = BytesIO()
-                    pil_image.save(img_bytes, format="PNG")
-                    output_bytes = remove(img_bytes.getvalue())
-                    pil_image = PILImage.open(BytesIO(output_bytes)).convert("RGBA")
-                    metadata.update({"background_removed": True})
+            with metrics.stage("plan"), PILImage.open(original_path) as pil_image:
+                # Normalize and fuse the requested steps before touching any pixels
+                plan = plan_transformations(
+                    transformations, pil_image.size, preset=data.get("resample"), mode=pil_image.mode,
+                )
+            if data.get("explain") or request.args.get("explain") in ("1", "true"):
+                return {"plan": plan.to_dict()}, 200
 
-                else:
-                    return {"error": f"Unsupported transformation type: {type}"}, 400
+            metadata = dict(image.image_metadata or {})
+            metadata.update(plan.metadata)
 
-            # Save the final transformed image
-            ext = "png" if "remove_bg" in [t["type"] for t in transformations] else "jpg"
-            new_filename = f"{image.id}_transformed.{ext}"
+            # Each row gets its own file name so deleting one never removes another's output
+            ext = plan.output["ext"]
+            new_filename = f"{image.id}_{uuid.uuid4().hex[:8]}_transformed.{ext}"
             transformed_path = os.path.join(app.config["UPLOAD_FOLDER"], new_filename)
+            run_async = data.get("async") or request.args.get("async") in ("1", "true")
+            memory_budget = app.config.get("TRANSFORM_MEMORY_BUDGET")
+            source = {"user_id": image.user_id, "original_url": image.original_url}
+
+            def save_row():
+                with metrics.stage("db"):
+                    new_image = transformed_row(source, plan, metadata, transformed_path)
+                    db.session.add(new_image)
+                    db.session.commit()
+                return image_schema.dump(new_image)
+
+            with metrics.stage("cache"):
+                source_digest = image.blob_sha256 or file_digest(original_path)
+                cache_key = transform_cache.key(source_digest, plan)
+                hit = transform_cache.fetch(cache_key, ext, transformed_path)
+            if hit:
+                if run_async:
+                    return self._accepted(job_queue.complete(save_row(), owner=user.id))
+                return save_row(), 201
+
+            # Wait for room in the decoded-pixel budget (or give up with 503)
+            with metrics.stage("admission"):
+                reservation = pixel_budget.reserve(estimate_plan_bytes(plan))
+            if run_async:
+                def on_done(path):
+                    transform_cache.store(cache_key, ext, path)
+                    return save_row()
+
+                try:
+                    job_id = job_queue.submit(
+                        render_plan, original_path, plan, transformed_path, memory_budget,
+                        owner=user.id, on_done=on_done, on_finish=reservation.release,
+                    )
+                except QueueFull:
+                    # Rejected before the job could take over the reservation
+                    reservation.release()
+                    raise
+                return self._accepted(job_id)
+
+            try:
+                render_plan(original_path, plan, transformed_path, memory_budget, timer=metrics.record)
+            finally:
+                reservation.release()
+            with metrics.stage("cache-store"):
+                transform_cache.store(cache_key, ext, transformed_path)
+            return save_row(), 201
+
+        except (QueueFull, AdmissionRejected) as e:
+            return busy(e)
+        except Exception as e:
+            return {"error": str(e)}, 400
+
+    @staticmethod
+    def _accepted(job_id):
+        status_url = f"/api/images/jobs/{job_id}"
+        return {"job_id": job_id, "status_url": status_url}, 202, {"Location": status_url}
+
+
+class BatchTransformResource(Resource):
+    """One pipeline over many images. Items are rendered in parallel on the
+    batch pool (background removal in groups, one model run per group) and
+    every successful row is inserted in a single commit."""
+
+    @login_required
+    def post(self):
+        try:
+            data = request.get_json() or {}
+            image_ids = data.get("image_ids") or []
+            transformations = data.get("transformations") or []
+            if not image_ids or not transformations:
+                return {"error": "image_ids and transformations are required"}, 400
+            max_items = app.config.get("BATCH_MAX_ITEMS", 500)
+            if len(image_ids) > max_items:
+                return {"error": f"A batch can hold at most {max_items} images"}, 400
+
+            images = {
+                img.id: img
+                for img in Image.query.filter(Image.id.in_(image_ids), Image.user_id == g.user_id)
+            }
+            folder = app.config["UPLOAD_FOLDER"]
+            results = {}
+            pending = []  # (image_id, plan, metadata, cache key, source path, dest path)
+            finished = []  # (image_id, plan, metadata, dest path)
+
+            for image_id in dict.fromkeys(image_ids):
+                image = images.get(image_id)
+                if image is None:
+                    results[image_id] = {"id": image_id, "status": "error", "error": "Image not found or unauthorized"}
+                    continue
+                try:
+                    original_path = os.path.join(folder, image.filename)
+                    size, mode = source_header(image, original_path)
+                    plan = plan_transformations(transformations, size, preset=data.get("resample"), mode=mode)
+                    metadata = dict(image.image_metadata or {})
+                    metadata.update(plan.metadata)
+                    ext = plan.output["ext"]
+                    dest = os.path.join(folder, f"{image.id}_{uuid.uuid4().hex[:8]}_transformed.{ext}")
+                    cache_key = transform_cache.key(image.blob_sha256 or file_digest(original_path), plan)
+                except Exception as e:
+                    results[image_id] = {"id": image_id, "status": "error", "error": str(e)}
+                    continue
+
+                if transform_cache.fetch(cache_key, ext, dest):
+                    finished.append((image_id, plan, metadata, dest))
+                else:
+                    pending.append((image_id, plan, metadata, cache_key, original_path, dest))
+
+            memory_budget = app.config.get("TRANSFORM_MEMORY_BUDGET")
+            groups = batch_groups(pending, job_queue.batch_workers, app.config.get("REMBG_BATCH_SIZE", 8))
+            # At most batch_workers groups are decoded at any one time
+            costs = sorted((sum(estimate_plan_bytes(pending[i][1]) for i in group) for group in groups), reverse=True)
+            try:
+                with pixel_budget.admit(sum(costs[:job_queue.batch_workers])):
+                    outcomes = job_queue.run_batch(render_plans, [
+                        ([(pending[i][4], pending[i][1], pending[i][5], memory_budget) for i in group],)
+                        for group in groups
+                    ])
+            except AdmissionRejected as e:
+                for _, _, _, dest in finished:
+                    os.remove(dest)  # Cache hits already linked into place
+                return busy(e)
+            rendered = [None] * len(pending)
+            for group, (values, error) in zip(groups, outcomes):
+                for i, value in zip(group, values or [(None, error)] * len(group)):
+                    rendered[i] = value
+            for (image_id, plan, metadata, cache_key, _, dest), (_, error) in zip(pending, rendered):
+                if error:
+                    results[image_id] = {"id": image_id, "status": "error", "error": error}
+                    continue
+                transform_cache.store(cache_key, plan.output["ext"], dest)
+                finished.append((image_id, plan, metadata, dest))
+
+            rows = []
+            for image_id, plan, metadata, dest in finished:
+                image = images[image_id]
+                source = {"user_id": image.user_id, "original_url": image.original_url}
+                rows.append((image_id, transformed_row(source, plan, metadata, dest)))
 
-            print(f"Saving image: mode={pil_image.mode}, size={pil_image.size}, ext={ext}", flush=True)
-            if ext in ["jpeg", "jpg"] and pil_image.mode != "RGB":
-                pil_image = pil_image.convert("RGB")
             try:
-                pil_image.save(transformed_path, quality=options.get("quality", 95))
+                db.session.add_all([row for _, row in rows])
+                db.session.commit()
             except Exception as e:
-                print(f"Save error: {e}", flush=True)
+                db.session.rollback()
+                for image_id, row in rows:
+                    os.remove(os.path.join(folder, row.filename))
+                    results[image_id] = {"id": image_id, "status": "error", "error": str(e)}
+            else:
+                for image_id, row in rows:
+                    results[image_id] = {"id": image_id, "status": "ok", "image": image_schema.dump(row)}
+
+            ordered = [results[image_id] for image_id in dict.fromkeys(image_ids)]
+            succeeded = sum(1 for item in ordered if item["status"] == "ok")
+            return {"succeeded": succeeded, "failed": len(ordered) - succeeded, "results": ordered}, 200
+        except Exception as e:
+            return {"error": str(e)}, 400
+
+
+class RenderImageResource(Resource):
+    """Read-only rendering with the pipeline in the query string. Nothing is
+    written to the database; output goes through the transform cache."""
+
+    def get(self, image_id):
+        try:
+            args = request.args.to_dict()
+            signed = "sig" in args
+            if signed:
+                secret = app.config.get("RENDER_SIGNING_KEY")
+                if not secret or not verify_signature(secret, image_id, args):
+                    return {"error": "Invalid or expired signature"}, 403
+                image = db.session.get(Image, image_id)
+            else:
+                error = authenticate()
+                if error:
+                    return error
+                image = db.session.get(Image, image_id)
+                if image and image.user_id != g.user_id:
+                    image = None
+            if not image:
+                return {"error": "Image not found or unauthorized"}, 404
+
+            source_path = os.path.join(app.config["UPLOAD_FOLDER"], image.filename)
+            size, mode = source_header(image, source_path)
+
+            try:
+                transformations, output, preset = parse_render_query(args, size)
+                plan = plan_transformations(transformations, size, preset=preset, mode=mode)
+            except ValueError as e:
                 return {"error": str(e)}, 400
+            plan.output.update(output)
+
+            # The cache key already covers source bytes, steps and encoding
+            etag = transform_cache.key(image.blob_sha256 or file_digest(source_path), plan)
+            max_age = app.config.get("RENDER_MAX_AGE", 86400)
+            cache_control = f"{'public' if signed else 'private'}, max-age={max_age}"
+            if etag in request.if_none_match:
+                return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": cache_control})
+
+            ext = plan.output["ext"]
+            path = transform_cache.lookup(etag, ext)
+            if path is None:
+                folder = transform_cache.folder or app.config["UPLOAD_FOLDER"]
+                fd, tmp = tempfile.mkstemp(dir=folder, prefix=".render-", suffix=".tmp")
+                os.close(fd)
+                try:
+                    with pixel_budget.admit(estimate_plan_bytes(plan)):
+                        render_plan(source_path, plan, tmp, app.config.get("TRANSFORM_MEMORY_BUDGET"), timer=metrics.record)
+                    transform_cache.store(etag, ext, tmp, move=True)
+                    path = transform_cache.lookup(etag, ext)
+                    if path is None:
+                        # Cache disabled: serve straight from memory
+                        with open(tmp, "rb") as f:
+                            path = BytesIO(f.read())
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+
+            response = send_file(path, mimetype=mimetype(ext), etag=etag, conditional=True)
+            response.headers["Cache-Control"] = cache_control
+            return response
+        except AdmissionRejected as e:
+            return busy(e)
+        except Exception as e:
+            return {"error": str(e)}, 400
 
-            if not os.path.exists(transformed_path):
-                print(f"Error: Transformed file not found at {transformed_path}", flush=True)
-
-            new_image = Image(
-                user_id=image.user_id,
-                filename=new_filename,
-                original_url=image.original_url,  # Keep the original image's URL
-                transformed_url=f"/uploads/{new_filename}",  # Ensure this matches the actual file path
-                transformation_type="multiple",  # Indicate multiple transformations
-                image_metadata=metadata,
-            )
-            db.session.add(new_image)
-            db.session.commit()
 
-            return image_schema.dump(new_image), 201
+class RenderUrlResource(Resource):
+    """Signed render URLs, for clients and edge caches that cannot send a token."""
+
+    @login_required
+    def get(self, image_id):
+        try:
+            image = db.session.get(Image, image_id)
+            if not image or image.user_id != g.user_id:
+                return {"error": "Image not found or unauthorized"}, 404
+
+            secret = app.config.get("RENDER_SIGNING_KEY")
+            if not secret:
+                return {"error": "Signed render URLs are not enabled"}, 404
+
+            args = request.args.to_dict()
+            expires_in = args.pop("expires_in", None)
+            params = sign_params(secret, image_id, args, expires_in)
+            return {"url": f"/api/images/{image_id}/render?{urlencode(params)}"}, 200
+        except Exception as e:
+            return {"error": str(e)}, 400
+
 
+class JobStatusResource(Resource):
+    @login_required
+    def get(self, job_id):
+        try:
+            user_id = g.user_id
+
+            job = job_queue.get(job_id)
+            if not job or job["owner"] != user_id:
+                return {"error": "Job not found"}, 404
+
+            return {
+                "id": job["id"],
+                "status": job["status"],
+                "result": job["result"],
+                "error": job["error"],
+            }, 200
         except Exception as e:
             return {"error": str(e)}, 400
 
@@ -301,19 +637,15 @@ class TransformImageResource(Resource):
 class DownloadImageResource(Resource):
     def get(self, filename):
         try:
-            return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=False)
-        except FileNotFoundError:
+            return send_upload(filename, as_attachment=False)
+        except NotFound:
             return {"error": "File not found"}, 404
         
 class ImageDetailResource(Resource):
+    @login_required
     def get(self, image_id):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            return {"error": "Authorization header required"}, 401
-
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
+            user_id = g.user_id
 
             image = Image.query.get(image_id)
             if not image or image.user_id != user_id:
@@ -323,14 +655,10 @@ class ImageDetailResource(Resource):
         except Exception as e:
             return {"error": str(e)}, 400
 
+    @login_required
     def patch(self, image_id):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            return {"error": "Authorization header required"}, 401
-
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
+            user_id = g.user_id
 
             image = Image.query.get(image_id)
             if not image or image.user_id != user_id:
@@ -350,41 +678,52 @@ class ImageDetailResource(Resource):
         except Exception as e:
             return {"error": str(e)}, 400
 
+    @login_required
     def delete(self, image_id):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header:
-            return {"error": "Authorization header required"}, 401
-
         try:
-            token = auth_header.split(" ")[1]
-            user_id = decode_token(token)
+            user_id = g.user_id
 
             # Retrieve the image using db.session.get()
             image = db.session.get(Image, image_id)
             if not image or image.user_id != user_id:
                 return {"error": "Image not found or unauthorized"}, 404
 
-            # Delete physical files
-            for url_field in [image.original_url, image.transformed_url]:
-                if url_field:
-                    filepath = os.path.join(app.config["UPLOAD_FOLDER"], os.path.basename(url_field))
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-
-            db.session.delete(image)
+            doomed = delete_image(image)
             db.session.commit()
 
+            # Delete physical files once nothing references them
+            remove_files(app.config["UPLOAD_FOLDER"], doomed)
+
             return {"message": "Image deleted successfully."}, 200
         except Exception as e:
             return {"error": str(e)}, 400
 
 @image_bp.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(current_app.config["UPLOAD_FOLDER"], filename)
+    return send_upload(filename, negotiate_format=True)
+
+@image_bp.route('/variants/<int:size>/<filename>')
+def serve_variant(size, filename):
+    try:
+        path = ensure_variant(app.config["UPLOAD_FOLDER"], filename, size, pixel_budget)
+    except AdmissionRejected as e:
+        return busy(e)
+    if path is None:
+        return {"error": "File not found"}, 404
+    response = send_upload(os.path.basename(path), negotiate_format=True)
+    # Variants of an immutable file name never change; the source standing in
+    # for a size it is too small to have must not be cached under this URL
+    response.headers["Cache-Control"] = REVALIDATE if os.path.basename(path) == filename else IMMUTABLE
+    return response
 
 # Add resources to the Blueprint
 api.add_resource(UploadImageResource, "/")
 api.add_resource(ListImagesResource, "/")
 api.add_resource(TransformImageResource, "/<string:image_id>/transform")
+api.add_resource(BatchTransformResource, "/batch/transform")
+api.add_resource(BatchUploadResource, "/batch/upload")
+api.add_resource(RenderImageResource, "/<string:image_id>/render")
+api.add_resource(RenderUrlResource, "/<string:image_id>/render-url")
+api.add_resource(JobStatusResource, "/jobs/<string:job_id>")
 api.add_resource(DownloadImageResource, "/download/<string:filename>")
 api.add_resource(ImageDetailResource, "/<string:image_id>")
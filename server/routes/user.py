@@ -1,10 +1,11 @@
 # server/routes/user.py
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_restful import Api, Resource
 from server.models.user import User
 from server.schemas.user_schema import UserSchema, user_schema, users_schema
 from server.extensions import db
+from server.utils.blobs import delete_image, remove_files
 from werkzeug.security import generate_password_hash
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
@@ -58,8 +59,14 @@ class UserResource(Resource):
 
     def delete(self, id):
         user = db.session.get(User, id)
+        # Each image drops its blob reference; the cascade alone would leak them
+        doomed = []
+        for image in list(user.images):
+            doomed.extend(delete_image(image))
+        db.session.expire(user, ["images"])
         db.session.delete(user)
         db.session.commit()
+        remove_files(current_app.config["UPLOAD_FOLDER"], doomed)
         return {"message": "User deleted successfully."}, 204
 
 class UserProfileResource(Resource):
@@ -1,5 +1,7 @@
+from marshmallow import fields
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from server.models.image import Image
+from server.utils.variants import variant_urls
 
 class ImageSchema(SQLAlchemyAutoSchema):
     class Meta:
@@ -10,8 +12,16 @@ class ImageSchema(SQLAlchemyAutoSchema):
         fields = (
             "id", "user_id", "filename", "original_url",
             "transformed_url", "transformation_type",
-            "image_metadata", "created_at"
+            "image_metadata", "width", "height", "format", "file_size",
+            "transformation_count", "created_at", "variants"
         )
+
+    variants = fields.Method("get_variants", dump_only=True)
+
+    def get_variants(self, obj):
+        # Only sizes smaller than the stored file; rows without dimensions list every size
+        dimensions = (obj.width, obj.height) if obj.width else None
+        return variant_urls(obj.filename, dimensions)
     
 
 image_schema = ImageSchema()
@@ -14,7 +14,8 @@ setup(
         "marshmallow-sqlalchemy",
         "python-dotenv",
         "pillow",
-        "rembg",
+        "rembg>=2.0.51,<=2.0.61",
+        "numpy",
         "pyjwt",
     ],
 ) 
\ No newline at end of file
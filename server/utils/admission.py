@@ -0,0 +1,156 @@
+"""Admission control by decoded pixel memory.
+
+Compressed size says little about decoded size (a 16MB PNG can hold
+gigabytes of pixels), so work that decodes images first reserves its
+estimated footprint from `ADMISSION_BUDGET_BYTES`. A reservation waits up
+to `ADMISSION_TIMEOUT` seconds for room and then gives up with
+`AdmissionRejected`, which routes turn into 503 + Retry-After. A request
+larger than the whole budget is admitted on its own once everything else
+has finished.
+
+By default the budget is per process. With `ADMISSION_STATE_DIR` set, every
+worker on the host shares it: each reservation is a small file named after
+its process, created and counted under an exclusive `flock`. Files left by
+dead processes are ignored and removed, so a crash never leaks budget.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-worker mode is unavailable
+    fcntl = None
+
+POLL_INTERVAL = 0.05
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+def estimate_plan_bytes(plan):
+    """Decoded size of every intermediate the plan produces, source included."""
+    from server.utils.strips import image_bytes
+
+    return sum(image_bytes(size) for size in plan.sizes)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Reservation:
+    def __init__(self, budget, cost, path=None):
+        self._budget = budget
+        self.cost = cost
+        self.path = path
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._budget._release(self)
+
+
+class PixelBudget:
+    def __init__(self, app=None):
+        self.max_bytes = 0
+        self.timeout = 10.0
+        self.state_dir = None
+        self.in_use = 0
+        self._cond = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get("ADMISSION_BUDGET_BYTES", 0)
+        self.timeout = app.config.get("ADMISSION_TIMEOUT", self.timeout)
+        self.state_dir = app.config.get("ADMISSION_STATE_DIR") if fcntl else None
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def reserve(self, cost, timeout=None):
+        """Take `cost` bytes from the budget, waiting up to `timeout` seconds.
+        Returns a `Reservation` to release when the work is done."""
+        if not self.enabled:
+            return Reservation(self, 0)
+        cost = min(int(cost), self.max_bytes)
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if self.state_dir:
+            return self._reserve_shared(cost, deadline)
+
+        with self._cond:
+            while self.in_use + cost > self.max_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected("Server is busy with other images, try again shortly")
+                self._cond.wait(remaining)
+            self.in_use += cost
+        return Reservation(self, cost)
+
+    @contextmanager
+    def admit(self, cost, timeout=None):
+        reservation = self.reserve(cost, timeout)
+        try:
+            yield reservation
+        finally:
+            reservation.release()
+
+    def _release(self, reservation):
+        if reservation.path:
+            try:
+                os.remove(reservation.path)
+            except FileNotFoundError:
+                pass
+            return
+        with self._cond:
+            self.in_use -= reservation.cost
+            self._cond.notify_all()
+
+    def _shared_in_use(self):
+        total = 0
+        with os.scandir(self.state_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".res"):
+                    continue
+                pid, _, rest = entry.name.partition("-")
+                if not _pid_alive(int(pid)):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                total += int(rest.split(".")[0].split("_")[1])
+        return total
+
+    def _reserve_shared(self, cost, deadline):
+        lock_path = os.path.join(self.state_dir, "budget.lock")
+        while True:
+            with open(lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if self._shared_in_use() + cost <= self.max_bytes:
+                    path = os.path.join(self.state_dir, f"{os.getpid()}-{uuid.uuid4().hex}_{cost}.res")
+                    open(path, "w").close()
+                    return Reservation(self, cost, path)
+            if time.monotonic() >= deadline:
+                raise AdmissionRejected("Server is busy with other images, try again shortly")
+            time.sleep(POLL_INTERVAL)
+
+    def stats(self):
+        in_use = self._shared_in_use() if self.state_dir else self.in_use
+        return {"budget_bytes": self.max_bytes, "in_use_bytes": in_use}
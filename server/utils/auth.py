@@ -0,0 +1,50 @@
+"""Request authentication shared by the API resources.
+
+`login_required` checks the Bearer token once per request and puts the
+caller on `flask.g` (`g.user_id`, and `g.user`, a `CachedUser` snapshot), so
+resources no longer parse headers or load the user themselves.
+"""
+from functools import wraps
+
+from flask import g, request
+
+from server.extensions import db, user_cache
+from server.utils.jwt_handler import decode_token
+
+
+def _load_user(user_id):
+    from server.models.user import User
+    return db.session.get(User, user_id)
+
+
+def authenticate():
+    """Resolve the request's Bearer token. Returns None on success, or an
+    error response tuple."""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return {"error": "Authorization header required"}, 401
+    scheme, _, token = auth_header.partition(" ")
+    if scheme != "Bearer" or not token:
+        return {"error": "Invalid Authorization header"}, 401
+
+    user_id = decode_token(token)
+    if not user_id:
+        return {"error": "Invalid or expired token"}, 401
+
+    user = user_cache.get(user_id, _load_user)
+    if user is None:
+        return {"error": "User not found"}, 404
+
+    g.user_id = user.id
+    g.user = user
+    return None
+
+
+def login_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        error = authenticate()
+        if error:
+            return error
+        return fn(*args, **kwargs)
+    return wrapper
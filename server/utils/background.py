@@ -0,0 +1,119 @@
+"""Background removal with long-lived rembg sessions.
+
+Model sessions are expensive to build, so each process creates one per
+model on first use and reuses it for every later call. Images are passed to
+rembg as Pillow images directly instead of being PNG-encoded and decoded.
+
+A single image goes through rembg's public `remove`. `remove_many` runs
+several images through the model in one inference call: each is normalized
+the way rembg's session would, the inputs are stacked into one batch and the
+masks are split back out. That path uses session internals
+(`normalize`, `inner_session`, `rembg.bg.naive_cutout`) and numpy, so the
+Pipfile pins rembg to the versions it was tested with. It covers the u2net
+family and isnet-general-use, whose sessions differ only in their input
+size and normalization. Other models, model files exported with a fixed
+batch size of one and rembg versions whose internals moved fall back to one
+public `remove` call per image on the same session.
+
+rembg (and onnxruntime with it) is only imported on first use, so requests
+that never remove a background, CLI commands and tests don't pay for it.
+Call `preload()` to take that cost up front, e.g. before forking workers.
+"""
+import logging
+import os
+import threading
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "u2net"
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+# Model name -> (mean, std, input size) its rembg session normalizes with
+BATCH_INPUTS = {
+    "u2net": (IMAGENET_MEAN, (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": (IMAGENET_MEAN, (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": (IMAGENET_MEAN, (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": (IMAGENET_MEAN, (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": (IMAGENET_MEAN, (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+class BackgroundRemover:
+    def __init__(self, app=None):
+        self.model_name = os.getenv("REMBG_MODEL", DEFAULT_MODEL)
+        self._sessions = {}
+        self._unbatched = set()  # Models whose file rejected a batch
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.model_name = app.config.get("REMBG_MODEL", DEFAULT_MODEL)
+
+    def session(self, model_name=None):
+        model_name = model_name or self.model_name
+        with self._lock:
+            # Sessions don't survive a fork; rebuild them in child processes.
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+            if model_name not in self._sessions:
+                from rembg import new_session
+
+                self._sessions[model_name] = new_session(model_name)
+            return self._sessions[model_name]
+
+    def preload(self, model_name=None, session=True):
+        """Import rembg now, and build the model session unless `session` is
+        false. Sessions are per process, so a pre-fork master should only
+        import: the libraries are then shared copy-on-write by every worker."""
+        import rembg  # noqa: F401
+
+        if session:
+            self.session(model_name)
+
+    def remove(self, image, model_name=None):
+        from rembg import remove
+
+        return remove(image, session=self.session(model_name)).convert("RGBA")
+
+    def remove_many(self, images, model_name=None):
+        """Cut out the foreground of each image, as RGBA, in one model run."""
+        from rembg import remove
+
+        if len(images) == 1:
+            return [self.remove(images[0], model_name)]
+        model_name = model_name or self.model_name
+        session = self.session(model_name)
+        if model_name in BATCH_INPUTS and model_name not in self._unbatched:
+            try:
+                return self._remove_batch(session, images, *BATCH_INPUTS[model_name])
+            except Exception:
+                log.warning("Model %s rejected a batch of %d; removing one image at a time",
+                            model_name, len(images), exc_info=True)
+                self._unbatched.add(model_name)
+        return [remove(image, session=session).convert("RGBA") for image in images]
+
+    @staticmethod
+    def _remove_batch(session, images, mean, std, size):
+        import numpy as np
+        from rembg.bg import naive_cutout
+
+        images = [ImageOps.exif_transpose(image) for image in images]  # As rembg.remove does
+        inputs = [session.normalize(image, mean, std, size) for image in images]
+        name = next(iter(inputs[0]))
+        outputs = session.inner_session.run(None, {name: np.concatenate([i[name] for i in inputs])})
+
+        cutouts = []
+        for image, pred in zip(images, outputs[0][:, 0, :, :]):
+            # Scaled per image, like a single-image run
+            low, high = pred.min(), pred.max()
+            pred = (pred - low) / (high - low)
+            mask = PILImage.fromarray((pred * 255).astype("uint8"), mode="L")
+            mask = mask.resize(image.size, PILImage.LANCZOS)
+            cutouts.append(naive_cutout(image, mask).convert("RGBA"))
+        return cutouts
@@ -0,0 +1,129 @@
+"""Reference-counted storage for uploaded bytes.
+
+Identical uploads share one file, `blobs/<sha256>` under UPLOAD_FOLDER,
+tracked by an `ImageBlob` row keyed by the content hash. Each original
+`Image` row still gets its own file name (with its own uploader's name in
+it), hard-linked to the blob so the bytes are stored once; filesystems
+without hard links get a copy. Every original row holds one reference and
+the blob file is removed when the last reference goes away. Rows are
+deleted through `delete_image`, whether one at a time or with their user,
+so no reference is dropped without being released. Callers own the
+transaction: nothing here commits except `discard_upload`, which cleans up
+after one that was rolled back.
+"""
+import os
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from server.extensions import db
+from server.models.blob import ImageBlob
+from server.models.image import Image
+from server.utils.transform_cache import _link_or_copy
+from server.utils.variants import remove_variants
+
+BLOB_DIR = "blobs"
+
+
+def _add_ref(digest, delta):
+    db.session.execute(
+        ImageBlob.__table__.update()
+        .where(ImageBlob.sha256 == digest)
+        .values(ref_count=ImageBlob.ref_count + delta)
+    )
+
+
+def _load(digest):
+    return db.session.execute(
+        select(ImageBlob).filter_by(sha256=digest).execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
+
+def acquire_blob(ingest, ingested, folder, filename):
+    """Take a reference to the blob for `ingested.digest`, storing the
+    pending upload only if these bytes are new, and link it to `filename`.
+    Returns the blob and whether it was created."""
+    blob = _load(ingested.digest)
+    created = False
+    if blob is None:
+        name = os.path.join(BLOB_DIR, ingested.digest)
+        os.makedirs(os.path.join(folder, BLOB_DIR), exist_ok=True)
+        ingest.commit(os.path.join(folder, name))
+        try:
+            with db.session.begin_nested():
+                blob = ImageBlob(sha256=ingested.digest, filename=name, size=ingested.size, ref_count=1)
+                db.session.add(blob)
+            created = True
+        except IntegrityError:
+            # Someone stored the same bytes first, under the same name.
+            blob = _load(ingested.digest)
+    else:
+        ingest.close()
+    if not created:
+        _add_ref(blob.sha256, 1)
+    _link_or_copy(os.path.join(folder, blob.filename), os.path.join(folder, filename))
+    return blob, created
+
+
+def discard_upload(folder, filename, blob, created):
+    """Undo `acquire_blob` after its transaction was rolled back: remove the
+    row's link and, if this upload created the blob, the blob itself."""
+    paths = [filename]
+    if created:
+        # pysqlite commits a released savepoint, so the row can outlive the rollback
+        if not db.session.query(Image.query.filter_by(blob_sha256=blob.sha256).exists()).scalar():
+            db.session.execute(ImageBlob.__table__.delete().where(ImageBlob.sha256 == blob.sha256))
+            db.session.commit()
+            paths.append(blob.filename)
+    for name in paths:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+    remove_variants(folder, filename)
+
+
+def release_blob(digest, filename):
+    """Drop the reference held by the row stored as `filename`. Returns the
+    file names to delete once the transaction commits."""
+    _add_ref(digest, -1)
+    blob = _load(digest)
+    if blob is None:
+        return [filename]
+    if blob.ref_count <= 0:
+        db.session.delete(blob)
+        return [filename, blob.filename]
+    return [filename]
+
+
+def delete_image(image):
+    """Delete an image row and drop its blob reference, if any. Returns the
+    file names to remove with `remove_files` once the transaction commits."""
+    # A transformed row owns only its output; originals link to a shared blob
+    if image.transformed_url:
+        doomed = [os.path.basename(image.transformed_url)]
+    else:
+        doomed = [os.path.basename(image.original_url)]
+
+    blob_sha256 = image.blob_sha256
+    db.session.delete(image)
+    db.session.flush()
+    if blob_sha256:
+        doomed = release_blob(blob_sha256, doomed[0])
+    return doomed
+
+
+def remove_files(folder, filenames):
+    """Remove stored files and everything derived from them."""
+    for filename in filter(None, filenames):
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.remove(path)
+        remove_variants(folder, filename)
+
+
+def sibling_filenames(digest, filename, limit=3):
+    """Other rows' files holding the same bytes as `filename`."""
+    rows = db.session.execute(
+        select(Image.filename).where(Image.blob_sha256 == digest, Image.filename != filename).limit(limit)
+    )
+    return [row.filename for row in rows]
@@ -0,0 +1,152 @@
+"""Output encoding for rendered images.
+
+Each output extension maps to a Pillow format and a set of effort presets.
+`fast` favours encode time, `small` favours file size, and `balanced` (the
+default) sits between them. Presets only control encoder effort; the quality
+is set separately, from the `compress` transformation. JPEG has no effort
+setting past optimized progressive output, so its `small` spends the saving
+on colour instead: luma is quantized at the requested quality and chroma,
+which the eye resolves less finely, at `SMALL_CHROMA_QUALITY` of it.
+`lossless` applies to WebP only. AVIF is offered only when the installed Pillow can write it.
+"""
+from PIL import Image as PILImage
+from PIL import features
+
+DEFAULT_QUALITY = 85
+DEFAULT_EFFORT = "balanced"
+EFFORTS = ("fast", "balanced", "small")
+
+SAVE_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+
+def _avif_supported():
+    # Asking features.check about a feature Pillow doesn't know (before
+    # 11.2) only warns and returns False, so look for a registered encoder.
+    PILImage.init()
+    if "AVIF" not in PILImage.SAVE:
+        return False
+    # Pillow's own plugin can be present without libavif behind it
+    return "avif" not in features.modules or features.check_module("avif")
+
+
+if _avif_supported():
+    SAVE_FORMATS["avif"] = "AVIF"
+
+# Extension to write for each name accepted by the `format` transformation
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "JPG": "jpg", "PNG": "png", "WEBP": "webp"}
+if "avif" in SAVE_FORMATS:
+    FORMAT_EXTENSIONS["AVIF"] = "avif"
+
+ENCODER_PRESETS = {
+    "JPEG": {
+        "fast": {},
+        "balanced": {"optimize": True, "progressive": True},
+        "small": {"optimize": True, "progressive": True},
+    },
+    "PNG": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"optimize": True},
+    },
+    "WEBP": {
+        "fast": {"method": 0},
+        "balanced": {"method": 4},
+        "small": {"method": 6},
+    },
+    "AVIF": {
+        "fast": {"speed": 8},
+        "balanced": {"speed": 6},
+        "small": {"speed": 4},
+    },
+}
+
+LOSSLESS_EFFORT = {"fast": 25, "balanced": 75, "small": 100}
+
+# libjpeg's baseline quantization tables (ITU T.81 Annex K), in natural order
+JPEG_LUMA_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+JPEG_CHROMA_TABLE = (
+    17, 18, 24, 47, 99, 99, 99, 99, 18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99, 47, 66, 99, 99, 99, 99, 99, 99,
+) + (99,) * 32
+SMALL_CHROMA_QUALITY = 0.5  # Share of the requested quality chroma gets
+
+# Modes each encoder writes directly; anything else is converted first.
+ENCODER_MODES = {
+    "JPEG": {"L", "RGB", "CMYK"},
+    "PNG": {"1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16"},
+    "WEBP": {"RGB", "RGBA"},
+    "AVIF": {"RGB", "RGBA"},
+}
+
+
+def output_extension(format_name):
+    """Extension for a `format` transformation value, e.g. "WEBP" -> "webp"."""
+    ext = FORMAT_EXTENSIONS.get(str(format_name).upper())
+    if ext is None:
+        raise ValueError(f"Unsupported output format: {format_name}")
+    return ext
+
+
+def parse_effort(value):
+    effort = (value or DEFAULT_EFFORT).lower()
+    if effort not in EFFORTS:
+        raise ValueError(f"Unsupported encoder effort: {value}")
+    return effort
+
+
+def parse_quality(value):
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    return quality
+
+
+def _has_alpha(image):
+    return image.mode in ("LA", "RGBA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def prepare_mode(image, fmt):
+    if image.mode in ENCODER_MODES[fmt]:
+        return image
+    if fmt != "JPEG" and _has_alpha(image):
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def jpeg_table(table, quality):
+    """Scale a baseline table to `quality` the way libjpeg does."""
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return [min(255, max(1, (value * scale + 50) // 100)) for value in table]
+
+
+def save_options(fmt, output):
+    """Keyword arguments for `Image.save` from a plan's output options."""
+    effort = output.get("effort", DEFAULT_EFFORT)
+    options = dict(ENCODER_PRESETS[fmt][effort])
+    quality = output.get("quality", DEFAULT_QUALITY)
+    if fmt == "JPEG" and effort == "small":
+        # Pillow would scale explicit tables by `quality` again, so pass only the tables
+        chroma = max(1, int(quality * SMALL_CHROMA_QUALITY))
+        options["qtables"] = [jpeg_table(JPEG_LUMA_TABLE, quality), jpeg_table(JPEG_CHROMA_TABLE, chroma)]
+    elif fmt == "WEBP" and output.get("lossless"):
+        # In lossless mode WebP reads quality as compression effort
+        options.update(lossless=True, quality=LOSSLESS_EFFORT[effort])
+    elif fmt != "PNG":
+        options["quality"] = quality
+    return options
+
+
+def encode(image, dest, output):
+    """Write `image` to `dest` (a path or file object) as `output["ext"]`."""
+    fmt = SAVE_FORMATS[output["ext"]]
+    image = prepare_mode(image, fmt)
+    image.save(dest, fmt, **save_options(fmt, output))
+
+
+def mimetype(ext):
+    return PILImage.MIME[SAVE_FORMATS[ext]]
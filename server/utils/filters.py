@@ -0,0 +1,112 @@
+"""Whole-image filter engine.
+
+Each filter runs over the entire image in a single Pillow call (colour
+matrix, lookup table or convolution kernel) instead of looping over pixels
+in Python. Alpha is split off before filtering and put back afterwards, so
+transparent images keep their transparency.
+"""
+from collections import namedtuple
+
+from PIL import ImageEnhance, ImageFilter, ImageOps
+
+# Classic sepia tone coefficients (rows are output R, G, B).
+SEPIA_MATRIX = (
+    0.393, 0.769, 0.189, 0,
+    0.349, 0.686, 0.168, 0,
+    0.272, 0.534, 0.131, 0,
+)
+
+# `pointwise` filters only look at one pixel at a time, so they can be moved
+# around crops and flips (or run on strips) without changing the result.
+# None of them commute exactly with resampling: both round to 8 bits.
+# `copies` counts the full-size temporaries a filter makes besides its output
+# (splitting off alpha comes on top, see ALPHA_COPIES).
+Filter = namedtuple("Filter", ["apply", "pointwise", "copies"], defaults=(0,))
+ALPHA_COPIES = 1.25  # The RGB conversion and the alpha band
+
+
+def _split_alpha(image):
+    if image.mode in ("RGB", "L"):
+        return image, None
+    if image.mode == "LA":
+        return image.convert("L"), image.getchannel("A")
+    if image.mode == "RGBA" or "transparency" in image.info or image.mode == "PA":
+        image = image.convert("RGBA")
+        return image.convert("RGB"), image.getchannel("A")
+    return image.convert("RGB"), None
+
+
+def _restore_alpha(image, alpha):
+    if alpha is not None:
+        image.putalpha(alpha)
+    return image
+
+
+def _lut(func, bands):
+    table = [max(0, min(255, int(func(i) + 0.5))) for i in range(256)]
+    return table * bands
+
+
+def _grayscale(image, options):
+    return image.convert("L")
+
+
+def _sepia(image, options):
+    return image.convert("RGB").convert("RGB", SEPIA_MATRIX)
+
+
+def _invert(image, options):
+    return ImageOps.invert(image)
+
+
+def _brightness(image, options):
+    factor = float(options.get("factor", 1.0))
+    return image.point(_lut(lambda v: v * factor, len(image.getbands())))
+
+
+def _contrast(image, options):
+    # Stretch around mid-grey rather than the image mean so the result does
+    # not depend on which part of the image is being processed.
+    factor = float(options.get("factor", 1.0))
+    return image.point(_lut(lambda v: (v - 128) * factor + 128, len(image.getbands())))
+
+
+def _saturation(image, options):
+    if image.mode == "L":
+        return image
+    return ImageEnhance.Color(image).enhance(float(options.get("factor", 1.0)))
+
+
+def _sharpen(image, options):
+    radius = float(options.get("radius", 2))
+    percent = int(options.get("amount", 150))
+    return image.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=3))
+
+
+def _blur(image, options):
+    return image.filter(ImageFilter.GaussianBlur(radius=float(options.get("radius", 2))))
+
+
+FILTERS = {
+    "grayscale": Filter(_grayscale, pointwise=True),
+    "sepia": Filter(_sepia, pointwise=True, copies=1),
+    "invert": Filter(_invert, pointwise=True),
+    "brightness": Filter(_brightness, pointwise=True),
+    "contrast": Filter(_contrast, pointwise=True),
+    "saturation": Filter(_saturation, pointwise=True, copies=1),
+    "sharpen": Filter(_sharpen, pointwise=False, copies=1),
+    "blur": Filter(_blur, pointwise=False, copies=1),
+}
+
+
+def get_filter(name):
+    try:
+        return FILTERS[name]
+    except KeyError:
+        raise ValueError(f"Unsupported filter: {name}")
+
+
+def apply_filter(image, name, options=None):
+    entry = get_filter(name)
+    color, alpha = _split_alpha(image)
+    return _restore_alpha(entry.apply(color, options or {}), alpha)
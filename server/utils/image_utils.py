@@ -1,7 +1,9 @@
 from PIL import Image, ImageOps, ImageEnhance, ImageFilter, ImageDraw, ImageFont
-from rembg import remove
 import io
 
+from server.extensions import background_remover
+from server.utils.filters import apply_filter
+
 def resize_image(image, width, height):
     return image.resize((width, height))
 
@@ -30,12 +32,13 @@ def convert_format(image, fmt):
     return Image.open(buf)
 
 def grayscale_image(image):
-    return image.convert("L")
+    return apply_filter(image, "grayscale")
 
 def sepia_image(image):
-    grayscale = image.convert("L")
-    sepia = ImageOps.colorize(grayscale, "#704214", "#C0A080")
-    return sepia
+    return apply_filter(image, "sepia")
+
+def filter_image(image, name, **options):
+    return apply_filter(image, name, options)
 
 def watermark_image(image, text="Pik-Cha", position=(10, 10), opacity=128):
     watermark = Image.new("RGBA", image.size)
@@ -46,8 +49,4 @@ def watermark_image(image, text="Pik-Cha", position=(10, 10), opacity=128):
     return watermarked.convert("RGB")
 
 def remove_background(image):
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    result = remove(buf.read())
-    return Image.open(io.BytesIO(result))
+    return background_remover.remove(image)
@@ -0,0 +1,182 @@
+"""Single-pass upload ingest.
+
+`IngestRequest` makes Werkzeug's multipart parser write each uploaded file
+straight into a temp file inside `UPLOAD_FOLDER`. While the bytes go by,
+`IngestFile` hashes them and sniffs the image header (format, mode, size),
+so once parsing finishes the upload can be validated and atomically renamed
+into place without reading it again or decoding any pixels. Bytes past the
+per-file limit are counted but never written.
+
+Only views marked `batch_upload` get the larger `UPLOAD_BATCH_MAX_BYTES`
+body limit and more than one file part; the file count is enforced while
+the body streams, so an oversized batch is refused before it is all read.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from io import BytesIO
+
+from flask import Request, current_app
+from PIL import Image as PILImage
+
+HEADER_LIMIT = 1024 * 1024  # Give up sniffing after this many bytes
+
+Ingested = namedtuple("Ingested", ["digest", "size", "format", "mode", "dimensions"])
+
+
+class IngestError(Exception):
+    pass
+
+
+class IngestFile:
+    def __init__(self, folder, header_limit=HEADER_LIMIT, max_bytes=None):
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix=".ingest-", suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._head = bytearray()
+        self._header_limit = header_limit
+        self._committed = False
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.header = None
+        self.too_large = False
+
+    @property
+    def oversized(self):
+        return bool(self.max_bytes) and self.size > self.max_bytes
+
+    def write(self, data):
+        self.size += len(data)
+        if self.oversized:
+            return len(data)  # Rejected once parsing ends; don't fill the disk
+        self._digest.update(data)
+        if self.header is None and not self.too_large and len(self._head) < self._header_limit:
+            self._head += data
+            self._sniff()
+        return self._file.write(data)
+
+    def _sniff(self):
+        try:
+            # Image.open only parses the header; pixel data is never touched.
+            with PILImage.open(BytesIO(self._head)) as im:
+                self.header = (im.format, im.mode, im.size)
+        except PILImage.DecompressionBombError:
+            self.too_large = True
+        except Exception:
+            return
+        self._head = bytearray()
+
+    @property
+    def digest(self):
+        return self._digest.hexdigest()
+
+    def commit(self, dest):
+        self._file.flush()
+        os.replace(self.path, dest)
+        self._committed = True
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        if name == "_file":
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+
+class IngestRequest(Request):
+    @property
+    def batch_upload(self):
+        view = current_app.view_functions.get(self.endpoint)
+        return getattr(getattr(view, "view_class", None), "batch_upload", False)
+
+    @property
+    def max_content_length(self):
+        # Each file is still held to MAX_CONTENT_LENGTH as it is written.
+        limit = current_app.config.get("MAX_CONTENT_LENGTH")
+        batch_limit = current_app.config.get("UPLOAD_BATCH_MAX_BYTES")
+        if limit and batch_limit and self.batch_upload:
+            return max(limit, batch_limit)
+        return limit
+
+    @property
+    def max_files(self):
+        return current_app.config.get("UPLOAD_MAX_FILES", 50) if self.batch_upload else 1
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        streams = self.__dict__.setdefault("_ingest_files", [])
+        if len(streams) >= self.max_files:
+            raise IngestError(f"At most {self.max_files} files can be uploaded at once")
+        stream = IngestFile(current_app.config["UPLOAD_FOLDER"], max_bytes=current_app.config.get("MAX_CONTENT_LENGTH"))
+        streams.append(stream)
+        return stream
+
+    def close(self):
+        # Parts of a body that failed to parse never reach `files`.
+        super().close()
+        for stream in self.__dict__.get("_ingest_files", ()):
+            stream.close()
+
+
+def _as_ingest_file(file, folder, max_bytes=None):
+    if isinstance(file.stream, IngestFile):
+        return file.stream
+    # Uploads parsed outside IngestRequest still get a single copy pass.
+    ingest = IngestFile(folder, max_bytes=max_bytes)
+    file.stream.seek(0)
+    shutil.copyfileobj(file.stream, ingest)
+    return ingest
+
+
+def validate_upload(file, folder, max_pixels=None, max_bytes=None):
+    """Check an uploaded file from its sniffed header. Returns the pending
+    `IngestFile` (call `commit` or `close` on it) and what was learned."""
+    ingest = _as_ingest_file(file, folder, max_bytes)
+    if ingest.oversized or (max_bytes and ingest.size > max_bytes):
+        ingest.close()
+        raise IngestError("File is too large")
+    header = ingest.header
+    if header is None and not ingest.too_large:
+        # Header bigger than the sniffing window: read it from the temp file.
+        try:
+            ingest.flush()
+            with PILImage.open(ingest.path) as im:
+                header = (im.format, im.mode, im.size)
+        except PILImage.DecompressionBombError:
+            ingest.too_large = True
+        except Exception:
+            header = None
+
+    if ingest.too_large or (header and max_pixels and header[2][0] * header[2][1] > max_pixels):
+        ingest.close()
+        raise IngestError("Image dimensions are too large")
+    if header is None:
+        ingest.close()
+        raise IngestError("Uploaded file is not a valid image")
+
+    return ingest, Ingested(ingest.digest, ingest.size, *header)
+
+
+def verify_upload(ingest):
+    """Check the whole file's structure (chunk CRCs, truncation) rather than
+    just its header. Closes the upload and raises IngestError if it fails."""
+    ingest.flush()
+    try:
+        with PILImage.open(ingest.path) as im:
+            im.verify()
+    except Exception:
+        ingest.close()
+        raise IngestError("Uploaded file is corrupt")
+
+
+def ingest_upload(file, dest, max_pixels=None):
+    """Validate an uploaded file from its header and move it to `dest`."""
+    ingest, ingested = validate_upload(file, os.path.dirname(dest), max_pixels)
+    ingest.commit(dest)
+    ingest.close()
+    return ingested
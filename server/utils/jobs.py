@@ -0,0 +1,210 @@
+"""Job queue for slow transformations.
+
+Work runs on a local process pool so Pillow and rembg never block a request
+thread. The queue is bounded: once `TRANSFORM_QUEUE_SIZE` jobs are waiting
+or running in this process, `submit` raises `QueueFull` and callers should
+answer 503.
+
+Job status and results are stored in the `transform_jobs` table, so any web
+worker can answer a status poll and finished results survive a restart.
+Only the process that accepted a job can tell "queued" from "running";
+elsewhere a job reads as queued until it finishes. Jobs still pending at
+shutdown are marked failed. The newest `TRANSFORM_JOB_HISTORY` finished
+jobs are kept.
+
+Batch requests use a second pool via `run_batch`, which blocks until every
+item has finished or failed. By default it gets this web worker's share of
+the CPUs (`cpu_count // WEB_WORKERS`), so all workers together start about
+one batch process per core.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+class QueueFull(Exception):
+    pass
+
+
+def batch_pool_size(web_workers=None):
+    """Batch processes for one web worker: the CPUs split between workers."""
+    return max(1, (os.cpu_count() or 1) // max(1, web_workers or 1))
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 1
+        self.max_pending = 1
+        self.history = 1000
+        self.batch_workers = batch_pool_size()
+        self._executor = None
+        self._batch_executor = None
+        self._slots = None
+        self._db = None
+        self._model = None
+        self._futures = {}  # Job id -> future, for jobs accepted by this process
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Imported here: the models import server.extensions, which imports us
+        from server.extensions import db
+        from server.models.job import TransformJob
+
+        self.app = app
+        self.workers = app.config.get("TRANSFORM_WORKERS", 2)
+        self.max_pending = app.config.get("TRANSFORM_QUEUE_SIZE", 32)
+        self.history = app.config.get("TRANSFORM_JOB_HISTORY", 1000)
+        self.batch_workers = app.config.get("BATCH_WORKERS") or batch_pool_size(app.config.get("WEB_WORKERS"))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._db = db
+        self._model = TransformJob
+
+    @property
+    def executor(self):
+        # Created on first use so forked web workers each get their own pool.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    @property
+    def batch_executor(self):
+        with self._lock:
+            if self._batch_executor is None:
+                self._batch_executor = ProcessPoolExecutor(max_workers=self.batch_workers)
+            return self._batch_executor
+
+    def run_batch(self, fn, calls):
+        """Run `fn(*args)` for each args tuple in `calls` and return a
+        `(value, error)` pair per call, in order. One failure never stops
+        the others."""
+        futures = [self.batch_executor.submit(fn, *args) for args in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append((future.result(), None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+    @property
+    def depth(self):
+        """Jobs queued or running in this process."""
+        with self._lock:
+            return len(self._futures)
+
+    def _new_job(self, owner):
+        job = self._model(id=uuid.uuid4().hex, owner_id=owner, status="queued")
+        self._db.session.add(job)
+        self._db.session.commit()
+        return job.id
+
+    def _finish(self, job_id, result=None, error=None):
+        session = self._db.session
+        with self.app.app_context():
+            session.rollback()  # Whatever on_done left behind
+            job = session.get(self._model, job_id)
+            if job is None:
+                return
+            job.status = "failed" if error else "done"
+            job.result = result
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            session.flush()
+            self._prune()
+            session.commit()
+
+    def _prune(self):
+        model = self._model
+        cutoff = (
+            self._db.session.query(model.finished_at)
+            .filter(model.finished_at.isnot(None))
+            .order_by(model.finished_at.desc())
+            .offset(self.history)
+            .limit(1)
+            .scalar()
+        )
+        if cutoff is not None:
+            model.query.filter(model.finished_at <= cutoff).delete(synchronize_session=False)
+
+    def submit(self, fn, *args, owner=None, on_done=None, on_finish=None):
+        """Run `fn(*args)` on the pool. `on_done(value)` runs back in this
+        process inside an app context and its return value becomes the job
+        result. `on_finish()` runs once the job has ended either way."""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull("Transform queue is full")
+
+        job_id = None
+        try:
+            job_id = self._new_job(owner)
+            future = self.executor.submit(fn, *args)
+        except Exception as e:
+            if job_id is not None:
+                self._finish(job_id, error=str(e))
+            self._slots.release()
+            if on_finish is not None:
+                on_finish()
+            raise
+
+        with self._lock:
+            self._futures[job_id] = future
+
+        def _done(future):
+            try:
+                value = future.result()
+                if on_done is not None:
+                    with self.app.app_context():
+                        value = on_done(value)
+                self._finish(job_id, result=value)
+            except Exception as e:
+                # A cancelled future raises CancelledError with no message.
+                self._finish(job_id, error=str(e) or type(e).__name__)
+            finally:
+                with self._lock:
+                    self._futures.pop(job_id, None)
+                self._slots.release()
+                if on_finish is not None:
+                    on_finish()
+
+        future.add_done_callback(_done)
+        return job_id
+
+    def complete(self, result, owner=None):
+        """Record work that finished without needing the pool (e.g. a cache hit)."""
+        job_id = self._new_job(owner)
+        self._finish(job_id, result=result)
+        return job_id
+
+    def get(self, job_id):
+        job = self._db.session.get(self._model, job_id, populate_existing=True)
+        if job is None:
+            return None
+        status = job.status
+        with self._lock:
+            future = self._futures.get(job_id)
+        if status == "queued" and future is not None and future.running():
+            status = "running"
+        return {
+            "id": job.id,
+            "owner": job.owner_id,
+            "status": status,
+            "result": job.result,
+            "error": job.error,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executors = [self._executor, self._batch_executor]
+            self._executor = self._batch_executor = None
+            futures = list(self._futures.values())
+        # cancel_futures needs Python 3.9; the Pipfile targets 3.8. Cancelling
+        # runs the done callback here, which takes the lock, so release it first.
+        for future in futures:
+            future.cancel()
+        for executor in filter(None, executors):
+            executor.shutdown(wait=False)
@@ -1,7 +1,10 @@
 from flask import current_app
 import jwt
+import logging
 from datetime import datetime, timedelta
 
+log = logging.getLogger(__name__)
+
 def generate_token(user_id):
     secret_key = current_app.config.get("JWT_SECRET_KEY", "pikcha-jwt-secret-key-2024")
     expires_delta = current_app.config.get("JWT_ACCESS_TOKEN_EXPIRES", timedelta(days=7))
@@ -18,11 +21,11 @@ def decode_token(token):
         payload = jwt.decode(token, secret_key, algorithms=["HS256"])
         return payload["user_id"]
     except jwt.ExpiredSignatureError:
-        print("Token has expired")
+        log.debug("Token has expired")
         return None
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token: {str(e)}")
+        log.info("Invalid token: %s", e)
         return None
     except Exception as e:
-        print(f"Error decoding token: {str(e)}")
+        log.warning("Error decoding token: %s", e)
         return None
@@ -0,0 +1,38 @@
+"""Logging setup for the `server` package.
+
+Records go through one handler on the `server` logger, which the app logger
+(`server.config`) and every module logger propagate to. `LOG_LEVEL` sets the
+threshold. `LOG_SAMPLE_RATE` keeps only that fraction of records below
+WARNING, so per-request debug and info lines can stay enabled under load.
+Warnings and errors are always kept.
+"""
+import logging
+import random
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(app):
+    logger = logging.getLogger("server")
+    logger.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+    handler = next((h for h in logger.handlers if getattr(h, "pikcha", False)), None)
+    if handler is None:
+        handler = logging.StreamHandler()
+        handler.pikcha = True
+        handler.setFormatter(logging.Formatter(FORMAT))
+        handler.addFilter(SampleFilter())
+        logger.addHandler(handler)
+    for f in handler.filters:
+        if isinstance(f, SampleFilter):
+            f.rate = app.config.get("LOG_SAMPLE_RATE", 1.0)
+    # Flask's logger defaults to the root level; follow ours instead
+    app.logger.setLevel(logging.NOTSET)
@@ -0,0 +1,167 @@
+"""Request and stage timings, exposed as Server-Timing and Prometheus metrics.
+
+`stage("decode")` times a block of request work. Each stage is added to the
+response's `Server-Timing` header and to the `pikcha_stage_duration_seconds`
+histogram, labelled with the endpoint. Every request is also recorded in
+`pikcha_request_duration_seconds`. `/metrics` serves these histograms in the
+Prometheus text format, together with gauges and counters read at scrape
+time: transform queue depth, transform cache hits and misses, and the pixel
+budget in use.
+
+Metrics live in process memory, with no client library. Behind several
+workers, each worker reports its own numbers, so scrape them per process or
+sum the series.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Seconds; covers a cache hit through a large background removal.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._series.get(labels, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(c), s)) for k, (c, s) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.label_names + ("le",), labels + (f"{bound:g}" if bound != "+Inf" else bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Collected:
+    """A gauge or counter whose value is read from `fn()` at scrape time."""
+
+    def __init__(self, name, help, type, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", f"{self.name} {self.fn()}"]
+
+
+def _timing_name(name):
+    return "".join(c if c.isalnum() or c in "-_" else "-" for c in name)
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.server_timing = True
+        self.requests = Histogram(
+            "pikcha_request_duration_seconds", "Time spent handling requests.", ("endpoint", "method", "status"),
+        )
+        self.stages = Histogram(
+            "pikcha_stage_duration_seconds", "Time spent in each stage of a request.", ("endpoint", "stage"),
+        )
+        self._collected = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from server.extensions import job_queue, pixel_budget, transform_cache
+
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        self.server_timing = app.config.get("SERVER_TIMING", True)
+        if not self.enabled:
+            return
+        self._collected = [
+            Collected("pikcha_transform_queue_depth", "Transform jobs queued or running.", "gauge",
+                      lambda: job_queue.depth),
+            Collected("pikcha_transform_cache_hits_total", "Transform cache hits.", "counter",
+                      lambda: transform_cache.stats()["hits"]),
+            Collected("pikcha_transform_cache_misses_total", "Transform cache misses.", "counter",
+                      lambda: transform_cache.stats()["misses"]),
+            Collected("pikcha_transform_cache_evictions_total", "Transform cache evictions.", "counter",
+                      lambda: transform_cache.stats()["evictions"]),
+            Collected("pikcha_pixel_budget_in_use_bytes", "Decoded pixel memory reserved by running work.", "gauge",
+                      lambda: pixel_budget.stats()["in_use_bytes"]),
+        ]
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule("/metrics", "metrics", self.render_response)
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+        g.stage_timings = []
+
+    def _finish(self, response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unmatched"
+        if endpoint != "metrics":
+            self.requests.observe(elapsed, endpoint, request.method, response.status_code)
+        timings = g.pop("stage_timings", [])
+        if self.server_timing:
+            entries = [f"{_timing_name(name)};dur={seconds * 1000:.1f}" for name, seconds in timings]
+            entries.append(f"total;dur={elapsed * 1000:.1f}")
+            response.headers.add("Server-Timing", ", ".join(entries))
+        return response
+
+    def record(self, name, seconds):
+        """Record a stage timed elsewhere (e.g. inside `render_plan`)."""
+        if not self.enabled or not has_request_context():
+            return
+        self.stages.observe(seconds, request.endpoint or "unmatched", name)
+        timings = g.get("stage_timings")
+        if timings is not None:
+            timings.append((name, seconds))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def render(self):
+        lines = self.requests.render() + self.stages.render()
+        for metric in self._collected:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def render_response(self):
+        from flask import current_app
+
+        return current_app.response_class(self.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,117 @@
+"""Accept-based format negotiation for stored images.
+
+Browsers that accept AVIF or WebP get a re-encoded copy of a stored JPEG or
+PNG instead of the original. The copy sits next to the source as
+`<filename>.<ext>` and is written on first request. When it comes out no
+smaller than the source, an empty `<filename>.<ext>.none` marker records
+that, and the original keeps being served. JPEG sources are re-encoded lossy
+at `NEGOTIATE_QUALITY`. PNG sources only get lossless WebP, so their pixels
+never change. Copies older than their source are rebuilt.
+
+Only explicit `image/avif` / `image/webp` entries in Accept count; `*/*`
+does not. Responses for negotiable files carry `Vary: Accept` whichever file
+is sent.
+"""
+import os
+import uuid
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from server.utils.admission import AdmissionRejected
+from server.utils.encoders import SAVE_FORMATS, prepare_mode, save_options
+
+NEGOTIABLE = {".jpg": "lossy", ".jpeg": "lossy", ".png": "lossless"}
+MIMETYPES = {"avif": "image/avif", "webp": "image/webp"}
+# Formats that can re-encode without losing pixels
+LOSSLESS_FORMATS = {"webp"}
+
+
+def negotiable(filename):
+    return os.path.splitext(filename)[1].lower() in NEGOTIABLE
+
+
+def accepts(accept, mimetype):
+    """True when the Accept header lists `mimetype` itself with q > 0."""
+    return any(value == mimetype and quality > 0 for value, quality in accept)
+
+
+def candidates(filename, accept, formats):
+    """Alternate formats to try for `filename`, best first."""
+    mode = NEGOTIABLE.get(os.path.splitext(filename)[1].lower())
+    if mode is None:
+        return []
+    return [
+        ext for ext in formats
+        if ext in SAVE_FORMATS and ext in MIMETYPES and accepts(accept, MIMETYPES[ext])
+        and (mode == "lossy" or ext in LOSSLESS_FORMATS)
+    ]
+
+
+def alternate_paths(folder, filename, formats=tuple(MIMETYPES)):
+    """Every alternate and marker file that may exist for `filename`."""
+    base = os.path.join(folder, filename)
+    return [base + suffix for ext in formats for suffix in (f".{ext}", f".{ext}.none")]
+
+
+def _fresh(path, source):
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source)
+    except FileNotFoundError:
+        return False
+
+
+def encode_alternate(source, ext, quality):
+    """Write `<source>.<ext>`. Returns its path, or None when it would not be
+    smaller than the source (a marker is left instead)."""
+    path = f"{source}.{ext}"
+    lossless = NEGOTIABLE[os.path.splitext(source)[1].lower()] == "lossless"
+    fmt = SAVE_FORMATS[ext]
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with PILImage.open(source) as image:
+        # The alternate carries no EXIF, so bake the orientation in
+        image = prepare_mode(ImageOps.exif_transpose(image), fmt)
+        options = save_options(fmt, {"ext": ext, "quality": quality, "lossless": lossless})
+        if image.info.get("icc_profile"):
+            options["icc_profile"] = image.info["icc_profile"]
+        image.save(tmp, fmt, **options)
+
+    if os.path.getsize(tmp) >= os.path.getsize(source):
+        os.remove(tmp)
+        open(f"{path}.none", "w").close()
+        return None
+    os.replace(tmp, path)
+    return path
+
+
+def _decoded_bytes(source):
+    from server.utils.strips import image_bytes
+
+    with PILImage.open(source) as image:
+        return image_bytes(image.size)
+
+
+def negotiate(folder, filename, accept, formats, quality, budget=None):
+    """File name to send for `filename` given the request's Accept header.
+
+    Encoding a missing alternate reserves its decoded size from `budget` (a
+    `PixelBudget`) without waiting; when there is no room the next candidate,
+    or the original, is sent this time."""
+    source = os.path.join(folder, filename)
+    for ext in candidates(filename, accept, formats):
+        path = f"{source}.{ext}"
+        if _fresh(path, source):
+            return f"{filename}.{ext}"
+        if _fresh(f"{path}.none", source):
+            continue
+        try:
+            reservation = budget.reserve(_decoded_bytes(source), timeout=0) if budget else None
+        except AdmissionRejected:
+            continue
+        try:
+            if encode_alternate(source, ext, quality):
+                return f"{filename}.{ext}"
+        finally:
+            if reservation:
+                reservation.release()
+    return filename
@@ -0,0 +1,64 @@
+"""Keyset pagination for image listings.
+
+Pages are ordered newest first by `(created_at, id)`. The cursor is the key
+of the last row served, so each page is one range query on an index,
+whatever its depth. Offset paging, by contrast, rescans every earlier row.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Metadata keys that each record one applied transformation
+TRANSFORMATION_KEYS = (
+    "width", "height", "crop_box", "rotation_angle",
+    "watermark", "flipped", "mirrored", "compressed_quality",
+    "format", "filter", "background_removed",
+)
+
+
+def count_transformations(metadata):
+    return sum(1 for key in (metadata or {}) if key in TRANSFORMATION_KEYS)
+
+
+def encode_cursor(image):
+    payload = json.dumps([image.created_at.isoformat(), image.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, image_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), image_id
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def keyset_page(query, model, limit, cursor=None):
+    """Returns (rows, next cursor or None)."""
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < last_id),
+        ))
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
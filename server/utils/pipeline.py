@@ -0,0 +1,508 @@
+"""Planning and execution of transformation pipelines.
+
+`plan_transformations` turns the client's `transformations` list into a
+normalized list of steps before any pixels are touched:
+
+* flips, mirrors and right-angle rotations are fused into one transpose
+  (flip + mirror becomes a single 180 degree rotation);
+* crops are moved ahead of resizes, with the crop box scaled to match and
+  folded into the resize itself (`box`), so only the kept region is
+  resampled (except when the resize first reduces by `reducing_gap`, or
+  runs on a palette or bilevel image, which Pillow always resamples with
+  nearest neighbour: a shifted fractional box picks other source pixels);
+* pointwise filters run after crops, on fewer pixels;
+* no-op steps (resize to the same size, full-size crops, zero rotations)
+  are dropped.
+
+`execute_plan` then applies the steps to a Pillow image. `render_plan` also
+handles decoding: when the plan starts with a downscale, JPEG sources are
+decoded straight to a smaller size with DCT scaling (`Image.draft`) and the
+rest of the reduction uses `reducing_gap`, so a thumbnail of a large photo
+never materializes at full resolution. The result is written by
+`server.utils.encoders`: the `format` transformation picks the output type
+and `compress` its quality. `render_plans` renders several plans in one
+worker so their background removals share a single model run.
+"""
+import logging
+import math
+import time
+
+from PIL import Image as PILImage
+from PIL import ImageDraw, ImageFont
+
+from server.extensions import background_remover
+from server.utils.encoders import (
+    DEFAULT_EFFORT, DEFAULT_QUALITY, encode, output_extension, parse_effort, parse_quality,
+)
+from server.utils.filters import apply_filter, get_filter
+
+log = logging.getLogger(__name__)
+
+# Orientation changes as 2x2 matrices acting on (x, y) with y pointing down.
+TRANSPOSE_MATRICES = {
+    "FLIP_LEFT_RIGHT": ((-1, 0), (0, 1)),
+    "FLIP_TOP_BOTTOM": ((1, 0), (0, -1)),
+    "ROTATE_90": ((0, 1), (-1, 0)),
+    "ROTATE_180": ((-1, 0), (0, -1)),
+    "ROTATE_270": ((0, -1), (1, 0)),
+    "TRANSPOSE": ((0, 1), (1, 0)),
+    "TRANSVERSE": ((0, -1), (-1, 0)),
+}
+IDENTITY = ((1, 0), (0, 1))
+ROTATIONS = {0: None, 90: "ROTATE_90", 180: "ROTATE_180", 270: "ROTATE_270"}
+
+# Quality-vs-speed trade-offs for resampling. `reducing_gap` lets Pillow (and
+# the JPEG decoder) shrink by whole factors first, as long as the remaining
+# resample still works on at least that many source pixels per output pixel.
+RESAMPLE_PRESETS = {
+    "fast": {"resample": "BILINEAR", "reducing_gap": 2.0},
+    "balanced": {"resample": "BICUBIC", "reducing_gap": 3.0},
+    "best": {"resample": "LANCZOS", "reducing_gap": None},
+}
+DEFAULT_PRESET = "balanced"
+# Modes Pillow resizes with nearest neighbour whatever filter is asked for
+NEAREST_MODES = ("P", "1")
+
+def _matmul(a, b):
+    return tuple(
+        tuple(sum(a[i][k] * b[k][j] for k in range(2)) for j in range(2))
+        for i in range(2)
+    )
+
+
+def _matrix_to_method(matrix):
+    if matrix == IDENTITY:
+        return None
+    for method, candidate in TRANSPOSE_MATRICES.items():
+        if candidate == matrix:
+            return method
+    raise ValueError(f"Not an orientation matrix: {matrix}")
+
+
+def _swaps_axes(method):
+    return method in ("ROTATE_90", "ROTATE_270", "TRANSPOSE", "TRANSVERSE")
+
+
+def _rotated_size(size, angle):
+    # Mirrors Image.rotate(..., expand=True) step for step, centre translation
+    # included: the float rounding decides the extra pixel on the edges.
+    w, h = size
+    angle = angle % 360.0
+    if angle == 0 or angle == 180:
+        return (w, h)
+    if angle in (90, 270):
+        return (h, w)
+    cx, cy = w / 2, h / 2
+    radians = -math.radians(angle)
+    a, b = round(math.cos(radians), 15), round(math.sin(radians), 15)
+    d, e = round(-math.sin(radians), 15), round(math.cos(radians), 15)
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+    xs = [a * x + b * y + c for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    ys = [d * x + e * y + f for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    return (
+        math.ceil(max(xs)) - math.floor(min(xs)),
+        math.ceil(max(ys)) - math.floor(min(ys)),
+    )
+
+
+def step_output_size(step, size):
+    op = step["op"]
+    if op == "resize":
+        return (step["width"], step["height"])
+    if op == "crop":
+        left, top, right, bottom = step["box"]
+        return (right - left, bottom - top)
+    if op == "transpose" and _swaps_axes(step["method"]):
+        return (size[1], size[0])
+    if op == "rotate":
+        return _rotated_size(size, step["angle"])
+    return size
+
+
+def _sizes(steps, size):
+    sizes = [size]
+    for step in steps:
+        size = step_output_size(step, size)
+        sizes.append(size)
+    return sizes
+
+
+def _parse(transformations, size, preset):
+    """Translate client transformations into raw steps, output options and
+    the metadata recorded for the requested (not the optimized) pipeline."""
+    if preset not in RESAMPLE_PRESETS:
+        raise ValueError(f"Unsupported resample preset: {preset}")
+    steps = []
+    output = {"ext": None, "quality": DEFAULT_QUALITY, "effort": DEFAULT_EFFORT, "lossless": False}
+    metadata = {}
+    for transformation in transformations:
+        type = transformation.get("type")
+        options = transformation.get("options", {}) or {}
+
+        if type == "resize":
+            step = {
+                "op": "resize",
+                "width": int(options.get("width", size[0])),
+                "height": int(options.get("height", size[1])),
+                **RESAMPLE_PRESETS[preset],
+            }
+            metadata.update({"width": step["width"], "height": step["height"]})
+        elif type == "crop":
+            step = {"op": "crop", "box": [
+                int(options.get("left", 0)),
+                int(options.get("top", 0)),
+                int(options.get("right", size[0])),
+                int(options.get("bottom", size[1])),
+            ]}
+            metadata.update({"crop_box": list(step["box"])})
+        elif type == "rotate":
+            angle = int(options.get("angle", 0))
+            metadata.update({"rotation_angle": angle})
+            if angle % 90 == 0:
+                step = {"op": "transpose", "method": ROTATIONS[angle % 360]}
+            else:
+                step = {"op": "rotate", "angle": angle}
+        elif type == "flip":
+            step = {"op": "transpose", "method": "FLIP_TOP_BOTTOM"}
+            metadata.update({"flipped": True})
+        elif type == "mirror":
+            step = {"op": "transpose", "method": "FLIP_LEFT_RIGHT"}
+            metadata.update({"mirrored": True})
+        elif type == "watermark":
+            step = {"op": "watermark", "text": options.get("text", "Pik-Cha")}
+            metadata.update({"watermark": step["text"]})
+        elif type == "compress":
+            step = None
+            output["quality"] = parse_quality(options.get("quality", 75))
+            if "effort" in options:
+                output["effort"] = parse_effort(options["effort"])
+            metadata.update({"compressed_quality": output["quality"]})
+        elif type == "format":
+            fmt = options.get("format", "JPEG").upper()
+            output["ext"] = output_extension(fmt)
+            output["lossless"] = bool(options.get("lossless", False))
+            if "effort" in options:
+                output["effort"] = parse_effort(options["effort"])
+            metadata.update({"format": fmt})
+            step = {"op": "convert", "mode": "RGB"} if fmt in ("JPEG", "JPG") else None
+        elif type == "filter":
+            name = options.get("filter")
+            get_filter(name)
+            params = {k: v for k, v in options.items() if k != "filter"}
+            step = {"op": "filter", "filter": name, "options": params}
+            metadata.update({"filter": name})
+        elif type == "remove_bg":
+            step = {"op": "remove_bg"}
+            metadata.update({"background_removed": True})
+        else:
+            raise ValueError(f"Unsupported transformation type: {type}")
+
+        if step is not None:
+            steps.append(step)
+            size = step_output_size(step, size)
+    if output["ext"] is None:
+        # Keep the transparency background removal produces
+        output["ext"] = "png" if any(s["op"] == "remove_bg" for s in steps) else "jpg"
+    return steps, output, metadata
+
+
+def _is_pointwise_filter(step):
+    return step["op"] == "filter" and get_filter(step["filter"]).pointwise
+
+
+def _within(box, size):
+    left, top, right, bottom = box
+    return left >= 0 and top >= 0 and right <= size[0] and bottom <= size[1]
+
+
+def _nearest_inputs(steps, mode):
+    """For each step, whether its input may still be in a mode that Pillow
+    only resamples with nearest neighbour ("P" or "1")."""
+    nearest = mode in NEAREST_MODES
+    flags = []
+    for step in steps:
+        flags.append(nearest)
+        if step["op"] in ("convert", "remove_bg"):
+            nearest = step.get("mode", "RGBA") in NEAREST_MODES
+    return flags
+
+
+def _rewrite_pair(first, second, size, nearest=False):
+    """Return replacement steps for an adjacent pair, or None to keep it.
+    `nearest` says the pair's input may be resampled with nearest neighbour."""
+    if first["op"] == "transpose" and second["op"] == "transpose":
+        a = TRANSPOSE_MATRICES.get(first["method"], IDENTITY)
+        b = TRANSPOSE_MATRICES.get(second["method"], IDENTITY)
+        method = _matrix_to_method(_matmul(b, a))
+        return [{"op": "transpose", "method": method}]
+
+    if first["op"] == "resize" and second["op"] == "crop" and not nearest:
+        width, height = first["width"], first["height"]
+        left, top, right, bottom = second["box"]
+        if right <= left or bottom <= top or not _within(second["box"], (width, height)):
+            return None
+        # Resampling only the source region under the crop gives the same
+        # pixels as resizing everything and cropping afterwards, up to float
+        # rounding in the filter weights (a level or two on a few pixels).
+        x0, y0, x1, y1 = first.get("box") or [0, 0, size[0], size[1]]
+        sx = (x1 - x0) / width
+        sy = (y1 - y0) / height
+        gap = first.get("reducing_gap")
+        if gap and max(sx, sy) >= 2 * gap:
+            # `reducing_gap` first reduces by whole blocks aligned to the
+            # box, which no longer line up with the full-frame blocks.
+            return None
+        box = [x0 + left * sx, y0 + top * sy, x0 + right * sx, y0 + bottom * sy]
+        return [dict(first, width=right - left, height=bottom - top, box=box)]
+
+    if first["op"] == "crop" and second["op"] == "crop":
+        l1, t1, r1, b1 = first["box"]
+        l2, t2, r2, b2 = second["box"]
+        if _within(first["box"], size) and _within(second["box"], (r1 - l1, b1 - t1)):
+            return [{"op": "crop", "box": [l1 + l2, t1 + t2, l1 + r2, t1 + b2]}]
+        return None
+
+    if _is_pointwise_filter(first):
+        # Out-of-bounds crops pad with black, which must not be filtered.
+        if second["op"] == "crop" and _within(second["box"], size):
+            return [second, first]
+
+    return None
+
+
+def _is_noop(step, size):
+    op = step["op"]
+    if op == "transpose":
+        return step["method"] is None
+    if op == "resize":
+        return "box" not in step and (step["width"], step["height"]) == tuple(size)
+    if op == "crop":
+        return step["box"] == [0, 0, size[0], size[1]]
+    if op == "rotate":
+        return step["angle"] % 360 == 0
+    return False
+
+
+def optimize_steps(steps, size, mode=None):
+    changed = True
+    while changed:
+        changed = False
+        sizes = _sizes(steps, size)
+        nearest = _nearest_inputs(steps, mode)
+        for index, step in enumerate(steps):
+            if _is_noop(step, sizes[index]):
+                steps = steps[:index] + steps[index + 1:]
+                changed = True
+                break
+        if changed:
+            continue
+        for index in range(len(steps) - 1):
+            replacement = _rewrite_pair(steps[index], steps[index + 1], sizes[index], nearest[index])
+            if replacement is not None:
+                steps = steps[:index] + replacement + steps[index + 2:]
+                changed = True
+                break
+    return steps
+
+
+class Plan:
+    def __init__(self, transformations, source_size, steps, output, metadata, preset=DEFAULT_PRESET):
+        self.transformations = transformations
+        self.source_size = tuple(source_size)
+        self.steps = steps
+        self.output = output
+        self.metadata = metadata
+        self.preset = preset
+
+    @property
+    def sizes(self):
+        return _sizes(self.steps, self.source_size)
+
+    @property
+    def output_size(self):
+        return self.sizes[-1]
+
+    def to_dict(self):
+        sizes = self.sizes
+        return {
+            "source_size": list(self.source_size),
+            "output_size": list(self.output_size),
+            "steps": [dict(step, size=list(sizes[i + 1])) for i, step in enumerate(self.steps)],
+            "output": self.output,
+            "preset": self.preset,
+            "requested_steps": len(self.transformations),
+        }
+
+
+def plan_transformations(transformations, source_size, optimize=True, preset=None, mode=None):
+    """`mode` is the source's Pillow mode; None means a continuous-tone one."""
+    preset = preset or DEFAULT_PRESET
+    steps, output, metadata = _parse(transformations, tuple(source_size), preset)
+    if optimize:
+        steps = optimize_steps(steps, tuple(source_size), mode)
+    return Plan(transformations, source_size, steps, output, metadata, preset)
+
+
+def _watermark(image, text):
+    if image.mode in ("P", "PA"):
+        # A full palette has no free entry for the text colour
+        image = image.convert("RGBA" if image.mode == "PA" or "transparency" in image.info else "RGB")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((10, 10), text, fill="white", font=font)
+    return image
+
+
+def apply_step(image, step):
+    op = step["op"]
+    if op == "resize":
+        box = tuple(step["box"]) if "box" in step else None
+        resample = PILImage.Resampling[step.get("resample", "BICUBIC")]
+        return image.resize(
+            (step["width"], step["height"]), resample, box=box,
+            reducing_gap=step.get("reducing_gap"),
+        )
+    if op == "crop":
+        return image.crop(tuple(step["box"]))
+    if op == "transpose":
+        if step["method"] is None:
+            return image
+        return image.transpose(PILImage.Transpose[step["method"]])
+    if op == "rotate":
+        return image.rotate(step["angle"], expand=True)
+    if op == "watermark":
+        return _watermark(image, step["text"])
+    if op == "convert":
+        return image.convert(step["mode"])
+    if op == "filter":
+        return apply_filter(image, step["filter"], step["options"])
+    if op == "remove_bg":
+        return background_remover.remove(image)
+    raise ValueError(f"Unsupported pipeline step: {op}")
+
+
+def execute_steps(image, steps):
+    for step in steps:
+        image = apply_step(image, step)
+    return image
+
+
+def execute_plan(image, plan):
+    return execute_steps(image, plan.steps)
+
+
+def open_for_plan(source_path, plan):
+    """Open the source, shrinking on load when the plan starts with a
+    downscale. Returns the image and the steps to run on it."""
+    image = PILImage.open(source_path)
+    steps = plan.steps
+    if not steps or steps[0]["op"] != "resize" or not steps[0].get("reducing_gap"):
+        return image, steps
+
+    first = steps[0]
+    width, height = image.size
+    x0, y0, x1, y1 = first.get("box") or [0, 0, width, height]
+    scale = min((x1 - x0) / first["width"], (y1 - y0) / first["height"])
+    gap = first["reducing_gap"]
+    if scale < 2 * gap:
+        return image, steps
+
+    # Ask for a decode that still leaves `gap` source pixels per output pixel.
+    requested = (math.ceil(width / scale * gap), math.ceil(height / scale * gap))
+    if image.draft(image.mode, requested) is None or image.size == (width, height):
+        return image, steps
+
+    fx, fy = image.size[0] / width, image.size[1] / height
+    box = [x0 * fx, y0 * fy, x1 * fx, y1 * fy]
+    return image, [dict(first, box=box)] + steps[1:]
+
+
+def _timed(timer, name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    timer(name, time.perf_counter() - start)
+    return result
+
+
+def render_plan(source_path, plan, dest_path, memory_budget=None, timer=None):
+    """Decode, transform and encode in one call. Safe to run in a worker process.
+
+    With a `memory_budget` (bytes), pipelines whose in-memory intermediates
+    would exceed it run in strips instead, if that lowers the estimated peak
+    (see `server.utils.strips`).
+    `timer(stage, seconds)`, if given, is called for decode, each step and
+    encode (which includes writing the file)."""
+    from server.utils.strips import execute_in_strips, saves_memory
+
+    timer = timer or (lambda name, seconds: None)
+    start = time.perf_counter()
+    image, steps = open_for_plan(source_path, plan)
+    image.load()
+    timer("decode", time.perf_counter() - start)
+
+    if saves_memory(image.mode, steps, image.size, memory_budget):
+        image = _timed(timer, "strips", execute_in_strips, image, steps, memory_budget)
+    else:
+        for step in steps:
+            name = step["filter"] if step["op"] == "filter" else step["op"]
+            image = _timed(timer, f"op-{name}", apply_step, image, step)
+    log.debug("Saving image: mode=%s, size=%s, ext=%s", image.mode, image.size, plan.output["ext"])
+    _timed(timer, "encode", encode, image, dest_path, plan.output)
+    return dest_path
+
+
+def removes_background(plan):
+    return any(step["op"] == "remove_bg" for step in plan.steps)
+
+
+def render_plans(calls):
+    """Run several `render_plan` argument tuples in one worker process and
+    return a `(value, error)` pair per call, in order. Background removal
+    is batched: every image waiting on a `remove_bg` step goes through the
+    model in one session call. Plans without it are rendered one by one."""
+    results = [None] * len(calls)
+    active = {}  # call index -> (image, remaining steps, plan, dest path)
+    for index, (source_path, plan, dest_path, *rest) in enumerate(calls):
+        if not removes_background(plan):
+            try:
+                results[index] = (render_plan(source_path, plan, dest_path, *rest), None)
+            except Exception as e:
+                results[index] = (None, str(e))
+            continue
+        try:
+            image, steps = open_for_plan(source_path, plan)
+            image.load()
+            active[index] = (image, steps, plan, dest_path)
+        except Exception as e:
+            results[index] = (None, str(e))
+
+    while active:
+        waiting = []
+        for index, (image, steps, plan, dest_path) in list(active.items()):
+            try:
+                while steps and steps[0]["op"] != "remove_bg":
+                    image = apply_step(image, steps[0])
+                    steps = steps[1:]
+                if steps:
+                    active[index] = (image, steps[1:], plan, dest_path)
+                    waiting.append(index)
+                else:
+                    encode(image, dest_path, plan.output)
+                    results[index] = (dest_path, None)
+                    del active[index]
+            except Exception as e:
+                results[index] = (None, str(e))
+                del active[index]
+        if not waiting:
+            continue
+        try:
+            removed = background_remover.remove_many([active[index][0] for index in waiting])
+        except Exception as e:
+            for index in waiting:
+                results[index] = (None, str(e))
+                del active[index]
+            continue
+        for index, image in zip(waiting, removed):
+            active[index] = (image,) + active[index][1:]
+    return results
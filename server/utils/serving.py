@@ -0,0 +1,95 @@
+"""Serving files from UPLOAD_FOLDER.
+
+Every stored file name is either content-addressed or unique per write
+(`<uuid hex>_<name>`, `<image id>_<token>_transformed.<ext>` and their
+`_<size>px` variants), so those are sent as immutable. Anything else is
+revalidated with its ETag/Last-Modified.
+
+With `UPLOAD_OFFLOAD` set, only headers are produced and the front proxy
+sends the bytes itself:
+
+* `x-accel-redirect` (nginx): the file must be reachable under the internal
+  location `UPLOAD_ACCEL_PREFIX`;
+* `x-sendfile` (Apache mod_xsendfile, lighttpd): the absolute path is sent.
+
+The proxy then also takes care of byte ranges and conditional requests.
+Otherwise Werkzeug streams the file with range and conditional support.
+
+Images can be negotiated by Accept (`NEGOTIATE_FORMATS`), in which case the
+chosen file is what gets sent or offloaded.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from server.utils.negotiation import negotiable, negotiate
+
+# Python 3.8 does not know the modern image types
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+IMMUTABLE_NAME = re.compile(r"^([0-9a-f]{32}_|[0-9a-f-]{36}_[0-9a-f]{8}_transformed\.)")
+
+
+def cache_control_for(filename):
+    return IMMUTABLE if IMMUTABLE_NAME.match(filename) else REVALIDATE
+
+
+def _negotiated(folder, filename):
+    from server.extensions import pixel_budget
+
+    formats = current_app.config.get("NEGOTIATE_FORMATS", ())
+    quality = current_app.config.get("NEGOTIATE_QUALITY", 80)
+    try:
+        return negotiate(folder, filename, request.accept_mimetypes, formats, quality, pixel_budget)
+    except (OSError, ValueError) as e:
+        current_app.logger.warning("Could not encode an alternate of %s: %s", filename, e)
+        return filename
+
+
+def send_upload(filename, as_attachment=False, folder=None, negotiate_format=False):
+    """Response for a file in UPLOAD_FOLDER. Raises NotFound.
+
+    With `negotiate_format`, a smaller AVIF/WebP copy is sent instead when
+    the client accepts it (see `server.utils.negotiation`)."""
+    folder = folder or current_app.config["UPLOAD_FOLDER"]
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    vary = negotiate_format and negotiable(filename)
+    if vary:
+        filename = _negotiated(folder, filename)
+        path = os.path.join(folder, filename)
+
+    offload = current_app.config.get("UPLOAD_OFFLOAD")
+    if offload == "x-accel-redirect":
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        prefix = current_app.config.get("UPLOAD_ACCEL_PREFIX", "/_uploads/")
+        response.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(filename)
+        if as_attachment:
+            response.headers.set("Content-Disposition", "attachment", filename=os.path.basename(filename))
+    else:
+        use_x_sendfile = offload == "x-sendfile"
+        response = send_file(
+            path,
+            request.environ,
+            as_attachment=as_attachment,
+            use_x_sendfile=use_x_sendfile,
+            response_class=current_app.response_class,
+            conditional=not use_x_sendfile,
+        )
+
+    response.headers["Cache-Control"] = cache_control_for(os.path.basename(filename))
+    if vary:
+        response.vary.add("Accept")
+    return response
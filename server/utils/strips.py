@@ -0,0 +1,255 @@
+"""Memory-bounded pipeline execution in horizontal strips.
+
+`execute_steps` makes a full-size output at every step, and filters and
+resizes make full-size temporaries on top (blur and sharpen a copy, images
+with alpha an RGB copy and an alpha band, a two-pass resize its horizontal
+pass), so a large source needs a multiple of its decoded size.
+`execute_in_strips` instead fills a preallocated output one band of rows at
+a time. For each band it works backwards through the steps to find the
+source region the band depends on (plus resampling or blur margins), then
+runs the steps on just that region. Only the decoded source, the output
+canvas and one band's intermediates are alive at once.
+
+Pillow decodes and encodes whole images, so the source and the canvas stay
+resident and the budget is not a bound on the peak: the band height is
+chosen so the band's intermediates fit in it (and in `BAND_BYTES`). `saves_memory` picks strips
+when that total is below the in-memory peak, which is the case for filter
+chains on large images (a blur needs the source, its output and a copy in
+memory, but only the source, the canvas and a band in strips) and for
+pipelines whose intermediates are larger than both ends.
+
+Crops, flips, mirrors, right-angle rotations, pointwise filters, mode
+conversions and watermarks give the same pixels as `execute_steps`.
+Resizes skip the `reducing_gap` shortcut (its reduction grid would depend on
+the band), so they can differ from the in-memory path by rounding, without
+seams between bands. Arbitrary-angle rotations and background removal need
+the whole image and are not supported here.
+"""
+import math
+
+from PIL import Image as PILImage
+from PIL import ImageDraw, ImageFont
+
+from server.utils.filters import ALPHA_COPIES, apply_filter, get_filter
+from server.utils.pipeline import TRANSPOSE_MATRICES, _sizes
+
+STRIP_OPS = {"resize", "crop", "transpose", "filter", "convert", "watermark"}
+STRIP_MODES = {"L", "LA", "RGB", "RGBA"}
+ALPHA_MODES = {"LA", "RGBA", "PA"}
+BYTES_PER_PIXEL = 4  # Pillow stores every multi-band 8-bit mode in 4 bytes
+# Bands larger than this only add to the peak; per-band margins are small
+# next to the few hundred rows of a wide image it still holds.
+BAND_BYTES = 32 * 1024 * 1024
+
+# Kernel radius of each resampling filter, in source pixels at scale 1.
+RESAMPLE_SUPPORT = {"NEAREST": 0.5, "BOX": 0.5, "BILINEAR": 1.0, "HAMMING": 1.0, "BICUBIC": 2.0, "LANCZOS": 3.0}
+
+
+def image_bytes(size):
+    return size[0] * size[1] * BYTES_PER_PIXEL
+
+
+def temporary_bytes(step, mode, size, output_size):
+    """Scratch memory a step makes besides its output, for an input of
+    `size` in `mode`."""
+    if step["op"] == "filter":
+        copies = get_filter(step["filter"]).copies
+        if mode in ALPHA_MODES:
+            copies += ALPHA_COPIES
+        return int(copies * image_bytes(size))
+    if step["op"] == "resize" and output_size[0] != size[0] and output_size[1] != size[1]:
+        # Horizontal pass first: output width by the rows of the box
+        _, y0, _, y1 = step.get("box") or (0, 0, size[0], size[1])
+        return image_bytes((output_size[0], math.ceil(y1) - math.floor(y0)))
+    return 0
+
+
+def peak_bytes(steps, sizes, mode):
+    """Largest input + output + temporaries held while running steps in
+    memory. `mode` is the source's; later mode changes are not tracked."""
+    if not steps:
+        return image_bytes(sizes[0])
+    return max(
+        image_bytes(a) + image_bytes(b) + temporary_bytes(step, mode, a, b)
+        for step, a, b in zip(steps, sizes, sizes[1:])
+    )
+
+
+def supports_strips(mode, steps):
+    if mode not in STRIP_MODES:
+        return False
+    return all(step["op"] in STRIP_OPS for step in steps)
+
+
+def _clamp(rect, size):
+    x0, y0, x1, y1 = rect
+    x0, y0 = min(max(0, x0), size[0]), min(max(0, y0), size[1])
+    return (x0, y0, max(x0, min(size[0], x1)), max(y0, min(size[1], y1)))
+
+
+def _transpose_offset(matrix, size):
+    w, h = size
+    corners = [(0, 0), (w, 0), (0, h), (w, h)]
+    xs = [matrix[0][0] * x + matrix[0][1] * y for x, y in corners]
+    ys = [matrix[1][0] * x + matrix[1][1] * y for x, y in corners]
+    return -min(xs), -min(ys)
+
+
+def _map_rect(matrix, offset, rect):
+    x0, y0, x1, y1 = rect
+    points = [(x, y) for x in (x0, x1) for y in (y0, y1)]
+    xs = [matrix[0][0] * x + matrix[0][1] * y + offset[0] for x, y in points]
+    ys = [matrix[1][0] * x + matrix[1][1] * y + offset[1] for x, y in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _resize_geometry(step, size):
+    x0, y0, x1, y1 = step.get("box") or (0, 0, size[0], size[1])
+    sx = (x1 - x0) / step["width"]
+    sy = (y1 - y0) / step["height"]
+    support = RESAMPLE_SUPPORT.get(step.get("resample", "BICUBIC"), 3.0)
+    return x0, y0, sx, sy, support
+
+
+def _filter_margin(step):
+    if get_filter(step["filter"]).pointwise:
+        return 0
+    # Pillow's Gaussian is three box blurs; each reaches about one radius.
+    return math.ceil(3 * float(step["options"].get("radius", 2))) + 3
+
+
+def needed_rect(step, size, rect):
+    """Region of the step's input (of `size`) needed to produce `rect` of
+    its output."""
+    op = step["op"]
+    if op == "crop":
+        left, top = step["box"][0], step["box"][1]
+        x0, y0, x1, y1 = rect
+        return _clamp((x0 + left, y0 + top, x1 + left, y1 + top), size)
+    if op == "transpose":
+        if step["method"] is None:
+            return rect
+        matrix = TRANSPOSE_MATRICES[step["method"]]
+        inverse = ((matrix[0][0], matrix[1][0]), (matrix[0][1], matrix[1][1]))
+        ox, oy = _transpose_offset(matrix, size)
+        x0, y0, x1, y1 = rect
+        return _map_rect(inverse, (0, 0), (x0 - ox, y0 - oy, x1 - ox, y1 - oy))
+    if op == "resize":
+        bx, by, sx, sy, support = _resize_geometry(step, size)
+        mx = math.ceil(support * max(sx, 1)) + 2
+        my = math.ceil(support * max(sy, 1)) + 2
+        x0, y0, x1, y1 = rect
+        return _clamp((
+            math.floor(bx + x0 * sx) - mx, math.floor(by + y0 * sy) - my,
+            math.ceil(bx + x1 * sx) + mx, math.ceil(by + y1 * sy) + my,
+        ), size)
+    if op == "filter":
+        margin = _filter_margin(step)
+        x0, y0, x1, y1 = rect
+        return _clamp((x0 - margin, y0 - margin, x1 + margin, y1 + margin), size)
+    return rect
+
+
+def _crop_to(tile, tile_rect, rect):
+    if tuple(tile_rect) == tuple(rect):
+        return tile
+    ox, oy = tile_rect[0], tile_rect[1]
+    return tile.crop((rect[0] - ox, rect[1] - oy, rect[2] - ox, rect[3] - oy))
+
+
+def run_step(step, tile, tile_rect, size, rect):
+    """Apply a step to `tile` (covering `tile_rect` of an input of `size`)
+    and return the part of its output covering `rect`."""
+    op = step["op"]
+    if op == "crop":
+        left, top = step["box"][0], step["box"][1]
+        x0, y0, x1, y1 = rect
+        # Areas past the source edge come out black, as with a full crop.
+        return _crop_to(tile, tile_rect, (x0 + left, y0 + top, x1 + left, y1 + top))
+    if op == "transpose":
+        if step["method"] is None:
+            return tile
+        matrix = TRANSPOSE_MATRICES[step["method"]]
+        turned = tile.transpose(PILImage.Transpose[step["method"]])
+        turned_rect = _map_rect(matrix, _transpose_offset(matrix, size), tile_rect)
+        return _crop_to(turned, turned_rect, rect)
+    if op == "resize":
+        bx, by, sx, sy, _ = _resize_geometry(step, size)
+        x0, y0, x1, y1 = rect
+        if x1 <= x0 or y1 <= y0:
+            # Nothing downstream reads this band (e.g. a later crop runs past
+            # the edge), and Pillow refuses to resize to an empty size.
+            return PILImage.new(tile.mode, (max(0, x1 - x0), max(0, y1 - y0)))
+        tx, ty = tile_rect[0], tile_rect[1]
+        box = (bx + x0 * sx - tx, by + y0 * sy - ty, bx + x1 * sx - tx, by + y1 * sy - ty)
+        resample = PILImage.Resampling[step.get("resample", "BICUBIC")]
+        return tile.resize((x1 - x0, y1 - y0), resample, box=box)
+    if op == "filter":
+        return _crop_to(apply_filter(tile, step["filter"], step["options"]), tile_rect, rect)
+    if op == "convert":
+        return tile.convert(step["mode"])
+    if op == "watermark":
+        tile = tile.copy()
+        draw = ImageDraw.Draw(tile)
+        draw.text((10 - rect[0], 10 - rect[1]), step["text"], fill="white", font=ImageFont.load_default())
+        return tile
+    raise ValueError(f"Step cannot run in strips: {op}")
+
+
+def _band_rects(steps, sizes, rect):
+    rects = [rect]
+    for index in reversed(range(len(steps))):
+        rects.insert(0, needed_rect(steps[index], sizes[index], rects[0]))
+    return rects
+
+
+def _band_bytes(steps, sizes, mode, rows):
+    """Every intermediate of the top band of `rows` rows, plus the largest
+    temporaries any of its steps makes."""
+    rects = _band_rects(steps, sizes, (0, 0, sizes[-1][0], min(sizes[-1][1], rows)))
+    shapes = [(r[2] - r[0], r[3] - r[1]) for r in rects]
+    temporaries = [temporary_bytes(step, mode, a, b) for step, a, b in zip(steps, shapes, shapes[1:])]
+    return sum(image_bytes(shape) for shape in shapes) + max(temporaries, default=0)
+
+
+def strip_rows(steps, sizes, budget, mode="RGB"):
+    """Tallest band whose intermediates fit in `budget` bytes (and
+    `BAND_BYTES`)."""
+    budget = min(budget, BAND_BYTES)
+    rows = sizes[-1][1]
+    while rows > 1 and _band_bytes(steps, sizes, mode, rows) > budget:
+        rows //= 2
+    return max(1, rows)
+
+
+def strip_peak_bytes(steps, sizes, budget, mode="RGB"):
+    """Source, output canvas and the tallest band's intermediates."""
+    band = _band_bytes(steps, sizes, mode, strip_rows(steps, sizes, budget, mode))
+    return image_bytes(sizes[0]) + image_bytes(sizes[-1]) + band
+
+
+def saves_memory(mode, steps, size, budget):
+    """Whether running `steps` in strips beats the in-memory path, given
+    that its estimated peak is over `budget` bytes."""
+    if not budget or not supports_strips(mode, steps):
+        return False
+    sizes = _sizes(steps, size)
+    in_memory = peak_bytes(steps, sizes, mode)
+    return in_memory > budget and strip_peak_bytes(steps, sizes, budget, mode) < in_memory
+
+
+def execute_in_strips(image, steps, budget):
+    sizes = _sizes(steps, image.size)
+    width, height = sizes[-1]
+    rows = strip_rows(steps, sizes, budget, image.mode)
+
+    canvas = None
+    for top in range(0, height, rows):
+        rects = _band_rects(steps, sizes, (0, top, width, min(height, top + rows)))
+        tile = image.crop(rects[0])
+        for index, step in enumerate(steps):
+            tile = run_step(step, tile, rects[index], sizes[index], rects[index + 1])
+        if canvas is None:
+            canvas = PILImage.new(tile.mode, (width, height))
+        canvas.paste(tile, (0, top))
+    return canvas
@@ -0,0 +1,227 @@
+"""Content-addressed cache of rendered transformation results.
+
+Entries are keyed by a hash of the source bytes plus the normalized plan and
+output settings, so identical requests (or equivalent ones such as flip +
+mirror vs. a 180 degree rotation) map to the same rendered file. Files are
+hard-linked in and out of the cache directory, so a hit costs no decoding,
+no encoding and no copy. The directory is kept under a byte budget by
+evicting the least recently used entries. Recency is the access time, set
+explicitly on every hit; the mtime is left alone because a cached file
+shares its inode with the upload it was linked from or to, and other code
+(digest memos, variant freshness) reads that mtime.
+
+Only entries the cache holds the last link to count against the budget and
+are eviction candidates: an entry still linked to a served image takes no
+space of its own, and removing it would free nothing. The total is kept as
+a running figure, seeded by one scan at startup and updated by every store
+and eviction, so writes don't list the directory. Only when the total passes
+the budget is the directory scanned, and then entries are evicted down to
+`EVICT_TO` of the budget, which leaves room for many more stores before the
+next scan. Link counts change outside the cache (a served image is deleted,
+a hit links an entry out) and workers sharing the directory each count only
+their own writes, so the total is also re-read from disk every
+`RESCAN_INTERVAL` seconds.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+CHUNK_SIZE = 1024 * 1024
+EVICT_TO = 0.9  # Share of the budget left after an eviction pass
+RESCAN_INTERVAL = 60  # Seconds between re-reading the total other workers add to
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def file_digest(path, max_entries=1024):
+    """sha256 of a file, memoized on (path, size, mtime)."""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if memo_key in _digests:
+            _digests.move_to_end(memo_key)
+            return _digests[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _digests_lock:
+        _digests[memo_key] = value
+        while len(_digests) > max_entries:
+            _digests.popitem(last=False)
+    return value
+
+
+def remember_digest(path, value, max_entries=1024):
+    """Record a digest computed elsewhere (e.g. while ingesting an upload)."""
+    stat = os.stat(path)
+    with _digests_lock:
+        _digests[(path, stat.st_size, stat.st_mtime_ns)] = value
+        while len(_digests) > max_entries:
+            _digests.popitem(last=False)
+
+
+def _link_or_copy(src, dst):
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _own_bytes(stat):
+    """Bytes removing a file would free: none while another link remains."""
+    return stat.st_size if stat.st_nlink == 1 else 0
+
+
+def _touch(path):
+    """Mark `path` as just used without changing its mtime."""
+    stat = os.stat(path)
+    os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+
+class TransformCache:
+    def __init__(self, app=None):
+        self.folder = None
+        self.max_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total = 0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config.get("TRANSFORM_CACHE_FOLDER") or os.path.join(
+            app.config["UPLOAD_FOLDER"], "cache"
+        )
+        self.max_bytes = app.config.get("TRANSFORM_CACHE_MAX_BYTES", 0)
+        os.makedirs(self.folder, exist_ok=True)
+        self._rescan()
+
+    @property
+    def enabled(self):
+        return self.folder is not None and self.max_bytes > 0
+
+    @staticmethod
+    def key(source_digest, plan):
+        payload = json.dumps(
+            {"source": source_digest, "steps": plan.steps, "output": plan.output},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.folder, f"{key}.{ext}")
+
+    def fetch(self, key, ext, dest):
+        """Materialize a cached result at `dest`. Returns False on a miss."""
+        if not self.enabled:
+            return False
+        path = self._path(key, ext)
+        try:
+            _link_or_copy(path, dest)
+            _touch(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def lookup(self, key, ext):
+        """Path of a cached result, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(key, ext)
+        try:
+            _touch(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, ext, src, move=False):
+        """Add `src` under `key`: hard-linked, or moved in with `move` when
+        the caller has no further use for it."""
+        if not self.enabled:
+            return
+        path = self._path(key, ext)
+        try:
+            replaced = _own_bytes(os.stat(path))
+        except FileNotFoundError:
+            replaced = 0
+        if move:
+            os.replace(src, path)
+        else:
+            _link_or_copy(src, path)
+        _touch(path)
+        with self._lock:
+            self._total += _own_bytes(os.stat(path)) - replaced
+            due = self._total > self.max_bytes or time.monotonic() - self._scanned_at > RESCAN_INTERVAL
+        if due:
+            self.evict()
+
+    def _scan(self):
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                if _own_bytes(stat):
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+        return entries
+
+    def _rescan(self):
+        total = sum(size for _, size, _ in self._scan())
+        with self._lock:
+            self._total = total
+            self._scanned_at = time.monotonic()
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return self._total
+
+    def evict(self):
+        """Re-read the directory and, if it is over budget, remove the least
+        recently used entries until it is down to `EVICT_TO` of it. Entries
+        linked elsewhere are neither counted nor removed."""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            target = self.max_bytes * EVICT_TO
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+        with self._lock:
+            self._total = total
+            self._scanned_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,68 @@
+"""Small per-process cache of authenticated users.
+
+Authenticating a request needs the user row, which used to cost a query on
+every call. `UserCache` keeps a read-only snapshot of recently seen users in
+an LRU bounded by size and age. Updates and deletes made through the ORM in
+this process evict the entry straight away. Other processes pick such
+changes up once the entry's TTL runs out.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Everything but the password hash
+CachedUser = namedtuple("CachedUser", ["id", "username", "email", "is_verified", "created_at"])
+
+
+class UserCache:
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.max_entries = 1024
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from sqlalchemy import event
+        from server.models.user import User
+
+        self.ttl = app.config.get("USER_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("USER_CACHE_SIZE", self.max_entries)
+        for name in ("after_update", "after_delete"):
+            if not event.contains(User, name, self._on_change):
+                event.listen(User, name, self._on_change)
+
+    def _on_change(self, mapper, connection, target):
+        self.invalidate(target.id)
+
+    def get(self, user_id, loader):
+        """Cached snapshot of a user, calling `loader(user_id)` on a miss.
+        Returns None when the user does not exist (misses are not cached)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        user = loader(user_id)
+        if user is None:
+            return None
+        snapshot = CachedUser(user.id, user.username, user.email, user.is_verified, user.created_at)
+        if self.ttl <= 0:
+            return snapshot
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
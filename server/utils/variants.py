@@ -0,0 +1,136 @@
+"""Downscaled variants of stored images for galleries and previews.
+
+Each stored file can have a fixed set of smaller copies (by long edge),
+written next to it as `<stem>_<size>px<ext>`. They are generated together
+from a single decode, largest first, each one resampled from the previous.
+File names in UPLOAD_FOLDER never change content, so neither do variants,
+which lets them be served with far-future caching headers. Variants older
+than their source are rebuilt all the same, as negotiated copies are.
+Files holding identical bytes (deduplicated uploads) can share one set of
+variants through `link_variants` instead of each decoding the source.
+"""
+import os
+import uuid
+
+from PIL import Image as PILImage
+from werkzeug.security import safe_join
+
+from server.utils.negotiation import _fresh, alternate_paths
+from server.utils.transform_cache import _link_or_copy
+
+VARIANT_SIZES = (128, 256, 512, 1024)
+SAVE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+
+def variant_filename(filename, size):
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() not in SAVE_FORMATS:
+        ext = ".png"
+    return f"{stem}_{size}px{ext}"
+
+
+def variant_urls(filename, dimensions=None):
+    long_edge = max(dimensions) if dimensions else None
+    return {
+        str(size): f"/api/images/variants/{size}/{filename}"
+        for size in VARIANT_SIZES
+        if long_edge is None or size < long_edge
+    }
+
+
+def variant_paths(folder, filename):
+    return [os.path.join(folder, variant_filename(filename, size)) for size in VARIANT_SIZES]
+
+
+def _save_atomic(image, path):
+    fmt = SAVE_FORMATS[os.path.splitext(path)[1].lower()]
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp, fmt, quality=85, optimize=True)
+    os.replace(tmp, path)
+
+
+def generate_variants(folder, filename, sizes=VARIANT_SIZES):
+    """Write every variant smaller than the source. Returns their paths."""
+    source = safe_join(folder, filename)
+    written = []
+    with PILImage.open(source) as image:
+        width, height = image.size
+        long_edge = max(width, height)
+        wanted = sorted((s for s in sizes if s < long_edge), reverse=True)
+        if not wanted:
+            return written
+
+        # Let the JPEG decoder skip straight to roughly twice the largest size.
+        scale = wanted[0] / long_edge
+        image.draft(image.mode, (round(width * scale * 2), round(height * scale * 2)))
+        current = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+        for size in wanted:
+            scale = size / long_edge
+            dims = (max(1, round(width * scale)), max(1, round(height * scale)))
+            current = current.resize(dims, PILImage.Resampling.LANCZOS, reducing_gap=3.0)
+            path = os.path.join(folder, variant_filename(filename, size))
+            _save_atomic(current, path)
+            written.append(path)
+    return written
+
+
+def link_variants(folder, source_filename, filename, dimensions, sizes=VARIANT_SIZES):
+    """Link the variants already built for `source_filename` to `filename`,
+    a file with the same bytes and `dimensions`. Returns False, linking
+    nothing, unless every variant the source should have exists."""
+    source = safe_join(folder, source_filename)
+    if source is None:
+        return False
+    wanted = [size for size in sizes if size < max(dimensions)]
+    pairs = [
+        (os.path.join(folder, variant_filename(source_filename, size)), os.path.join(folder, variant_filename(filename, size)))
+        for size in wanted
+    ]
+    if not all(_fresh(path, source) for path, _ in pairs):
+        return False
+    for path, dest in pairs:
+        _link_or_copy(path, dest)
+    return True
+
+
+def ensure_variant(folder, filename, size, budget=None):
+    """Path of the requested variant, generating the set on first use. Falls
+    back to the source itself when it is already that small.
+
+    Generating reserves the source's decoded size from `budget` (a
+    `PixelBudget`) first, so it raises `AdmissionRejected` when there is no
+    room."""
+    source = safe_join(folder, filename)
+    if source is None or size not in VARIANT_SIZES or not os.path.exists(source):
+        return None
+    path = os.path.join(folder, variant_filename(filename, size))
+    if _fresh(path, source):
+        return path
+
+    from server.utils.strips import image_bytes
+
+    with PILImage.open(source) as image:
+        if size >= max(image.size):
+            return source
+        cost = image_bytes(image.size)
+    reservation = budget.reserve(cost) if budget else None
+    try:
+        generate_variants(folder, filename)
+    finally:
+        if reservation:
+            reservation.release()
+    return path
+
+
+def remove_variants(folder, filename):
+    """Remove the size variants and the negotiated format copies of them
+    and of the source."""
+    paths = variant_paths(folder, filename)
+    for path in [os.path.join(folder, filename)] + paths:
+        paths.extend(alternate_paths(*os.path.split(path)))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
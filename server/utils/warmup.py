@@ -0,0 +1,83 @@
+"""Worker warmup before taking traffic.
+
+The first request through each operation pays for lazy work: Pillow plugin
+and codec initialization, font loading, resampling tables and the database
+connection pool. `warmup` runs a small synthetic image through every
+transformation and output format, and opens a database connection, so no
+user request pays for these. Background removal is included only when asked,
+since it builds the rembg model session.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image as PILImage
+from sqlalchemy import text
+
+from server.utils.encoders import FORMAT_EXTENSIONS
+from server.utils.filters import FILTERS
+from server.utils.pipeline import plan_transformations, render_plan
+
+log = logging.getLogger(__name__)
+
+WARMUP_SIZE = (320, 240)
+
+
+def warmup_transformations(remove_bg=False):
+    """One pipeline per operation, filter and output format."""
+    pipelines = [
+        [{"type": "resize", "options": {"width": 160, "height": 120}}],
+        [{"type": "crop", "options": {"left": 10, "top": 10, "right": 200, "bottom": 150}}],
+        [{"type": "rotate", "options": {"angle": 90}}],
+        [{"type": "rotate", "options": {"angle": 30}}],
+        [{"type": "flip"}],
+        [{"type": "mirror"}],
+        [{"type": "watermark", "options": {"text": "Pik-Cha"}}],
+        [{"type": "compress", "options": {"quality": 75}}],
+    ]
+    pipelines += [[{"type": "filter", "options": {"filter": name}}] for name in FILTERS]
+    pipelines += [[{"type": "format", "options": {"format": name}}] for name in sorted(set(FORMAT_EXTENSIONS.values()))]
+    if remove_bg:
+        pipelines.append([{"type": "remove_bg"}])
+    return pipelines
+
+
+def warmup(app, remove_bg=False):
+    """Run every operation once and open a database connection. Returns
+    seconds spent per operation; failures are logged, never raised."""
+    from server.extensions import db
+
+    timings = {}
+    folder = tempfile.mkdtemp(prefix="warmup-")
+    source = os.path.join(folder, "source.png")
+    image = PILImage.radial_gradient("L").resize(WARMUP_SIZE).convert("RGB")
+    image.save(source)
+    try:
+        for transformations in warmup_transformations(remove_bg):
+            options = transformations[0].get("options", {})
+            name = options.get("filter") or options.get("format") or transformations[0]["type"]
+            start = time.perf_counter()
+            try:
+                plan = plan_transformations(transformations, WARMUP_SIZE)
+                dest = os.path.join(folder, f"out.{plan.output['ext']}")
+                render_plan(source, plan, dest)
+                os.remove(dest)
+            except Exception:
+                log.exception("Warmup of %s failed", name)
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                db.session.execute(text("SELECT 1"))
+                db.session.remove()
+        except Exception:
+            log.exception("Warmup database connection failed")
+        timings["database"] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    log.info("Worker %s warmed up in %.2fs", os.getpid(), sum(timings.values()))
+    return timings
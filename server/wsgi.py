@@ -0,0 +1,16 @@
+"""WSGI entry point for production.
+
+    gunicorn -c python:server.gunicorn_conf server.wsgi:app
+
+With gunicorn's `preload_app` this module is imported once in the master
+process, so the app, Pillow and (with `PRELOAD_REMBG`) rembg and
+onnxruntime are loaded before forking and shared copy-on-write by the
+workers. Per-process state (database connections, rembg sessions, process
+pools) is only created after the fork; see `server.gunicorn_conf`.
+"""
+from server.app import app
+from server.extensions import background_remover
+
+if app.config.get("PRELOAD_REMBG"):
+    # Import only: model sessions don't survive a fork
+    background_remover.preload(session=False)
@@ -1,5 +1,6 @@
 import pytest
 from server.config import create_app, db
+from server.extensions import user_cache
 
 
 @pytest.fixture
@@ -10,8 +11,38 @@ def app():
         yield app
         db.session.remove()
         db.drop_all()
+        user_cache.clear()
 
 
 @pytest.fixture
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture
+def image_client(app, tmp_path):
+    """A client for an app with the image routes registered, as server.app
+    does, storing uploads under tmp_path."""
+    from server.extensions import transform_cache
+    from server.routes.image import image_bp
+
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    transform_cache.init_app(app)
+    app.register_blueprint(image_bp, url_prefix="/api/images")
+    return app.test_client()
+
+
+@pytest.fixture
+def user_headers(app):
+    """Create a user and return auth headers for them."""
+    from server.models.user import User
+    from server.utils.jwt_handler import generate_token
+
+    def make(name="owner"):
+        user = User(username=name, email=f"{name}@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+        return {"Authorization": f"Bearer {generate_token(user.id)}"}
+
+    return make
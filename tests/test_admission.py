@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from server.utils.admission import AdmissionRejected, PixelBudget, estimate_plan_bytes
+from server.utils.pipeline import plan_transformations
+
+
+def budget(max_bytes, **config):
+    pixel_budget = PixelBudget()
+    pixel_budget.max_bytes = max_bytes
+    for key, value in config.items():
+        setattr(pixel_budget, key, value)
+    return pixel_budget
+
+
+def test_estimate_counts_every_intermediate():
+    plan = plan_transformations([{"type": "resize", "options": {"width": 50, "height": 40}}], (100, 80))
+    assert estimate_plan_bytes(plan) == (100 * 80 + 50 * 40) * 4
+
+
+def test_requests_wait_for_room_and_time_out():
+    pixel_budget = budget(100, timeout=0.05)
+    held = pixel_budget.reserve(80)
+
+    with pytest.raises(AdmissionRejected):
+        pixel_budget.reserve(30)
+
+    threading.Timer(0.05, held.release).start()
+    with pixel_budget.admit(30, timeout=2):
+        assert pixel_budget.in_use == 30
+    assert pixel_budget.in_use == 0
+
+
+def test_oversized_requests_run_alone(tmp_path):
+    pixel_budget = budget(100, timeout=0.05, state_dir=str(tmp_path))
+
+    with pixel_budget.admit(10_000):
+        assert pixel_budget.stats()["in_use_bytes"] == 100
+        with pytest.raises(AdmissionRejected):
+            pixel_budget.reserve(1)
+    assert pixel_budget.stats()["in_use_bytes"] == 0
+
+
+def test_rejected_async_transforms_give_back_their_reservation(image_client, user_headers, monkeypatch):
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    from server.extensions import job_queue, pixel_budget
+
+    headers = user_headers()
+    buf = BytesIO()
+    PILImage.new("RGB", (120, 90), "red").save(buf, "PNG")
+    upload = image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), "red.png")}, headers=headers)
+    image_id = upload.json["id"]
+
+    monkeypatch.setattr(job_queue, "_slots", threading.Semaphore(0))  # queue full
+    for width in (60, 61, 62):
+        response = image_client.post(f"/api/images/{image_id}/transform", headers=headers, json={
+            "async": True, "transformations": [{"type": "resize", "options": {"width": width, "height": 40}}],
+        })
+        assert response.status_code == 503
+    assert pixel_budget.in_use == 0
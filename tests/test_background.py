@@ -0,0 +1,166 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from server.utils.background import BackgroundRemover
+
+
+class FakeSession:
+    """Records each model run; the mask keeps the left half of the image."""
+
+    def __init__(self, model_name, max_batch=None):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.batches = []
+        self.inner_session = self
+
+    def normalize(self, image, mean, std, size):
+        pixels = np.asarray(image.convert("RGB").resize(size), dtype=np.float32)
+        return {"input.1": pixels.transpose(2, 0, 1)[np.newaxis]}
+
+    def run(self, outputs, feed):
+        batch = feed["input.1"]
+        if self.max_batch and len(batch) > self.max_batch:
+            raise ValueError("Got invalid dimensions for input: input.1")
+        self.batches.append(len(batch))
+        pred = np.zeros((len(batch), 1) + batch.shape[2:], dtype=np.float32)
+        pred[..., : batch.shape[3] // 2] = 1.0
+        return [pred]
+
+
+@pytest.fixture
+def fake_rembg(monkeypatch):
+    """A stand-in rembg module that records the sessions it builds."""
+    module = types.ModuleType("rembg")
+    module.sessions = []
+    module.max_batch = None
+    module.single_calls = 0
+
+    def new_session(model_name):
+        session = FakeSession(model_name, module.max_batch)
+        module.sessions.append((model_name, session))
+        return session
+
+    def remove(image, session=None):
+        assert any(session is built for _, built in module.sessions)
+        module.single_calls += 1
+        return image.convert("LA")
+
+    bg = types.ModuleType("rembg.bg")
+    bg.naive_cutout = lambda image, mask: PILImage.composite(
+        image.convert("RGBA"), PILImage.new("RGBA", image.size, 0), mask
+    )
+
+    module.new_session = new_session
+    module.remove = remove
+    module.bg = bg
+    monkeypatch.setitem(sys.modules, "rembg", module)
+    monkeypatch.setitem(sys.modules, "rembg.bg", bg)
+    return module
+
+
+def test_one_session_per_model_is_reused(fake_rembg):
+    remover = BackgroundRemover()
+    image = PILImage.new("RGB", (8, 8), "red")
+
+    for _ in range(3):
+        assert remover.remove(image).mode == "RGBA"
+    remover.remove(image, model_name="isnet-general-use")
+
+    assert [name for name, _ in fake_rembg.sessions] == ["u2net", "isnet-general-use"]
+    # Single images go through rembg's public remove, not the batch path
+    assert fake_rembg.single_calls == 4
+    assert fake_rembg.sessions[0][1].batches == []
+    assert remover.remove_many([image])[0].mode == "RGBA"
+    assert fake_rembg.single_calls == 5
+
+
+def test_one_session_call_removes_a_batch(fake_rembg):
+    remover = BackgroundRemover()
+    images = [PILImage.new("RGB", size, "red") for size in ((40, 30), (16, 16), (9, 20))]
+
+    cutouts = remover.remove_many(images)
+
+    session = fake_rembg.sessions[0][1]
+    assert session.batches == [3]
+    assert [c.size for c in cutouts] == [i.size for i in images]
+    for cutout in cutouts:
+        assert cutout.mode == "RGBA"
+        assert cutout.getpixel((0, 0))[3] == 255
+        assert cutout.getpixel((cutout.width - 1, 0))[3] == 0
+
+
+def test_models_without_batch_support_run_per_image(fake_rembg):
+    fake_rembg.max_batch = 1  # Exported with a fixed batch dimension
+    remover = BackgroundRemover()
+    images = [PILImage.new("RGB", (8, 8), "red")] * 3
+
+    assert len(remover.remove_many(images)) == 3
+    assert len(remover.remove_many(images)) == 3
+    assert fake_rembg.single_calls == 6  # The failed batch is not retried
+    assert fake_rembg.sessions[0][1].batches == []
+
+    assert len(remover.remove_many(images, model_name="sam")) == 3
+    assert fake_rembg.single_calls == 9
+
+
+def test_batches_fall_back_when_rembg_internals_move(fake_rembg):
+    remover = BackgroundRemover()
+    remover.session().normalize = None  # e.g. renamed in a rembg upgrade
+    images = [PILImage.new("RGB", (8, 8), "red")] * 2
+
+    assert [c.mode for c in remover.remove_many(images)] == ["RGBA", "RGBA"]
+    assert fake_rembg.single_calls == 2
+
+
+def test_render_plans_removes_backgrounds_in_one_run(fake_rembg, tmp_path, monkeypatch):
+    from server.extensions import background_remover
+    from server.utils.pipeline import plan_transformations, render_plans
+
+    monkeypatch.setattr(background_remover, "_sessions", {})
+    calls = []
+    for i, size in enumerate(((60, 40), (30, 30), (50, 20))):
+        source = tmp_path / f"{i}.png"
+        PILImage.new("RGB", size, "red").save(source)
+        plan = plan_transformations(
+            [{"type": "resize", "options": {"width": 20, "height": 20}}, {"type": "remove_bg"}], size,
+        )
+        calls.append((str(source), plan, str(tmp_path / f"{i}_out.png"), None))
+    calls.append((str(tmp_path / "missing.png"), calls[0][1], str(tmp_path / "x.png"), None))
+
+    results = render_plans(calls)
+
+    assert [session.batches for _, session in fake_rembg.sessions] == [[3]]
+    assert [error for _, error in results[:3]] == [None, None, None]
+    assert results[3][0] is None and results[3][1]
+    with PILImage.open(results[0][0]) as out:
+        assert (out.mode, out.size) == ("RGBA", (20, 20))
+
+
+def test_sessions_are_rebuilt_after_a_fork(fake_rembg):
+    remover = BackgroundRemover()
+    first = remover.session()
+    remover._pid = -1  # As seen from a forked child
+
+    assert remover.session() is not first
+    assert remover.session() is remover.session()
+    assert len(fake_rembg.sessions) == 2
+
+
+def test_rembg_is_imported_only_when_needed(app, monkeypatch):
+    monkeypatch.delitem(sys.modules, "rembg", raising=False)
+    app.config["REMBG_MODEL"] = "u2netp"
+    remover = BackgroundRemover(app)
+    assert "rembg" not in sys.modules
+
+    module = types.ModuleType("rembg")
+    module.new_session = lambda model_name: model_name
+    monkeypatch.setitem(sys.modules, "rembg", module)
+    remover.preload(session=False)
+    assert remover._sessions == {}
+
+    remover.preload()
+    assert remover._sessions == {"u2netp": "u2netp"}
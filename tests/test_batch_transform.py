@@ -0,0 +1,111 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image as PILImage
+
+from server.config import db
+from server.extensions import job_queue, pixel_budget
+from server.models.image import Image
+from server.utils.admission import AdmissionRejected
+
+RESIZE = [{"type": "resize", "options": {"width": 20, "height": 15}}]
+
+
+@pytest.fixture
+def batch_client(image_client):
+    job_queue.batch_workers = 2
+    yield image_client
+    job_queue.shutdown()
+
+
+def upload(client, headers, size=(80, 60), name="red.png"):
+    buf = BytesIO()
+    PILImage.new("RGB", size, "red").save(buf, "PNG")
+    return client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), name)}, headers=headers).json
+
+
+def transformed_files(folder):
+    return sorted(name for name in os.listdir(folder) if "_transformed." in name)
+
+
+def batch(client, headers, image_ids, transformations=RESIZE):
+    return client.post("/api/images/batch/transform", headers=headers, json={
+        "image_ids": image_ids, "transformations": transformations,
+    })
+
+
+def test_failed_items_do_not_stop_the_rest(app, batch_client, user_headers):
+    headers = user_headers()
+    good = upload(batch_client, headers)
+    gone = upload(batch_client, headers, size=(40, 40), name="gone.png")
+    os.remove(os.path.join(app.config["UPLOAD_FOLDER"], gone["filename"]))
+
+    response = batch(batch_client, headers, [good["id"], gone["id"], "missing", good["id"]])
+
+    assert response.status_code == 200
+    assert (response.json["succeeded"], response.json["failed"]) == (1, 2)
+    results = response.json["results"]
+    assert [r["id"] for r in results] == [good["id"], gone["id"], "missing"]  # Duplicates collapse
+    assert [r["status"] for r in results] == ["ok", "error", "error"]
+    assert (results[0]["image"]["width"], results[0]["image"]["height"]) == (20, 15)
+    assert results[2]["error"] == "Image not found or unauthorized"
+    assert Image.query.filter(Image.transformed_url.isnot(None)).count() == 1
+
+
+def test_a_failed_commit_rolls_back_every_item(app, batch_client, user_headers, monkeypatch):
+    headers = user_headers()
+    ids = [upload(batch_client, headers, size=(40 + i, 30))["id"] for i in range(3)]
+
+    monkeypatch.setattr(db.session, "commit", lambda: (_ for _ in ()).throw(RuntimeError("database is down")))
+    response = batch(batch_client, headers, ids)
+    monkeypatch.undo()
+
+    assert response.status_code == 200
+    assert response.json["succeeded"] == 0
+    assert all(r["error"] == "database is down" for r in response.json["results"])
+    assert Image.query.filter(Image.transformed_url.isnot(None)).count() == 0
+    assert transformed_files(app.config["UPLOAD_FOLDER"]) == []
+
+
+def test_batches_are_capped(app, batch_client, user_headers):
+    app.config["BATCH_MAX_ITEMS"] = 2
+    headers = user_headers()
+    ids = [upload(batch_client, headers, size=(40 + i, 30))["id"] for i in range(3)]
+
+    response = batch(batch_client, headers, ids)
+
+    assert response.status_code == 400
+    assert response.json["error"] == "A batch can hold at most 2 images"
+    assert transformed_files(app.config["UPLOAD_FOLDER"]) == []
+
+
+def test_rejected_batches_remove_linked_cache_hits(app, batch_client, user_headers, monkeypatch):
+    headers = user_headers()
+    cached = upload(batch_client, headers)
+    fresh = upload(batch_client, headers, size=(50, 40), name="fresh.png")
+    assert batch(batch_client, headers, [cached["id"]]).json["succeeded"] == 1
+    before = transformed_files(app.config["UPLOAD_FOLDER"])
+
+    def admit(cost, timeout=None):
+        raise AdmissionRejected("Server is busy")
+
+    monkeypatch.setattr(pixel_budget, "admit", admit)
+    response = batch(batch_client, headers, [cached["id"], fresh["id"]])
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert transformed_files(app.config["UPLOAD_FOLDER"]) == before
+    assert Image.query.filter(Image.transformed_url.isnot(None)).count() == 1
+
+
+def test_background_removal_is_grouped_per_model_run():
+    from server.routes.image import batch_groups
+    from server.utils.pipeline import plan_transformations
+
+    resize = plan_transformations(RESIZE, (80, 60))
+    remove_bg = plan_transformations([{"type": "remove_bg"}], (80, 60))
+    pending = [(str(i), remove_bg if i % 2 else resize) for i in range(9)]
+
+    assert batch_groups(pending, 2, 8) == [[0], [2], [4], [6], [8], [1, 3], [5, 7]]
+    assert batch_groups(pending, 1, 3) == [[0], [2], [4], [6], [8], [1, 3, 5], [7]]
@@ -0,0 +1,43 @@
+from benchmarks.transforms import OPERATIONS, compare, main, run_suite
+
+
+def test_every_operation_runs_on_every_mode():
+    results = run_suite(list(OPERATIONS), [0.01], ["RGB", "RGBA", "P"], repeat=1)
+
+    assert len(results) == len(OPERATIONS) * 3
+    for name, result in results.items():
+        assert "error" not in result, name
+        assert result["p95_ms"] >= result["p50_ms"] > 0
+
+
+def test_regressions_beyond_the_threshold_fail(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--sizes", "0.01", "--modes", "RGB", "--ops", "resize", "--repeat", "1", "--baseline", str(baseline)]
+    assert main(args + ["--save"]) == 0
+    assert main(args + ["--threshold", "1000"]) == 0
+
+    slower = {"resize/0.01MP/RGB": {"p50_ms": 10.0, "peak_mb": 20.0}}
+    faster = {"resize/0.01MP/RGB": {"p50_ms": 1.0, "peak_mb": 40.0}}
+    assert compare(slower, faster, 0.25) == [("resize/0.01MP/RGB", "p50_ms", 1.0, 10.0)]
+    assert compare(faster, slower, 0.25) == [("resize/0.01MP/RGB", "peak_mb", 20.0, 40.0)]
+
+
+def test_replay_files_skip_lines_that_are_not_requests(tmp_path):
+    from benchmarks.load import Results, load_replay, summarize
+
+    traffic = tmp_path / "traffic.jsonl"
+    traffic.write_text(
+        '{"method": "GET", "path": "/api/images/"}\n'
+        '{"upload": true}\n'
+        '{"request_id": "user-001", "title": "not a request"}\n'
+    )
+    entries, skipped = load_replay(str(traffic))
+    assert [e["path"] for e in entries] == ["/api/images/", "/api/images/"]
+    assert skipped == 1
+
+    results = Results()
+    for status in (200, 200, 500, None):
+        results.record("list", status, 0.01)
+    summary = summarize(results, elapsed=2.0)
+    assert summary["total"]["rps"] == 2.0
+    assert summary["endpoints"]["list"]["error_rate"] == 0.5
@@ -0,0 +1,99 @@
+import os
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from server.models.blob import ImageBlob
+
+
+def png_upload(name):
+    buf = BytesIO()
+    PILImage.new("RGB", (40, 30), "green").save(buf, "PNG")
+    return {"image": (BytesIO(buf.getvalue()), name)}
+
+
+def test_identical_uploads_share_bytes_but_keep_their_own_names(app, image_client, user_headers):
+    alice, bob = user_headers("alice"), user_headers("bob")
+    first = image_client.post("/api/images/", data=png_upload("holiday.png"), headers=alice).json
+    second = image_client.post("/api/images/", data=png_upload("cat.png"), headers=bob).json
+
+    assert first["filename"].endswith("_holiday.png")
+    assert second["filename"].endswith("_cat.png")
+    blob = ImageBlob.query.one()
+    assert blob.ref_count == 2
+    folder = app.config["UPLOAD_FOLDER"]
+    assert os.path.samefile(os.path.join(folder, first["filename"]), os.path.join(folder, second["filename"]))
+
+    assert image_client.delete(f"/api/images/{first['id']}", headers=alice).status_code == 200
+    assert not os.path.exists(os.path.join(folder, first["filename"]))
+    assert ImageBlob.query.one().ref_count == 1
+    download = image_client.get(f"/api/images/download/{second['filename']}")
+    assert download.status_code == 200
+    download.close()
+
+    assert image_client.delete(f"/api/images/{second['id']}", headers=bob).status_code == 200
+    assert ImageBlob.query.count() == 0
+    assert not os.path.exists(os.path.join(folder, blob.filename))
+
+
+def test_deleting_a_user_releases_their_blobs(app, image_client, user_headers):
+    from server.models.user import User
+    from server.routes.user import user_bp
+
+    app.register_blueprint(user_bp, url_prefix="/api/users")
+    alice, bob = user_headers("alice"), user_headers("bob")
+    shared = image_client.post("/api/images/", data=png_upload("a.png"), headers=alice).json
+    image_client.post("/api/images/", data=png_upload("b.png"), headers=bob)
+    buf = BytesIO()
+    PILImage.new("RGB", (20, 20), "blue").save(buf, "PNG")
+    own = image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), "c.png")}, headers=alice).json
+    own_blob = ImageBlob.query.filter(ImageBlob.ref_count == 1).one().filename
+
+    alice_id = User.query.filter_by(username="alice").one().id
+    assert image_client.delete(f"/api/users/{alice_id}").status_code == 204
+
+    folder = app.config["UPLOAD_FOLDER"]
+    assert [blob.ref_count for blob in ImageBlob.query] == [1]
+    assert not os.path.exists(os.path.join(folder, shared["filename"]))
+    assert not os.path.exists(os.path.join(folder, own["filename"]))
+    assert not os.path.exists(os.path.join(folder, own_blob))
+
+
+def test_a_failed_upload_commit_leaves_no_files(app, image_client, user_headers, monkeypatch):
+    from server.config import db
+
+    headers = user_headers()
+    commit = db.session.commit
+
+    def fail_once():
+        monkeypatch.setattr(db.session, "commit", commit)
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(db.session, "commit", fail_once)
+    response = image_client.post("/api/images/", data=png_upload("a.png"), headers=headers)
+
+    assert response.status_code == 400
+    assert ImageBlob.query.count() == 0
+    folder = app.config["UPLOAD_FOLDER"]
+    assert [e.name for e in os.scandir(folder) if e.is_file()] == []
+    assert not os.listdir(os.path.join(folder, "blobs"))
+
+
+def test_duplicate_uploads_share_variants(app, image_client, user_headers):
+    from server.utils.variants import variant_filename
+
+    app.config["VARIANTS_ON_UPLOAD"] = True
+    buf = BytesIO()
+    PILImage.new("RGB", (300, 200), "green").save(buf, "PNG")
+    first, second = (
+        image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), f"{name}.png")}, headers=user_headers(name)).json
+        for name in ("first", "second")
+    )
+
+    folder = app.config["UPLOAD_FOLDER"]
+    for size in (128, 256):
+        assert os.path.samefile(
+            os.path.join(folder, variant_filename(first["filename"], size)),
+            os.path.join(folder, variant_filename(second["filename"], size)),
+        )
+    assert not os.path.exists(os.path.join(folder, variant_filename(second["filename"], 512)))
@@ -0,0 +1,107 @@
+import io
+
+import pytest
+from PIL import Image as PILImage
+
+from server.utils.encoders import SAVE_FORMATS, encode, save_options
+from server.utils.pipeline import plan_transformations, render_plan
+
+
+def sample_image(mode="RGB"):
+    return PILImage.effect_mandelbrot((160, 120), (-2, -1, 1, 1), 60).convert(mode)
+
+
+def encoded(image, **output):
+    buf = io.BytesIO()
+    encode(image, buf, output)
+    buf.seek(0)
+    return buf
+
+
+def test_format_option_picks_extension_and_compress_picks_quality():
+    plan = plan_transformations([
+        {"type": "compress", "options": {"quality": 40}},
+        {"type": "format", "options": {"format": "WEBP", "quality": 99}},
+        {"type": "flip", "options": {"quality": 100}},
+    ], (160, 120))
+    assert plan.output["ext"] == "webp"
+    assert plan.output["quality"] == 40
+
+
+def test_remove_bg_defaults_to_png_unless_format_given():
+    assert plan_transformations([{"type": "remove_bg"}], (10, 10)).output["ext"] == "png"
+    plan = plan_transformations([{"type": "remove_bg"}, {"type": "format", "options": {"format": "webp"}}], (10, 10))
+    assert plan.output["ext"] == "webp"
+
+
+@pytest.mark.parametrize("transformation", [
+    {"type": "format", "options": {"format": "TIFF"}},
+    {"type": "compress", "options": {"quality": 0}},
+    {"type": "compress", "options": {"effort": "extreme"}},
+])
+def test_invalid_encoder_options_are_rejected(transformation):
+    with pytest.raises(ValueError):
+        plan_transformations([transformation], (10, 10))
+
+
+def test_jpeg_is_progressive_and_optimized_by_default():
+    image = PILImage.open(encoded(sample_image(), ext="jpg"))
+    assert image.format == "JPEG"
+    assert image.info.get("progressive")
+
+
+def test_webp_lossless_round_trips_pixels():
+    source = sample_image("RGBA")
+    image = PILImage.open(encoded(source, ext="webp", lossless=True))
+    assert image.format == "WEBP"
+    assert list(image.convert("RGBA").getdata()) == list(source.getdata())
+
+
+def test_effort_trades_size_for_time():
+    source = sample_image()
+    fast = len(encoded(source, ext="png", effort="fast").getvalue())
+    small = len(encoded(source, ext="png", effort="small").getvalue())
+    assert small <= fast
+
+
+def test_small_jpegs_are_smaller_at_the_same_luma_quality():
+    r, g, _ = sample_image().split()
+    source = PILImage.merge("RGB", (r, g.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT), PILImage.linear_gradient("L").resize(r.size)))
+    balanced = encoded(source, ext="jpg", quality=85)
+    small = encoded(source, ext="jpg", quality=85, effort="small")
+
+    assert len(small.getvalue()) < len(balanced.getvalue())
+    small, balanced = PILImage.open(small), PILImage.open(balanced)
+    assert small.quantization[0] == balanced.quantization[0]
+    assert small.info.get("progressive")
+
+
+def test_lossy_formats_take_the_plan_quality():
+    assert save_options("JPEG", {"quality": 55})["quality"] == 55
+    assert "quality" not in save_options("PNG", {"quality": 55})
+
+
+def test_palette_images_are_converted_for_jpeg_and_webp(tmp_path):
+    source = tmp_path / "source.png"
+    sample_image().convert("P").save(source)
+    for fmt in ("JPEG", "WEBP"):
+        plan = plan_transformations([{"type": "format", "options": {"format": fmt}}], (160, 120))
+        dest = tmp_path / f"out.{plan.output['ext']}"
+        render_plan(str(source), plan, str(dest))
+        assert PILImage.open(dest).format == fmt
+
+
+@pytest.mark.skipif("avif" not in SAVE_FORMATS, reason="Pillow was built without AVIF")
+def test_avif_when_available():
+    image = PILImage.open(encoded(sample_image("RGBA"), ext="avif", quality=60))
+    assert image.format == "AVIF"
+
+
+def test_avif_probe_does_not_warn():
+    import warnings
+
+    from server.utils.encoders import _avif_supported
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert _avif_supported() == ("avif" in SAVE_FORMATS)
@@ -0,0 +1,37 @@
+import pytest
+from PIL import Image as PILImage
+
+from server.utils.filters import FILTERS, apply_filter
+
+
+def legacy_sepia(pixel):
+    r, g, b = pixel
+    return (
+        min(255, int(0.393 * r + 0.769 * g + 0.189 * b)),
+        min(255, int(0.349 * r + 0.686 * g + 0.168 * b)),
+        min(255, int(0.272 * r + 0.534 * g + 0.131 * b)),
+    )
+
+
+def test_sepia_matches_legacy_coefficients():
+    image = PILImage.new("RGB", (64, 64))
+    image.putdata([((x * 4) % 256, (y * 4) % 256, (x * y) % 256) for y in range(64) for x in range(64)])
+
+    result = apply_filter(image, "sepia")
+
+    for actual, source in zip(result.getdata(), image.getdata()):
+        expected = legacy_sepia(source)
+        assert all(abs(a - e) <= 1 for a, e in zip(actual, expected))
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_filters_keep_alpha(name):
+    image = PILImage.new("RGBA", (20, 20), (200, 100, 50, 80))
+    result = apply_filter(image, name, {"factor": 1.2})
+    assert result.size == image.size
+    assert result.getchannel("A").getextrema() == (80, 80)
+
+
+def test_unknown_filter_is_rejected():
+    with pytest.raises(ValueError):
+        apply_filter(PILImage.new("RGB", (4, 4)), "vintage")
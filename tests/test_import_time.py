@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds; override with IMPORT_TIME_BUDGET on slow CI machines
+BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 2.0))
+HEAVY = ("rembg", "onnxruntime")
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import server.app
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "heavy": [name for name in {HEAVY!r} if name in sys.modules],
+}}))
+"""
+
+
+def test_app_import_is_fast_and_skips_background_removal(tmp_path):
+    env = dict(
+        os.environ,
+        DATABASE_URL="sqlite:///:memory:",
+        UPLOAD_FOLDER=str(tmp_path / "uploads"),
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=tmp_path, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+
+    assert result["heavy"] == []
+    assert result["seconds"] < BUDGET, f"import server.app took {result['seconds']:.2f}s (budget {BUDGET}s)"
@@ -0,0 +1,147 @@
+import hashlib
+import os
+from io import BytesIO
+
+import pytest
+from flask import request
+from PIL import Image as PILImage
+from werkzeug.datastructures import FileStorage
+
+from server.utils.ingest import IngestError, ingest_upload
+
+
+def upload_of(data, name="photo.png"):
+    return FileStorage(stream=BytesIO(data), filename=name)
+
+
+def png_bytes(size=(40, 30)):
+    buf = BytesIO()
+    PILImage.new("RGB", size, "blue").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_ingest_hashes_sniffs_and_moves_into_place(tmp_path):
+    data = png_bytes()
+    dest = tmp_path / "stored.png"
+
+    ingested = ingest_upload(upload_of(data), str(dest))
+
+    assert ingested.digest == hashlib.sha256(data).hexdigest()
+    assert (ingested.format, ingested.dimensions, ingested.size) == ("PNG", (40, 30), len(data))
+    assert dest.read_bytes() == data
+    assert [p.name for p in tmp_path.iterdir()] == ["stored.png"]
+
+
+@pytest.mark.parametrize("data, max_pixels", [
+    (b"not an image", None),
+    (png_bytes((200, 200)), 100 * 100),
+])
+def test_rejected_uploads_leave_nothing_behind(tmp_path, data, max_pixels):
+    with pytest.raises(IngestError):
+        ingest_upload(upload_of(data), str(tmp_path / "stored.png"), max_pixels)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_only_multi_file_uploads_get_the_batch_body_limit(app, image_client):
+    app.config.update(MAX_CONTENT_LENGTH=100, UPLOAD_BATCH_MAX_BYTES=1000)
+    multipart = "multipart/form-data; boundary=x"
+    with app.test_request_context("/api/images/batch/upload", method="POST", content_type=multipart):
+        assert request.max_content_length == 1000
+    with app.test_request_context("/api/images/", method="POST", content_type=multipart):
+        assert request.max_content_length == 100
+
+
+def test_bytes_past_the_file_limit_are_not_written(tmp_path):
+    from server.utils.ingest import IngestFile
+
+    ingest = IngestFile(str(tmp_path), max_bytes=100)
+    ingest.write(b"x" * 80)
+    ingest.write(b"x" * 80)
+    ingest.flush()
+    assert ingest.oversized
+    assert os.path.getsize(ingest.path) == 80
+    ingest.close()
+
+
+def stored_files(folder):
+    return sorted(p.name for p in folder.iterdir() if p.is_file())
+
+
+def multi_upload(client, headers, files):
+    data = {"images[]": [(BytesIO(body), name) for name, body in files]}
+    return client.post("/api/images/batch/upload", data=data, headers=headers, content_type="multipart/form-data")
+
+
+def test_multi_file_upload_reports_each_file(app, image_client, user_headers, tmp_path):
+    truncated = png_bytes((64, 64))[:-20]
+    response = multi_upload(image_client, user_headers(), [
+        ("good.png", png_bytes()), ("notes.png", b"not an image"), ("cut.png", truncated), ("doc.txt", png_bytes()),
+    ])
+
+    assert response.status_code == 201
+    assert (response.json["uploaded"], response.json["failed"]) == (1, 3)
+    assert [r["status"] for r in response.json["results"]] == ["ok", "error", "error", "error"]
+    assert response.json["results"][2]["error"] == "Uploaded file is corrupt"
+    assert [name.endswith("_good.png") for name in stored_files(tmp_path)] == [True]
+
+
+def test_multi_file_upload_limits_the_file_count(app, image_client, user_headers, tmp_path):
+    app.config["UPLOAD_MAX_FILES"] = 2
+    response = multi_upload(image_client, user_headers(), [(f"{i}.png", png_bytes((10 + i, 10))) for i in range(3)])
+
+    assert response.status_code == 400
+    assert response.json["error"] == "At most 2 files can be uploaded at once"
+    assert stored_files(tmp_path) == []
+
+
+def test_file_parts_past_the_cap_stop_the_parse(app, tmp_path):
+    from server.utils.ingest import IngestRequest
+
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    with app.test_request_context("/", method="POST"):
+        ingest_request = IngestRequest(request.environ)
+        ingest_request._get_file_stream(None, "image/png")
+        with pytest.raises(IngestError):
+            ingest_request._get_file_stream(None, "image/png")  # Single-file views take one part
+        ingest_request.close()
+    assert stored_files(tmp_path) == []
+
+
+def test_multi_file_upload_rolls_back_every_file(app, image_client, user_headers, tmp_path, monkeypatch):
+    from server.config import db
+    from server.models.image import Image
+
+    from server.models.blob import ImageBlob
+
+    headers = user_headers()
+    commit = db.session.commit
+
+    def fail_once():
+        monkeypatch.setattr(db.session, "commit", commit)
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(db.session, "commit", fail_once)
+    response = multi_upload(image_client, headers, [("a.png", png_bytes((10, 10))), ("b.png", png_bytes((20, 10)))])
+
+    assert response.status_code == 400
+    assert response.json["uploaded"] == 0
+    assert all(r["error"] == "database is down" for r in response.json["results"])
+    assert Image.query.count() == 0
+    assert ImageBlob.query.count() == 0
+    assert stored_files(tmp_path) == []
+    assert not any((tmp_path / "blobs").iterdir())
+
+
+def test_single_upload_is_not_read_again(app, image_client, user_headers, monkeypatch):
+    import server.routes.image as image_routes
+
+    verified = []
+    monkeypatch.setattr(image_routes, "verify_upload", verified.append)
+    response = image_client.post(
+        "/api/images/", data={"image": (BytesIO(png_bytes()), "one.png")}, headers=user_headers(),
+    )
+    assert response.status_code == 201
+    assert verified == []
+
+    multi_upload(image_client, user_headers("batch"), [("two.png", png_bytes())])
+    assert len(verified) == 1
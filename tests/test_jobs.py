@@ -0,0 +1,100 @@
+from server.utils.jobs import JobQueue, batch_pool_size
+
+
+def invert(value):
+    return 1 / value
+
+
+def test_run_batch_keeps_order_and_isolates_failures():
+    queue = JobQueue()
+    queue.batch_workers = 2
+    try:
+        results = queue.run_batch(invert, [(1,), (0,), (4,)])
+    finally:
+        queue.shutdown()
+
+    assert results[0] == (1.0, None)
+    assert results[1][0] is None and "division" in results[1][1]
+    assert results[2] == (0.25, None)
+
+
+def test_batch_pools_split_the_cpus_between_web_workers(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    assert batch_pool_size() == 8
+    assert batch_pool_size(4) == 2
+    assert batch_pool_size(8) == batch_pool_size(16) == 1
+
+
+def test_shutdown_cancels_queued_jobs_without_hanging(app):
+    import threading
+    import time
+
+    queue = JobQueue()
+    queue.init_app(app)
+    queue.workers = 1
+    # The pool hands max_workers + 1 calls to its feeder, and more while
+    # each submit records its job, so only the ones well behind are still
+    # cancellable.
+    for _ in range(4):
+        queue.submit(time.sleep, 0.5)
+    waiting = queue.submit(time.sleep, 0)
+
+    stopper = threading.Thread(target=queue.shutdown)
+    stopper.start()
+    stopper.join(timeout=5)
+    assert not stopper.is_alive()
+    assert queue.get(waiting)["status"] == "failed"
+    # Let the running jobs record themselves before the tables are dropped
+    deadline = time.monotonic() + 10
+    while queue.depth and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_async_transforms_are_polled_until_done(image_client, user_headers):
+    import time
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    from server.extensions import job_queue
+
+    headers = user_headers()
+    buf = BytesIO()
+    PILImage.new("RGB", (80, 60), "red").save(buf, "PNG")
+    image_id = image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), "red.png")}, headers=headers).json["id"]
+
+    try:
+        response = image_client.post(f"/api/images/{image_id}/transform", headers=headers, json={
+            "async": True, "transformations": [{"type": "resize", "options": {"width": 40, "height": 30}}],
+        })
+        assert response.status_code == 202
+        status_url = response.headers["Location"]
+        assert image_client.get(status_url, headers=user_headers("other")).status_code == 404
+
+        deadline = time.monotonic() + 30
+        while True:
+            job = image_client.get(status_url, headers=headers).json
+            if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+    finally:
+        job_queue.shutdown()
+
+    assert job["status"] == "done", job["error"]
+    assert (job["result"]["width"], job["result"]["height"]) == (40, 30)
+
+
+def test_job_status_is_readable_from_another_worker(app):
+    # Two queues stand in for two web workers sharing the database
+    accepting, other = JobQueue(), JobQueue()
+    accepting.init_app(app)
+    other.init_app(app)
+    accepting.history = 1
+
+    first = accepting.complete({"width": 40}, owner=7)
+    second = accepting.complete({"width": 20}, owner=7)
+
+    job = other.get(second)
+    assert (job["status"], job["owner"], job["result"]) == ("done", 7, {"width": 20})
+    # Only the newest TRANSFORM_JOB_HISTORY finished jobs are kept
+    assert other.get(first) is None
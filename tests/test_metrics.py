@@ -0,0 +1,45 @@
+import logging
+
+from server.extensions import metrics
+from server.utils.log import SampleFilter
+from server.utils.metrics import Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("demo_seconds", "Demo.", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "decode")
+
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="decode",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="decode",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{stage="decode"} 3' in lines
+
+
+def test_stages_reach_server_timing_and_metrics(app):
+    @app.route("/slow")
+    def slow():
+        with metrics.stage("decode"):
+            pass
+        metrics.record("op-resize", 0.25)
+        return "ok"
+
+    client = app.test_client()
+    timing = client.get("/slow").headers["Server-Timing"]
+    assert timing.startswith("decode;dur=")
+    assert "op-resize;dur=250.0" in timing
+    assert "total;dur=" in timing
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'pikcha_stage_duration_seconds_count{endpoint="slow",stage="op-resize"}' in body
+    assert 'pikcha_request_duration_seconds_count{endpoint="slow",method="GET",status="200"}' in body
+    assert "pikcha_transform_queue_depth 0" in body
+
+
+def test_sampling_keeps_every_warning():
+    sample = SampleFilter(rate=0)
+    record = logging.LogRecord("server", logging.INFO, __file__, 1, "info", None, None)
+    assert not sample.filter(record)
+    record.levelno = logging.WARNING
+    assert sample.filter(record)
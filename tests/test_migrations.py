@@ -0,0 +1,54 @@
+import json
+import os
+
+from flask_migrate import upgrade
+from PIL import Image as PILImage
+from sqlalchemy import text
+
+import server
+from server.config import TestingConfig, create_app, db
+
+MIGRATIONS = os.path.join(os.path.dirname(server.__file__), "migrations")
+
+
+def test_typed_columns_are_backfilled_from_stored_files(tmp_path, monkeypatch):
+    folder = tmp_path / "uploads"
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setattr(TestingConfig, "UPLOAD_FOLDER", str(folder))
+    app = create_app("testing")
+
+    PILImage.new("RGB", (400, 300), "red").save(folder / "a_photo.png")
+    PILImage.new("RGB", (100, 75), "red").save(folder / "1_resized.jpg")
+    original = {"format": "PNG", "mode": "RGB", "size": [400, 300]}
+    rows = [
+        ("1", "a_photo.png", None, original),
+        ("2", "1_resized.jpg", "/uploads/1_resized.jpg", dict(original, width=100, height=75)),
+        ("3", "b_gone.png", None, dict(original, size=[640, 480])),
+    ]
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS, revision="51228aef408b")
+        db.session.execute(text(
+            "INSERT INTO users (id, username, email, password_hash) VALUES (1, 'u', 'u@example.com', 'x')"
+        ))
+        for image_id, filename, transformed_url, metadata in rows:
+            db.session.execute(text(
+                "INSERT INTO images (id, user_id, filename, original_url, transformed_url, image_metadata) "
+                "VALUES (:id, 1, :filename, '/uploads/a_photo.png', :transformed_url, :metadata)"
+            ), {"id": image_id, "filename": filename, "transformed_url": transformed_url, "metadata": json.dumps(metadata)})
+        db.session.commit()
+
+        upgrade(directory=MIGRATIONS, revision="1f89fbede2aa")
+        typed = {row.id: row for row in db.session.execute(text(
+            "SELECT id, width, height, format, file_size, transformation_count FROM images"
+        ))}
+        db.session.remove()
+        db.engine.dispose()
+
+    assert (typed["1"].width, typed["1"].height, typed["1"].format) == (400, 300, "PNG")
+    assert typed["1"].file_size == os.path.getsize(folder / "a_photo.png")
+    assert typed["1"].transformation_count == 0
+    assert (typed["2"].width, typed["2"].height, typed["2"].format) == (100, 75, "JPEG")
+    assert typed["2"].file_size == os.path.getsize(folder / "1_resized.jpg")
+    # Missing files fall back to metadata
+    assert (typed["3"].width, typed["3"].height, typed["3"].file_size) == (640, 480, None)
@@ -0,0 +1,54 @@
+import os
+
+from PIL import Image as PILImage
+
+from server.utils.serving import send_upload
+
+NAME = "c75fc30f4c07443282ef64e0528d933a_photo.jpg"
+WEBP_ONLY = "image/webp,*/*;q=0.8"
+
+
+def photo(folder, name=NAME, quality=95):
+    image = PILImage.effect_mandelbrot((400, 300), (-2, -1, 1, 1), 80).convert("RGB")
+    image.save(os.path.join(folder, name), quality=quality)
+    return name
+
+
+def serve(app, folder, name, accept):
+    app.config.update(UPLOAD_FOLDER=str(folder), NEGOTIATE_FORMATS=["webp"])
+    with app.test_request_context(headers={"Accept": accept}):
+        response = send_upload(name, negotiate_format=True)
+        response.direct_passthrough = False
+        return response
+
+
+def test_webp_is_created_once_and_sent_to_clients_that_accept_it(app, tmp_path):
+    name = photo(tmp_path)
+
+    response = serve(app, tmp_path, name, WEBP_ONLY)
+    assert response.mimetype == "image/webp"
+    assert "Accept" in response.vary
+    assert len(response.get_data()) < os.path.getsize(tmp_path / name)
+    assert os.path.exists(tmp_path / f"{name}.webp")
+
+    response = serve(app, tmp_path, name, "*/*")
+    assert response.mimetype == "image/jpeg"
+    assert "Accept" in response.vary
+
+
+def test_original_is_kept_when_the_copy_is_not_smaller(app, tmp_path):
+    name = photo(tmp_path, quality=5)
+    app.config["NEGOTIATE_QUALITY"] = 100
+
+    assert serve(app, tmp_path, name, WEBP_ONLY).mimetype == "image/jpeg"
+    assert os.path.exists(tmp_path / f"{name}.webp.none")
+    assert not os.path.exists(tmp_path / f"{name}.webp")
+
+
+def test_downloads_are_not_negotiated(app, tmp_path):
+    name = photo(tmp_path)
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    with app.test_request_context(headers={"Accept": WEBP_ONLY}):
+        response = send_upload(name, as_attachment=True)
+    assert response.mimetype == "image/jpeg"
+    assert "Accept" not in response.vary
@@ -0,0 +1,45 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from server.utils.pagination import count_transformations, decode_cursor, encode_cursor, parse_limit
+
+
+def test_cursor_round_trips_the_sort_key():
+    image = SimpleNamespace(created_at=datetime(2024, 5, 1, 12, 30, 15, 250), id="abc-123")
+
+    assert decode_cursor(encode_cursor(image)) == (image.created_at, image.id)
+
+
+def test_bad_cursors_and_limits_are_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    with pytest.raises(ValueError):
+        parse_limit("0")
+    assert parse_limit("100000") == 200
+
+
+def test_transformation_count_ignores_descriptive_keys():
+    assert count_transformations({"size": [10, 10], "mode": "RGB", "width": 5, "filter": "sepia"}) == 2
+    assert count_transformations(None) == 0
+
+
+def test_listing_pages_and_filters_by_kind(image_client, user_headers):
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    headers = user_headers()
+    for color in ("red", "green", "blue"):
+        buf = BytesIO()
+        PILImage.new("RGB", (20, 20), color).save(buf, "PNG")
+        image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), f"{color}.png")}, headers=headers)
+
+    first = image_client.get("/api/images/?limit=2&type=original", headers=headers)
+    cursor = first.headers["X-Next-Cursor"]
+    rest = image_client.get(f"/api/images/?limit=2&type=original&cursor={cursor}", headers=headers)
+    assert len(first.json) == 2 and len(rest.json) == 1
+    assert "X-Next-Cursor" not in rest.headers
+    assert image_client.get("/api/images/?type=transformed", headers=headers).json == []
+    assert image_client.get("/api/images/?type=resize", headers=headers).status_code == 400
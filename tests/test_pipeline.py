@@ -0,0 +1,138 @@
+import pytest
+from PIL import Image as PILImage
+from PIL import ImageChops
+
+from server.utils.pipeline import (
+    apply_step, execute_plan, execute_steps, open_for_plan, plan_transformations,
+    step_output_size,
+)
+
+
+def sample_image():
+    return PILImage.effect_mandelbrot((120, 80), (-2, -1, 1, 1), 40).convert("RGB")
+
+
+def run_unoptimized(image, transformations):
+    plan = plan_transformations(transformations, image.size, optimize=False)
+    for step in plan.steps:
+        image = apply_step(image, step)
+    return image
+
+
+def assert_same_pixels(a, b):
+    assert a.size == b.size
+    assert ImageChops.difference(a.convert("RGB"), b.convert("RGB")).getbbox() is None
+
+
+def test_flip_and_mirror_fuse_into_one_rotation():
+    plan = plan_transformations([{"type": "flip"}, {"type": "mirror"}], (120, 80))
+    assert plan.steps == [{"op": "transpose", "method": "ROTATE_180"}]
+
+
+def test_opposite_rotations_cancel_out():
+    transformations = [
+        {"type": "rotate", "options": {"angle": 90}},
+        {"type": "rotate", "options": {"angle": 270}},
+        {"type": "resize", "options": {"width": 120, "height": 80}},
+    ]
+    assert plan_transformations(transformations, (120, 80)).steps == []
+
+
+@pytest.mark.parametrize("size", [(300, 200), (121, 80), (1, 1), (7, 333)])
+def test_rotated_size_matches_pillow(size):
+    image = PILImage.new("L", size)
+    for angle in [a / 2 for a in range(-720, 721, 3)] + [0.1, 33.3, 89.999, 359.99]:
+        step = {"op": "rotate", "angle": angle}
+        assert step_output_size(step, size) == image.rotate(angle, expand=True).size, angle
+
+
+@pytest.mark.parametrize("transformations", [
+    [
+        {"type": "resize", "options": {"width": 240, "height": 160}},
+        {"type": "crop", "options": {"left": 20, "top": 10, "right": 140, "bottom": 90}},
+    ],
+    [
+        {"type": "filter", "options": {"filter": "grayscale"}},
+        {"type": "crop", "options": {"left": 10, "top": 10, "right": 90, "bottom": 70}},
+    ],
+    [
+        {"type": "filter", "options": {"filter": "sepia"}},
+        {"type": "crop", "options": {"left": 5, "top": 5, "right": 50, "bottom": 60}},
+        {"type": "rotate", "options": {"angle": 90}},
+        {"type": "flip"},
+    ],
+])
+def test_optimized_plan_matches_requested_pipeline(transformations):
+    image = sample_image()
+    plan = plan_transformations(transformations, image.size)
+    assert len(plan.steps) <= len(transformations)
+    assert_same_pixels(execute_plan(image, plan), run_unoptimized(image, transformations))
+
+
+@pytest.mark.parametrize("name", ["grayscale", "invert"])
+def test_filters_are_not_moved_past_a_downscale(name):
+    # Both orders round to 8 bits at different points, so they can differ by a level
+    transformations = [
+        {"type": "filter", "options": {"filter": name}},
+        {"type": "resize", "options": {"width": 200, "height": 150}},
+    ]
+    plan = plan_transformations(transformations, (1200, 900))
+    assert [step["op"] for step in plan.steps] == ["filter", "resize"]
+
+
+def test_crops_after_a_large_downscale_match_with_the_default_preset():
+    image = PILImage.effect_mandelbrot((1200, 900), (-2, -1, 1, 1), 60).convert("RGB")
+    transformations = [
+        {"type": "resize", "options": {"width": 200, "height": 150}},
+        {"type": "crop", "options": {"left": 10, "top": 10, "right": 150, "bottom": 120}},
+    ]
+    result = execute_plan(image, plan_transformations(transformations, image.size))
+    expected = run_unoptimized(image, transformations)
+    assert result.size == expected.size
+    assert max(high for _, high in ImageChops.difference(result, expected).getextrema()) <= 2
+
+
+@pytest.mark.parametrize("mode", ["P", "1"])
+def test_crops_after_a_resize_match_on_nearest_neighbour_modes(mode):
+    image = PILImage.effect_mandelbrot((1200, 900), (-2, -1, 1, 1), 60).convert("RGB")
+    image = image.convert(mode) if mode == "1" else image.quantize(64)
+    transformations = [
+        {"type": "resize", "options": {"width": 700, "height": 500}},
+        {"type": "crop", "options": {"left": 33, "top": 17, "right": 400, "bottom": 300}},
+    ]
+    plan = plan_transformations(transformations, image.size, mode=image.mode)
+    assert [step["op"] for step in plan.steps] == ["resize", "crop"]
+    assert_same_pixels(execute_plan(image, plan), run_unoptimized(image, transformations))
+
+    converted = plan_transformations([{"type": "format", "options": {"format": "JPEG"}}] + transformations, image.size, mode=image.mode)
+    assert [step["op"] for step in converted.steps] == ["convert", "resize"]
+
+
+def test_metadata_describes_requested_steps():
+    plan = plan_transformations([
+        {"type": "flip"},
+        {"type": "mirror"},
+        {"type": "compress", "options": {"quality": 60}},
+    ], (120, 80))
+    assert plan.metadata == {"flipped": True, "mirrored": True, "compressed_quality": 60}
+    assert plan.output["quality"] == 60
+
+
+def test_unknown_transformation_is_rejected():
+    with pytest.raises(ValueError):
+        plan_transformations([{"type": "swirl"}], (10, 10))
+
+
+def test_thumbnail_of_large_jpeg_is_decoded_at_reduced_size(tmp_path):
+    source = str(tmp_path / "large.jpg")
+    PILImage.effect_mandelbrot((1600, 1200), (-2, -1, 1, 1), 40).convert("RGB").save(source)
+    plan = plan_transformations([{"type": "resize", "options": {"width": 100, "height": 75}}], (1600, 1200))
+
+    image, steps = open_for_plan(source, plan)
+    assert image.size[0] < 1600
+    assert execute_steps(image, steps).size == (100, 75)
+
+
+def test_unknown_resample_preset_is_rejected():
+    with pytest.raises(ValueError):
+        plan_transformations([{"type": "resize"}], (10, 10), preset="ultra")
@@ -0,0 +1,50 @@
+import pytest
+
+from server.utils.render import parse_render_query, sign_params, verify_signature
+
+
+def test_query_order_does_not_matter_and_aspect_is_kept():
+    a = parse_render_query({"w": "400", "filter": "grayscale", "fmt": "webp"}, (800, 600))
+    b = parse_render_query({"fmt": "webp", "filter": "grayscale", "w": "400"}, (800, 600))
+
+    assert a == b
+    transformations, output, preset = a
+    assert transformations[0] == {"type": "resize", "options": {"width": 400, "height": 300}}
+    assert output == {"ext": "webp"}
+    assert preset is None
+
+
+@pytest.mark.parametrize("args", [{"bogus": "1"}, {"fmt": "tiff"}, {"q": "0"}, {"crop": "1,2"}])
+def test_invalid_queries_are_rejected(args):
+    with pytest.raises(ValueError):
+        parse_render_query(args, (800, 600))
+
+
+def test_signatures_cover_every_parameter():
+    params = sign_params("secret", "img-1", {"w": "100"}, expires_in=60)
+
+    assert verify_signature("secret", "img-1", {k: str(v) for k, v in params.items()})
+    assert not verify_signature("secret", "img-2", params)
+    assert not verify_signature("other", "img-1", params)
+    assert not verify_signature("secret", "img-1", dict(params, w="101"))
+
+
+def test_render_scales_from_the_transformed_size(image_client, user_headers):
+    from io import BytesIO
+
+    from PIL import Image as PILImage
+
+    headers = user_headers()
+    buf = BytesIO()
+    PILImage.new("RGB", (400, 200), "red").save(buf, "PNG")
+    image_id = image_client.post("/api/images/", data={"image": (BytesIO(buf.getvalue()), "red.png")}, headers=headers).json["id"]
+    response = image_client.post(f"/api/images/{image_id}/transform", headers=headers, json={
+        "transformations": [{"type": "resize", "options": {"width": 100, "height": 300}}],
+    })
+    transformed_id = response.json["id"]
+
+    response = image_client.get(f"/api/images/{transformed_id}/render?w=50&fmt=png", headers=headers)
+
+    assert response.status_code == 200
+    with PILImage.open(BytesIO(response.data)) as rendered:
+        assert rendered.size == (50, 150)
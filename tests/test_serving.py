@@ -0,0 +1,74 @@
+import pytest
+
+from server.utils.serving import IMMUTABLE, REVALIDATE, cache_control_for
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("c75fc30f4c07443282ef64e0528d933a_photo.png", IMMUTABLE),
+    ("c75fc30f4c07443282ef64e0528d933a_photo_256px.png", IMMUTABLE),
+    ("48fb06c3-7f2c-4316-8e08-ae713226aab5_1a2b3c4d_transformed.jpg", IMMUTABLE),
+    ("48fb06c3-7f2c-4316-8e08-ae713226aab5_transformed.jpg", REVALIDATE),
+    ("photo.png", REVALIDATE),
+])
+def test_only_unique_names_are_immutable(filename, expected):
+    assert cache_control_for(filename) == expected
+
+
+NAME = "c75fc30f4c07443282ef64e0528d933a_photo.png"
+
+
+@pytest.fixture
+def stored(app, image_client, tmp_path):
+    from PIL import Image as PILImage
+
+    PILImage.effect_mandelbrot((64, 48), (-2, -1, 1, 1), 30).convert("RGB").save(tmp_path / NAME)
+    return tmp_path / NAME
+
+
+def test_files_are_sent_with_ranges(image_client, stored):
+    data = stored.read_bytes()
+    response = image_client.get(f"/api/images/download/{NAME}", headers={"Range": "bytes=10-19"})
+
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+    assert response.data == data[10:20]
+    assert response.headers["Cache-Control"] == IMMUTABLE
+
+
+def test_unchanged_files_are_not_sent_again(image_client, stored):
+    first = image_client.get(f"/api/images/download/{NAME}")
+    etag, last_modified = first.headers["ETag"], first.headers["Last-Modified"]
+    first.close()
+
+    by_etag = image_client.get(f"/api/images/download/{NAME}", headers={"If-None-Match": etag})
+    by_date = image_client.get(f"/api/images/download/{NAME}", headers={"If-Modified-Since": last_modified})
+    assert (by_etag.status_code, by_date.status_code) == (304, 304)
+    assert by_etag.data == by_date.data == b""
+
+    changed = image_client.get(f"/api/images/download/{NAME}", headers={"If-None-Match": '"stale"'})
+    assert changed.status_code == 200
+    changed.close()
+
+
+def test_nginx_offload_sends_only_headers(app, image_client, stored):
+    app.config.update(UPLOAD_OFFLOAD="x-accel-redirect", UPLOAD_ACCEL_PREFIX="/_uploads/")
+    response = image_client.get(f"/api/images/download/{NAME}")
+
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == f"/_uploads/{NAME}"
+    assert response.mimetype == "image/png"
+    assert response.headers["Cache-Control"] == IMMUTABLE
+    assert response.data == b""
+
+
+def test_sendfile_offload_sends_the_absolute_path(app, image_client, stored):
+    app.config["UPLOAD_OFFLOAD"] = "x-sendfile"
+    response = image_client.get(f"/api/images/download/{NAME}")
+
+    assert response.status_code == 200
+    assert response.headers["X-Sendfile"] == str(stored)
+    assert response.data == b""
+
+
+def test_missing_files_are_not_found(image_client, stored):
+    assert image_client.get("/api/images/download/nothing.png").status_code == 404
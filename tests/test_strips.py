@@ -0,0 +1,125 @@
+import pytest
+from PIL import Image as PILImage
+from PIL import ImageChops, ImageStat
+
+from server.utils.pipeline import execute_steps, plan_transformations, render_plan
+from server.utils.strips import (
+    BAND_BYTES, execute_in_strips, image_bytes, peak_bytes, saves_memory, strip_peak_bytes, supports_strips,
+)
+
+BUDGET = 16 * 1024  # A few rows per band for a 120x80 image
+
+
+def sample_image():
+    return PILImage.effect_mandelbrot((120, 80), (-2, -1, 1, 1), 40).convert("RGB")
+
+
+@pytest.mark.parametrize("transformations", [
+    [{"type": "crop", "options": {"left": -5, "top": 10, "right": 100, "bottom": 90}}],
+    [{"type": "rotate", "options": {"angle": 90}}, {"type": "flip"}],
+    [{"type": "filter", "options": {"filter": "sepia"}}, {"type": "mirror"}],
+    [{"type": "filter", "options": {"filter": "blur", "radius": 2}}],
+    [{"type": "watermark", "options": {"text": "Pik-Cha"}}],
+])
+def test_strips_match_in_memory_execution(transformations):
+    image = sample_image()
+    plan = plan_transformations(transformations, image.size)
+
+    expected = execute_steps(image.copy(), plan.steps)
+    actual = execute_in_strips(image.copy(), plan.steps, BUDGET)
+
+    assert actual.size == expected.size
+    assert ImageChops.difference(actual, expected).getbbox() is None
+
+
+def test_resized_strips_only_differ_by_rounding():
+    image = sample_image()
+    plan = plan_transformations([{"type": "resize", "options": {"width": 70, "height": 45}}], image.size, preset="best")
+
+    expected = execute_steps(image.copy(), plan.steps)
+    actual = execute_in_strips(image.copy(), plan.steps, BUDGET)
+
+    assert max(high for _, high in ImageStat.Stat(ImageChops.difference(actual, expected)).extrema) <= 2
+
+
+def test_whole_image_steps_are_not_split():
+    plan = plan_transformations([{"type": "rotate", "options": {"angle": 30}}], (120, 80))
+    assert not supports_strips("RGB", plan.steps)
+    assert not supports_strips("P", [])
+
+
+def test_bands_cut_away_by_a_later_crop_are_left_blank():
+    image = PILImage.effect_mandelbrot((300, 200), (-2, -1, 1, 1), 40).convert("RGB")
+    plan = plan_transformations([
+        {"type": "resize", "options": {"width": 280, "height": 41}},
+        {"type": "rotate", "options": {"angle": 90}},
+        {"type": "crop", "options": {"left": 43, "top": 1, "right": 167, "bottom": 116}},
+    ], image.size, preset="best")
+
+    expected = execute_steps(image.copy(), plan.steps)
+    actual = execute_in_strips(image.copy(), plan.steps, 20000)
+
+    assert actual.size == expected.size
+    assert ImageChops.difference(actual, expected).getbbox() is None
+
+
+def test_strips_are_only_used_when_they_peak_lower(tmp_path):
+    source = tmp_path / "source.png"
+    sample_image().save(source)
+    # Pointwise filters that write straight into their output gain nothing
+    invert = plan_transformations([{"type": "filter", "options": {"filter": "invert"}}], (120, 80))
+    # A large intermediate that is scaled back down
+    upscale = plan_transformations([
+        {"type": "resize", "options": {"width": 1200, "height": 800}},
+        {"type": "filter", "options": {"filter": "blur", "radius": 2}},
+        {"type": "resize", "options": {"width": 120, "height": 80}},
+    ], (120, 80))
+    assert not saves_memory("RGB", invert.steps, (120, 80), BUDGET)
+    assert saves_memory("RGB", upscale.steps, (120, 80), BUDGET)
+    assert not saves_memory("RGB", upscale.steps, (120, 80), 0)
+
+    stages = []
+    for plan in (invert, upscale):
+        render_plan(str(source), plan, str(tmp_path / "out.png"), BUDGET, timer=lambda name, _: stages.append(name))
+    assert stages.count("strips") == 1
+    assert "op-invert" in stages
+
+
+@pytest.mark.parametrize("transformations", [
+    [{"type": "filter", "options": {"filter": "blur", "radius": 2}}],
+    [{"type": "flip"}, {"type": "filter", "options": {"filter": "sharpen"}}],
+    [{"type": "crop", "options": {"left": 100, "top": 100, "right": 9000, "bottom": 8000}},
+     {"type": "filter", "options": {"filter": "blur", "radius": 2}}],
+    [{"type": "resize", "options": {"width": 5000, "height": 4000}},
+     {"type": "filter", "options": {"filter": "blur", "radius": 2}}],
+])
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_filter_chains_on_large_images_run_in_strips(transformations, mode):
+    size = (10000, 8000)  # 80 MP
+    budget = 256 * 1024 * 1024
+    plan = plan_transformations(transformations, size)
+    sizes = plan.sizes
+
+    assert saves_memory(mode, plan.steps, size, budget)
+    ends = image_bytes(sizes[0]) + image_bytes(sizes[-1])
+    # Temporaries count towards the in-memory peak; strips add one band to the ends
+    assert peak_bytes(plan.steps, sizes, mode) > ends
+    assert strip_peak_bytes(plan.steps, sizes, budget, mode) - ends <= BAND_BYTES
+
+
+def test_strips_render_a_same_size_filter_chain(tmp_path):
+    source = tmp_path / "source.png"
+    sample_image().save(source)
+    plan = plan_transformations([
+        {"type": "filter", "options": {"filter": "sepia"}},
+        {"type": "filter", "options": {"filter": "blur", "radius": 2}},
+        {"type": "format", "options": {"format": "PNG"}},
+    ], (120, 80))
+    stages = []
+
+    render_plan(str(source), plan, str(tmp_path / "out.png"), BUDGET, timer=lambda name, _: stages.append(name))
+
+    assert "strips" in stages
+    with PILImage.open(tmp_path / "out.png") as rendered:
+        expected = execute_steps(sample_image(), plan.steps)
+        assert ImageChops.difference(rendered.convert("RGB"), expected).getbbox() is None
@@ -0,0 +1,98 @@
+import os
+from collections import namedtuple
+
+from flask import Flask
+
+from server.utils.transform_cache import TransformCache, file_digest
+
+FakePlan = namedtuple("FakePlan", ["steps", "output"])
+
+
+def make_cache(tmp_path, max_bytes=1024):
+    app = Flask(__name__)
+    app.config.update(UPLOAD_FOLDER=str(tmp_path), TRANSFORM_CACHE_MAX_BYTES=max_bytes)
+    return TransformCache(app)
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_fetch_after_store_is_a_hit(tmp_path):
+    cache = make_cache(tmp_path)
+    source = write(tmp_path / "source.png", b"source")
+    key = cache.key(file_digest(source), FakePlan([{"op": "transpose"}], {"ext": "jpg"}))
+
+    assert not cache.fetch(key, "jpg", str(tmp_path / "first.jpg"))
+    cache.store(key, "jpg", write(tmp_path / "first.jpg", b"rendered"))
+
+    assert cache.fetch(key, "jpg", str(tmp_path / "second.jpg"))
+    assert (tmp_path / "second.jpg").read_bytes() == b"rendered"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for index in range(3):
+        cache.store(f"key{index}", "jpg", write(tmp_path / f"out{index}.jpg", b"x" * 100), move=True)
+        os.utime(os.path.join(cache.folder, f"key{index}.jpg"), (index, index))
+    cache.evict()
+
+    assert sorted(os.listdir(cache.folder)) == ["key1.jpg", "key2.jpg"]
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_hits_refresh_recency_without_touching_the_shared_mtime(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for index in range(2):
+        cache.store(f"key{index}", "jpg", write(tmp_path / f"out{index}.jpg", b"x" * 100))
+        os.utime(os.path.join(cache.folder, f"key{index}.jpg"), (index, index))
+
+    assert cache.fetch("key0", "jpg", str(tmp_path / "copy.jpg"))
+    assert os.stat(tmp_path / "copy.jpg").st_mtime == 0
+    assert os.stat(tmp_path / "out0.jpg").st_mtime == 0
+
+    for name in ("out0.jpg", "out1.jpg", "copy.jpg"):  # Only the cache holds them now
+        os.remove(tmp_path / name)
+    cache.store("key2", "jpg", write(tmp_path / "out2.jpg", b"x" * 100), move=True)
+    cache.evict()  # The periodic rescan notices the dropped links
+    assert sorted(os.listdir(cache.folder)) == ["key0.jpg", "key2.jpg"]
+
+
+def test_stores_under_the_cap_do_not_scan_the_folder(tmp_path, monkeypatch):
+    import server.utils.transform_cache as transform_cache
+
+    (tmp_path / "cache").mkdir()
+    write(tmp_path / "cache" / "old.png", b"x" * 100)
+    cache = make_cache(tmp_path, max_bytes=250)
+    assert cache.total_bytes == 100
+
+    real_scandir = os.scandir
+    scans = []
+    monkeypatch.setattr(transform_cache.os, "scandir", lambda path: scans.append(path) or real_scandir(path))
+    cache.store("a", "png", write(tmp_path / "a.png", b"x" * 100), move=True)
+    cache.store("a", "png", write(tmp_path / "a2.png", b"x" * 120), move=True)  # Replacing counts the difference
+    assert (scans, cache.total_bytes) == ([], 220)
+
+    cache.store("b", "png", write(tmp_path / "b.png", b"x" * 100), move=True)
+    assert len(scans) == 1
+    assert cache.total_bytes <= 250 * transform_cache.EVICT_TO
+    assert cache.total_bytes == sum(e.stat().st_size for e in real_scandir(cache.folder))
+
+
+def test_entries_linked_to_served_files_do_not_count(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=250)
+    for index in range(5):
+        # The first two stay linked to their outputs, as after a transform
+        cache.store(f"key{index}", "jpg", write(tmp_path / f"out{index}.jpg", b"x" * 100), move=index >= 2)
+        os.utime(os.path.join(cache.folder, f"key{index}.jpg"), (index, index))
+
+    # Evicting a linked entry would free nothing, so only owned ones went
+    assert sorted(os.listdir(cache.folder)) == ["key0.jpg", "key1.jpg", "key3.jpg", "key4.jpg"]
+    assert cache.total_bytes == 200
+
+    os.remove(tmp_path / "out0.jpg")  # The transformed image is deleted
+    cache.evict()
+    assert sorted(os.listdir(cache.folder)) == ["key1.jpg", "key3.jpg", "key4.jpg"]
+    assert cache.total_bytes == 200
@@ -0,0 +1,32 @@
+from server.config import db
+from server.extensions import user_cache
+from server.models.user import User
+
+
+def make_user(username="alice"):
+    user = User(username=username, email=f"{username}@example.com")
+    user.set_password("secret1")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_users_are_loaded_once_and_evicted_on_change(app):
+    user = make_user()
+    calls = []
+
+    def loader(user_id):
+        calls.append(user_id)
+        return db.session.get(User, user_id)
+
+    assert user_cache.get(user.id, loader).username == "alice"
+    assert user_cache.get(user.id, loader).username == "alice"
+    assert calls == [user.id]
+
+    user.username = "alicia"
+    db.session.commit()
+    assert user_cache.get(user.id, loader).username == "alicia"
+
+    db.session.delete(user)
+    db.session.commit()
+    assert user_cache.get(user.id, loader) is None
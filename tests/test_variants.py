@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from PIL import Image as PILImage
+
+from server.utils.admission import AdmissionRejected, PixelBudget
+from server.utils import variants
+from server.utils.variants import ensure_variant, variant_filename
+
+
+def stored(folder, name="photo.png", size=(600, 400), color="red"):
+    PILImage.new("RGB", size, color).save(folder / name)
+    return name
+
+
+def test_variants_are_built_once_then_served(tmp_path, monkeypatch):
+    name = stored(tmp_path)
+
+    path = ensure_variant(str(tmp_path), name, 256)
+    assert path == str(tmp_path / variant_filename(name, 256))
+    with PILImage.open(path) as image:
+        assert image.size == (256, 171)
+
+    monkeypatch.setattr(variants, "generate_variants", pytest.fail)
+    assert ensure_variant(str(tmp_path), name, 256) == path
+    assert ensure_variant(str(tmp_path), name, 1024) == str(tmp_path / name)  # Source is already smaller
+    assert ensure_variant(str(tmp_path), name, 300) is None
+    assert ensure_variant(str(tmp_path), "missing.png", 256) is None
+
+
+def test_variants_older_than_their_source_are_rebuilt(tmp_path):
+    name = stored(tmp_path)
+    path = ensure_variant(str(tmp_path), name, 128)
+    os.utime(path, (0, 0))
+    stored(tmp_path, name, color="blue")
+
+    assert ensure_variant(str(tmp_path), name, 128) == path
+    with PILImage.open(path) as image:
+        assert image.convert("RGB").getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_building_variants_waits_for_pixel_budget(tmp_path):
+    name = stored(tmp_path)
+    pixel_budget = PixelBudget()
+    pixel_budget.max_bytes, pixel_budget.timeout = 600 * 400 * 4, 0.01
+
+    held = pixel_budget.reserve(1)
+    with pytest.raises(AdmissionRejected):
+        ensure_variant(str(tmp_path), name, 256, pixel_budget)
+    assert not os.path.exists(tmp_path / variant_filename(name, 256))
+
+    held.release()
+    assert ensure_variant(str(tmp_path), name, 256, pixel_budget)
+    assert pixel_budget.in_use == 0
+
+
+def test_variant_route_answers_busy_when_there_is_no_room(image_client, tmp_path, monkeypatch):
+    from server.extensions import pixel_budget
+
+    name = stored(tmp_path)
+    monkeypatch.setattr(pixel_budget, "max_bytes", 1)
+    monkeypatch.setattr(pixel_budget, "timeout", 0.01)
+    held = pixel_budget.reserve(1)
+    try:
+        response = image_client.get(f"/api/images/variants/256/{name}")
+    finally:
+        held.release()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert image_client.get(f"/api/images/variants/256/{name}").status_code == 200
+
+
+def test_only_real_variants_are_cached_forever(image_client, tmp_path):
+    from server.utils.serving import IMMUTABLE, REVALIDATE
+
+    name = stored(tmp_path, "c75fc30f4c07443282ef64e0528d933a_photo.png")
+
+    variant = image_client.get(f"/api/images/variants/256/{name}")
+    fallback = image_client.get(f"/api/images/variants/1024/{name}")  # Source is smaller
+
+    assert variant.headers["Cache-Control"] == IMMUTABLE
+    assert fallback.status_code == 200
+    assert fallback.headers["Cache-Control"] == REVALIDATE
+    variant.close()
+    fallback.close()
+
+
+def test_transformed_rows_only_advertise_smaller_sizes():
+    from server.models.image import Image
+    from server.schemas.image_schema import image_schema
+
+    row = Image(filename="1_ab_transformed.jpg", transformed_url="/uploads/1_ab_transformed.jpg", width=300, height=200)
+    assert sorted(image_schema.get_variants(row), key=int) == ["128", "256"]
+    assert len(image_schema.get_variants(Image(filename="old_transformed.jpg", transformed_url="/uploads/x"))) == 4
@@ -0,0 +1,11 @@
+from server.utils.filters import FILTERS
+from server.utils.warmup import warmup, warmup_transformations
+
+
+def test_warmup_covers_every_operation(app):
+    types = {t["type"] for pipeline in warmup_transformations() for t in pipeline}
+    assert types == {"resize", "crop", "rotate", "flip", "mirror", "watermark", "compress", "filter", "format"}
+
+    timings = warmup(app)
+    assert set(FILTERS) <= set(timings)
+    assert {"jpg", "png", "webp", "database"} <= set(timings)